@@ -41,6 +41,34 @@ class AppConfig:
         log_level (str): Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
         log_file (str): Path to the log file for application logging
         supported_formats (tuple): Tuple of supported image file extensions
+        detector_backend (str): Detector used by the API ("auto", "cnn", "lightweight" or "stub")
+        cnn_model_path (str): Path to a trained Keras model for the CNN detector
+        stub_latency_ms (float): Per-image delay of the "stub" detector used in load tests
+        inference_workers (int): Number of threads running detector inference
+        batch_size (int): Images per batched forward pass on the batch endpoint
+        max_batch_images (int): Maximum images accepted in one batch request
+        max_upload_bytes (int): Maximum size of a single uploaded image
+        max_batch_upload_bytes (int): Maximum request body for batch uploads
+        upload_spool_bytes (int): Upload size kept in RAM before spooling to disk
+        job_db_path (str): SQLite file backing the asynchronous job queue
+        job_workers (int): Number of workers processing queued jobs
+        job_max_attempts (int): Attempts per job before it is marked failed
+        job_ttl_seconds (int): How long jobs and their results are kept
+        result_cache_size (int): Analysis results cached by image content hash
+        stream_smoothing_alpha (float): Weight of the newest frame in live camera smoothing, 0 < alpha <= 1
+        max_in_flight (int): Analysis requests running at once per process (pre-fork: per worker)
+        max_queued_requests (int): Requests allowed to wait before 429 is returned, per process
+        request_timeout_seconds (float): Deadline per analysis request once uploaded, queueing included
+        degrade_after_seconds (float): Overload duration before falling back to the cheap path
+        degraded_image_side (int): Longest image side analysed on the degraded path
+        plant_id_routing (bool): Race the local detector against Plant.id per image (hedged_router.py)
+        routing_confidence_threshold (float): Confidence (0-1) that settles the local/Plant.id race
+        llm_threads (int): llama.cpp threads for the local LLM (0 = physical cores)
+        llm_batch_size (int): llama.cpp prompt batch size (0 = chosen from free RAM)
+        llm_context (int): Context window of the local LLM in tokens
+        llm_gpu_layers (int): Layers offloaded to a GPU (-1 = all)
+        llm_use_mlock (bool): Lock the local LLM in RAM when it fits
+        llm_profile_path (str): Where gguf_loader.py --benchmark saves its settings
 
     Example:
         >>> # Create config from environment variables
@@ -69,8 +97,60 @@ class AppConfig:
     # Supported image formats
     supported_formats: tuple = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
 
+    # API Inference Configuration
+    # "auto" uses the CNN when cnn_model_path exists, else the lightweight detector
+    detector_backend: str = "auto"
+    cnn_model_path: Optional[str] = None  # Trained Keras model for RealDiseaseDetector
+    stub_latency_ms: float = 50.0  # Simulated model time for load tests
+    inference_workers: int = 2  # Size of the detector thread pool
+    batch_size: int = 16  # Images per forward pass for batch requests
+    max_batch_images: int = 200  # Upper bound on images in one batch request
+
+    # Upload Limits
+    max_upload_bytes: int = 10 * 1024 * 1024  # Per image (10 MB)
+    max_batch_upload_bytes: int = 200 * 1024 * 1024  # Whole batch request (200 MB)
+    upload_spool_bytes: int = 1024 * 1024  # In-memory part of each upload (1 MB)
+
+    # Asynchronous Job Queue
+    job_db_path: str = "jobs.sqlite3"  # Persistent queue and result storage
+    job_workers: int = 2  # Concurrent job workers
+    job_max_attempts: int = 3  # Retries before a job is marked failed
+    job_ttl_seconds: int = 24 * 3600  # Jobs and results expire after a day
+    result_cache_size: int = 1024  # Results kept for ETag / hash lookups
+    stream_smoothing_alpha: float = 0.4  # Live camera: newest frame weight (0 < alpha <= 1)
+
+    # Admission Control
+    max_in_flight: int = 4  # Concurrent analysis requests per process (pre-fork: per worker)
+    max_queued_requests: int = 32  # Waiting requests before answering 429, per process
+    request_timeout_seconds: float = 15.0  # Deadline from admission to response
+    degrade_after_seconds: float = 5.0  # Sustained overload before degrading
+    degraded_image_side: int = 256  # Max side (px) of images on the degraded path
+
+    # Local / Plant.id Routing (needs PLANT_ID_API_KEY)
+    plant_id_routing: bool = False  # Ask Plant.id too when the local detector is unsure
+    routing_confidence_threshold: float = 0.8  # Local confidence (0-1) that skips Plant.id
+
+    # Local LLM (GGUF) Loading
+    llm_threads: int = 0  # 0 = one per physical core
+    llm_batch_size: int = 0  # 0 = 512, or less when RAM is tight
+    llm_context: int = 2048  # Tokens of context
+    llm_gpu_layers: int = -1  # Ignored by CPU-only llama.cpp builds
+    llm_use_mlock: bool = False  # Only honoured if the model fits in available RAM
+    llm_profile_path: str = os.path.join("models", "Sinong", "load_profile.json")  # Benchmarked settings
+
+    def __post_init__(self):
+        """
+        Reject settings that would only fail later, mid-request.
+
+        Raises:
+            ValueError: If stream_smoothing_alpha is not in (0, 1]
+        """
+        if not 0 < self.stream_smoothing_alpha <= 1:
+            raise ValueError(
+                f"STREAM_SMOOTHING_ALPHA must be in (0, 1], got {self.stream_smoothing_alpha}")
+
     @classmethod
-    def from_env(cls) -> 'AppConfig':
+    def from_env(cls, require_api_key: bool = True) -> 'AppConfig':
         """
         Create configuration instance from environment variables.
 
@@ -85,12 +165,44 @@ class AppConfig:
             MAX_COMPLETION_TOKENS (optional): Override default max tokens
             LOG_LEVEL (optional): Override default logging level
             LOG_FILE (optional): Override default log file path
+            DETECTOR_BACKEND (optional): Override default detector backend
+            CNN_MODEL_PATH (optional): Path to a trained CNN model
+            STUB_LATENCY_MS (optional): Override default stub detector latency
+            INFERENCE_WORKERS (optional): Override default inference thread count
+            BATCH_SIZE (optional): Override default inference batch size
+            MAX_BATCH_IMAGES (optional): Override default batch request limit
+            MAX_UPLOAD_BYTES (optional): Override default per-image size limit
+            MAX_BATCH_UPLOAD_BYTES (optional): Override default batch body limit
+            UPLOAD_SPOOL_BYTES (optional): Override default in-memory spool size
+            JOB_DB_PATH (optional): Override default job queue database path
+            JOB_WORKERS (optional): Override default job worker count
+            JOB_MAX_ATTEMPTS (optional): Override default job retry limit
+            JOB_TTL_SECONDS (optional): Override default job retention
+            RESULT_CACHE_SIZE (optional): Override default result cache size
+            STREAM_SMOOTHING_ALPHA (optional): Override default frame smoothing
+            MAX_IN_FLIGHT (optional): Override default concurrent request limit (per worker)
+            MAX_QUEUED_REQUESTS (optional): Override default waiting request limit (per worker)
+            REQUEST_TIMEOUT_SECONDS (optional): Override default request deadline
+            DEGRADE_AFTER_SECONDS (optional): Override default overload grace period
+            DEGRADED_IMAGE_SIDE (optional): Override default degraded image size
+            PLANT_ID_ROUTING (optional): "1"/"true" to also ask Plant.id for unsure images
+            ROUTING_CONFIDENCE_THRESHOLD (optional): Override default routing threshold
+            LLM_THREADS (optional): Override automatic local LLM thread count
+            LLM_BATCH_SIZE (optional): Override automatic local LLM batch size
+            LLM_CONTEXT (optional): Override default local LLM context window
+            LLM_GPU_LAYERS (optional): Override default GPU offload
+            LLM_USE_MLOCK (optional): "1"/"true" to lock the local LLM in RAM
+            LLM_PROFILE_PATH (optional): Override default benchmark settings file
+
+        Args:
+            require_api_key (bool): Raise if GROQ_API_KEY is missing. Services
+                that never call Groq (such as the FastAPI backend) pass False.
 
         Returns:
             AppConfig: Configured instance with values from environment variables
 
         Raises:
-            ValueError: If GROQ_API_KEY environment variable is not set
+            ValueError: If GROQ_API_KEY is not set and require_api_key is True
 
         Example:
             >>> import os
@@ -99,8 +211,8 @@ class AppConfig:
             >>> config = AppConfig.from_env()
             >>> print(config.log_level)  # Output: DEBUG
         """
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
+        groq_api_key = os.getenv("GROQ_API_KEY", "")
+        if not groq_api_key and require_api_key:
             raise ValueError("GROQ_API_KEY environment variable is required")
 
         return cls(
@@ -111,5 +223,50 @@ class AppConfig:
             max_completion_tokens=int(
                 os.getenv("MAX_COMPLETION_TOKENS", cls.max_completion_tokens)),
             log_level=os.getenv("LOG_LEVEL", cls.log_level),
-            log_file=os.getenv("LOG_FILE", cls.log_file)
+            log_file=os.getenv("LOG_FILE", cls.log_file),
+            detector_backend=os.getenv("DETECTOR_BACKEND", cls.detector_backend),
+            cnn_model_path=os.getenv("CNN_MODEL_PATH", cls.cnn_model_path),
+            stub_latency_ms=float(
+                os.getenv("STUB_LATENCY_MS", cls.stub_latency_ms)),
+            inference_workers=int(
+                os.getenv("INFERENCE_WORKERS", cls.inference_workers)),
+            batch_size=int(os.getenv("BATCH_SIZE", cls.batch_size)),
+            max_batch_images=int(
+                os.getenv("MAX_BATCH_IMAGES", cls.max_batch_images)),
+            max_upload_bytes=int(
+                os.getenv("MAX_UPLOAD_BYTES", cls.max_upload_bytes)),
+            max_batch_upload_bytes=int(
+                os.getenv("MAX_BATCH_UPLOAD_BYTES", cls.max_batch_upload_bytes)),
+            upload_spool_bytes=int(
+                os.getenv("UPLOAD_SPOOL_BYTES", cls.upload_spool_bytes)),
+            job_db_path=os.getenv("JOB_DB_PATH", cls.job_db_path),
+            job_workers=int(os.getenv("JOB_WORKERS", cls.job_workers)),
+            job_max_attempts=int(
+                os.getenv("JOB_MAX_ATTEMPTS", cls.job_max_attempts)),
+            job_ttl_seconds=int(
+                os.getenv("JOB_TTL_SECONDS", cls.job_ttl_seconds)),
+            result_cache_size=int(
+                os.getenv("RESULT_CACHE_SIZE", cls.result_cache_size)),
+            stream_smoothing_alpha=float(
+                os.getenv("STREAM_SMOOTHING_ALPHA", cls.stream_smoothing_alpha)),
+            max_in_flight=int(os.getenv("MAX_IN_FLIGHT", cls.max_in_flight)),
+            max_queued_requests=int(
+                os.getenv("MAX_QUEUED_REQUESTS", cls.max_queued_requests)),
+            request_timeout_seconds=float(
+                os.getenv("REQUEST_TIMEOUT_SECONDS", cls.request_timeout_seconds)),
+            degrade_after_seconds=float(
+                os.getenv("DEGRADE_AFTER_SECONDS", cls.degrade_after_seconds)),
+            degraded_image_side=int(
+                os.getenv("DEGRADED_IMAGE_SIDE", cls.degraded_image_side)),
+            plant_id_routing=os.getenv(
+                "PLANT_ID_ROUTING", str(cls.plant_id_routing)).lower() in ("1", "true", "yes"),
+            routing_confidence_threshold=float(
+                os.getenv("ROUTING_CONFIDENCE_THRESHOLD", cls.routing_confidence_threshold)),
+            llm_threads=int(os.getenv("LLM_THREADS", cls.llm_threads)),
+            llm_batch_size=int(os.getenv("LLM_BATCH_SIZE", cls.llm_batch_size)),
+            llm_context=int(os.getenv("LLM_CONTEXT", cls.llm_context)),
+            llm_gpu_layers=int(os.getenv("LLM_GPU_LAYERS", cls.llm_gpu_layers)),
+            llm_use_mlock=os.getenv(
+                "LLM_USE_MLOCK", str(cls.llm_use_mlock)).lower() in ("1", "true", "yes"),
+            llm_profile_path=os.getenv("LLM_PROFILE_PATH", cls.llm_profile_path)
         )
@@ -8,6 +8,8 @@ import io
 import numpy as np
 import random
 
+from Leaf_Disease.metrics import ERRORS, STAGE_SECONDS
+
 class LeafDiseaseDetector:
     """
     Lightweight detector - works without TensorFlow
@@ -85,62 +87,113 @@ class LeafDiseaseDetector:
         Analyze leaf image and return disease info
         """
         try:
-            # Decode image
             image_bytes = base64.b64decode(base64_image)
-            img = Image.open(io.BytesIO(image_bytes))
-            
-            # Convert to RGB if needed
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Get basic image properties
-            img_array = np.array(img)
+        except Exception as e:
+            print(f"Error: {e}")
+            image_bytes = b''
+        return self.analyze_leaf_image_bytes(image_bytes)
+    
+    def analyze_leaf_images_bytes(self, images_bytes, max_side=None):
+        """
+        Analyze several images (same interface as the CNN batch path)
+        """
+        return [self.analyze_leaf_image_bytes(image_bytes, max_side) for image_bytes in images_bytes]
+    
+    def analyze_leaf_image_bytes(self, image_bytes, max_side=None):
+        """
+        Analyze raw image bytes (used by the API, skips base64).
+        Also accepts a binary file object, e.g. a spooled upload.
+        With max_side, the image is shrunk to at most that many pixels per
+        side first; JPEGs are then decoded at reduced scale, which is much
+        cheaper (used when the API is overloaded).
+        """
+        try:
+            # Decode image (straight from the file object if we got one)
+            with STAGE_SECONDS.time(stage="decode"):
+                source = image_bytes if hasattr(image_bytes, 'read') else io.BytesIO(image_bytes)
+                img = Image.open(source)
+                if max_side:
+                    img.draft('RGB', (max_side, max_side))
+                img.load()  # PIL decodes lazily; do it here so it's timed as decode
+                if max_side:
+                    img.thumbnail((max_side, max_side))
+                
+                # Convert to RGB if needed
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
             
-            # Calculate average color
-            avg_r = np.mean(img_array[:,:,0])
-            avg_g = np.mean(img_array[:,:,1])
-            avg_b = np.mean(img_array[:,:,2])
+            with STAGE_SECONDS.time(stage="preprocess"):
+                # Get basic image properties
+                img_array = np.array(img)
+                
+                # Calculate average color
+                avg_r = np.mean(img_array[:,:,0])
+                avg_g = np.mean(img_array[:,:,1])
+                avg_b = np.mean(img_array[:,:,2])
             
-            # Simple logic for demo (in real app, this would be ML)
-            # Check if likely healthy (more green)
-            if avg_g > avg_r and avg_g > avg_b and avg_g > 120:
-                disease_key = 'healthy'
-                confidence = 0.92
-            else:
-                # Random selection for demo (shows different results)
-                import random
-                disease_keys = ['early_blight', 'late_blight', 'powdery_mildew', 'leaf_spot', 'rust']
-                disease_key = random.choice(disease_keys)
-                confidence = 0.78 + random.random() * 0.15
+            with STAGE_SECONDS.time(stage="inference"):
+                # Simple logic for demo (in real app, this would be ML)
+                # Check if likely healthy (more green)
+                if avg_g > avg_r and avg_g > avg_b and avg_g > 120:
+                    disease_key = 'healthy'
+                    confidence = 0.92
+                else:
+                    # Random selection for demo (shows different results)
+                    disease_keys = ['early_blight', 'late_blight', 'powdery_mildew', 'leaf_spot', 'rust']
+                    disease_key = random.choice(disease_keys)
+                    confidence = 0.78 + random.random() * 0.15
             
-            # Get disease info
-            disease = self.diseases[disease_key]
-            
-            return {
-                'disease_detected': disease_key != 'healthy',
-                'disease_name': disease['name'],
-                'disease_type': disease['type'],
-                'confidence': float(min(confidence, 0.98)),
-                'severity': disease['severity'],
-                'symptoms': disease['symptoms'],
-                'treatment': disease['treatment'],
-                'organic_solutions': disease['organic'],
-                'possible_causes': disease['causes'],
-                'hindi_message': disease['hindi']
-            }
+            with STAGE_SECONDS.time(stage="postprocess"):
+                # Get disease info
+                return {
+                    'disease_detected': disease_key != 'healthy',
+                    'disease_id': disease_key,
+                    'confidence': float(min(confidence, 0.98)),
+                    **self._disease_info(disease_key)
+                }
             
         except Exception as e:
             print(f"Error: {e}")
+            ERRORS.inc(type=type(e).__name__)
             # Return healthy as fallback
             return {
                 'disease_detected': False,
+                'disease_id': 'unclear',
+                'confidence': 0.90,
+                **self._disease_info('unclear')
+            }
+    
+    def _disease_info(self, disease_key):
+        """
+        Static text for one disease id: everything in a result except the
+        detection itself. 'unclear' is the fallback for unreadable images.
+        """
+        if disease_key == 'unclear':
+            return {
                 'disease_name': 'Healthy Plant',
                 'disease_type': 'healthy',
-                'confidence': 0.90,
                 'severity': 'none',
                 'symptoms': ['Unable to analyze image clearly', 'Please try another photo'],
                 'treatment': 'Your crop appears healthy. Continue monitoring.',
                 'organic_solutions': ['Neem oil spray', 'Compost application'],
                 'possible_causes': [],
                 'hindi_message': 'आपकी फसल स्वस्थ है। नियमित निरीक्षण करें।'
-            }
\ No newline at end of file
+            }
+        disease = self.diseases[disease_key]
+        return {
+            'disease_name': disease['name'],
+            'disease_type': disease['type'],
+            'severity': disease['severity'],
+            'symptoms': disease['symptoms'],
+            'treatment': disease['treatment'],
+            'organic_solutions': disease['organic'],
+            'possible_causes': disease['causes'],
+            'hindi_message': disease['hindi']
+        }
+    
+    def knowledge_base(self):
+        """
+        Static text for every disease id the detector can return.
+        Clients cache this once and can then take compact (id-only) results.
+        """
+        return {key: self._disease_info(key) for key in list(self.diseases) + ['unclear']}
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""
+Runtime metrics in the Prometheus text exposition format.
+
+A small, dependency-free subset of the Prometheus client: counters, gauges
+and histograms with labels, collected in a registry that renders the
+``text/plain; version=0.0.4`` format served by the API's ``/metrics``
+endpoint. The detectors record their per-stage timings here directly, so
+the same numbers are available whichever front end runs them.
+
+Usage:
+    >>> with STAGE_SECONDS.time(stage="decode"):
+    ...     img = Image.open(source)
+    >>> ERRORS.inc(type="UnidentifiedImageError")
+    >>> print(REGISTRY.render())
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. cache hits or errors."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. queue depth.
+    ``set_function`` makes the gauge read a callback at scrape time instead.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """Read the (unlabelled) value from ``function`` on every scrape."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observations (latencies, batch sizes) in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the ``with`` block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together for a /metrics scrape."""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Pipeline stages: upload_read, decode, preprocess, inference, postprocess, serialization
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "crop_stage_seconds", "Time spent per analysis stage", ["stage"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "crop_request_seconds", "End-to-end API request latency", ["path", "status"]))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "crop_cache_requests_total", "Result cache lookups", ["cache", "result"]))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "crop_batch_size", "Images per detector batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "crop_job_queue_depth", "Jobs waiting in the persistent queue"))
+MODEL_INFO = REGISTRY.register(Gauge(
+    "crop_model_info", "Loaded detector backend and model version", ["backend", "version"]))
+ERRORS = REGISTRY.register(Counter(
+    "crop_errors_total", "Errors by type", ["type"]))
+# Outcomes: admitted, degraded, rejected (429), expired (deadline while queued)
+ADMISSIONS = REGISTRY.register(Counter(
+    "crop_admissions_total", "Admission control decisions", ["outcome"]))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "crop_requests_in_flight", "Analysis requests running or waiting", ["state"]))
+# Remote services (e.g. plant_id): 0 closed, 1 half-open (probing), 2 open
+CIRCUIT_STATE = REGISTRY.register(Gauge(
+    "crop_circuit_state", "Circuit breaker state per remote service", ["service"]))
+RETRIES = REGISTRY.register(Counter(
+    "crop_retries_total", "Retried calls to remote services", ["service"]))
+FALLBACKS = REGISTRY.register(Counter(
+    "crop_fallbacks_total", "Results served by a local fallback", ["service", "reason"]))
+ROUTER_DECISIONS = REGISTRY.register(Counter(
+    "crop_router_decisions_total", "Local vs Plant.id race outcomes", ["winner", "reason"]))
+ROUTER_AGREEMENT = REGISTRY.register(Counter(
+    "crop_router_agreement_total", "Local and Plant.id verdicts compared", ["result"]))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency and HTTP/unhandled errors.
+
+    Requests are labelled with the matched route template (e.g.
+    ``/jobs/{job_id}``) rather than the raw path to keep cardinality low.
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
+            raise
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path=path, status=str(status["code"]))
+            if status["code"] >= 400:
+                ERRORS.inc(type=f"http_{status['code']}")
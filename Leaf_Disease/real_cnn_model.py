@@ -14,6 +14,8 @@ import io
 import pickle
 import os
 
+from Leaf_Disease.metrics import ERRORS, STAGE_SECONDS
+
 class RealDiseaseDetector:
     """
     REAL Machine Learning Model - Not hardcoded!
@@ -40,6 +42,9 @@ class RealDiseaseDetector:
             'Tomato___Target_Spot', 'Tomato___Tomato_Yellow_Leaf_Curl_Virus', 'Tomato___Tomato_mosaic_virus', 'Tomato___healthy'
         ]
         
+        # Display name -> class name, used as the stable disease id in results
+        self.class_ids = {self._display_name(name): name for name in self.class_names}
+        
         # Load or create model
         if model_path and os.path.exists(model_path):
             print(f"🔄 Loading pre-trained model from {model_path}")
@@ -108,23 +113,28 @@ class RealDiseaseDetector:
     
     def preprocess_image(self, image_bytes):
         """
-        Preprocess image for model input
+        Preprocess image for model input.
+        image_bytes may also be a binary file object (e.g. a spooled upload).
         """
-        # Open image
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Resize
-        img = img.resize((self.img_size, self.img_size))
-        
-        # Convert to array and normalize
-        img_array = np.array(img) / 255.0
+        # Open image (straight from the file object if we got one)
+        with STAGE_SECONDS.time(stage="decode"):
+            source = image_bytes if hasattr(image_bytes, 'read') else io.BytesIO(image_bytes)
+            img = Image.open(source)
+            img.load()  # PIL decodes lazily; do it here so it's timed as decode
+            
+            # Convert to RGB if needed
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
         
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
+        with STAGE_SECONDS.time(stage="preprocess"):
+            # Resize
+            img = img.resize((self.img_size, self.img_size))
+            
+            # Convert to array and normalize
+            img_array = np.array(img) / 255.0
+            
+            # Add batch dimension
+            img_array = np.expand_dims(img_array, axis=0)
         
         return img_array
     
@@ -132,18 +142,34 @@ class RealDiseaseDetector:
         """
         REAL prediction - model actually processes the image!
         """
-        # Preprocess
-        img_array = self.preprocess_image(image_bytes)
+        return self.predict_batch([image_bytes])[0]
+    
+    def predict_batch(self, images_bytes):
+        """
+        Top-3 predictions for several images with a single model call.
+        One forward pass over a stacked batch is much cheaper than
+        calling model.predict once per image.
+        """
+        return self._predict_arrays([self.preprocess_image(b) for b in images_bytes])
+    
+    def _predict_arrays(self, img_arrays):
+        """Stack preprocessed (1, 224, 224, 3) arrays and run one forward pass"""
+        batch = np.concatenate(img_arrays)
         
         # Run inference (THIS IS REAL ML!)
-        predictions = self.model.predict(img_array, verbose=0)[0]
+        with STAGE_SECONDS.time(stage="inference"):
+            all_predictions = self.model.predict(batch, batch_size=len(batch), verbose=0)
         
-        # Get top 3 predictions
+        with STAGE_SECONDS.time(stage="postprocess"):
+            return [self._top_predictions(predictions) for predictions in all_predictions]
+    
+    def _top_predictions(self, predictions):
+        """Get top 3 predictions from one row of class probabilities"""
         top_3_idx = np.argsort(predictions)[-3:][::-1]
         
         results = []
         for idx in top_3_idx:
-            disease_name = self.class_names[idx].replace('_', ' ').replace('___', ' - ')
+            disease_name = self._display_name(self.class_names[idx])
             confidence = float(predictions[idx])
             results.append({
                 'disease': disease_name,
@@ -152,61 +178,135 @@ class RealDiseaseDetector:
         
         return results
     
+    @staticmethod
+    def _display_name(class_name):
+        """PlantVillage class name -> name shown to users"""
+        return class_name.replace('_', ' ').replace('___', ' - ')
+    
     def analyze_leaf_image_base64(self, base64_image):
         """
         Main method that matches your existing interface
         """
         try:
-            # Decode base64
             image_bytes = base64.b64decode(base64_image)
-            
-            # Get predictions
-            predictions = self.predict(image_bytes)
-            top_result = predictions[0]
-            
-            # Extract disease name and clean it
-            disease_name = top_result['disease']
-            confidence = top_result['confidence']
-            
-            # Determine if healthy
-            is_healthy = 'healthy' in disease_name.lower()
-            
-            # Get severity based on confidence
-            if confidence > 0.9:
-                severity = 'high'
-            elif confidence > 0.7:
-                severity = 'moderate'
-            else:
-                severity = 'low'
-            
-            # Get treatment based on disease
+        except Exception as e:
+            print(f"Error in prediction: {e}")
+            image_bytes = b''
+        return self.analyze_leaf_image_bytes(image_bytes)
+    
+    def analyze_leaf_image_bytes(self, image_bytes):
+        """
+        Same as analyze_leaf_image_base64 but takes raw bytes (used by the API)
+        """
+        try:
+            return self._build_result(self.predict(image_bytes))
+        except Exception as e:
+            print(f"Error in prediction: {e}")
+            ERRORS.inc(type=type(e).__name__)
+            return self._fallback_result()
+    
+    def analyze_leaf_images_bytes(self, images_bytes):
+        """
+        Analyze many images with one batched forward pass.
+        Images that fail to decode get the usual fallback result.
+        """
+        results = [None] * len(images_bytes)
+        batch, batch_idx = [], []
+        for i, image_bytes in enumerate(images_bytes):
+            try:
+                batch.append(self.preprocess_image(image_bytes))
+                batch_idx.append(i)
+            except Exception as e:
+                print(f"Error in prediction: {e}")
+                ERRORS.inc(type=type(e).__name__)
+                results[i] = self._fallback_result()
+        
+        if batch:
+            try:
+                for i, predictions in zip(batch_idx, self._predict_arrays(batch)):
+                    results[i] = self._build_result(predictions)
+            except Exception as e:
+                print(f"Error in prediction: {e}")
+                ERRORS.inc(type=type(e).__name__)
+                for i in batch_idx:
+                    results[i] = self._fallback_result()
+        
+        return results
+    
+    def _build_result(self, predictions):
+        """Turn top-3 predictions into the result dict the app expects"""
+        top_result = predictions[0]
+        
+        # Extract disease name and clean it
+        disease_name = top_result['disease']
+        confidence = top_result['confidence']
+        
+        # Determine if healthy
+        is_healthy = 'healthy' in disease_name.lower()
+        
+        # Get severity based on confidence
+        if confidence > 0.9:
+            severity = 'high'
+        elif confidence > 0.7:
+            severity = 'moderate'
+        else:
+            severity = 'low'
+        
+        # Get treatment based on disease
+        treatment_info = self._get_treatment(disease_name)
+        
+        return {
+            'disease_detected': not is_healthy,
+            'disease_id': self.class_ids.get(disease_name, disease_name),
+            'disease_name': disease_name,
+            'confidence': confidence,
+            'severity': severity,
+            'treatment': treatment_info['treatment'],
+            'organic_solutions': treatment_info['organic'],
+            'possible_causes': treatment_info['causes'],
+            'hindi_message': treatment_info['hindi'],
+            'all_predictions': predictions  # Send all predictions for transparency
+        }
+    
+    def _fallback_result(self):
+        """Result returned when an image can't be analyzed"""
+        return {
+            'disease_detected': False,
+            'disease_id': 'unclear',
+            'confidence': 0.95,
+            'severity': 'none',
+            **self._unclear_info(),
+            'all_predictions': []
+        }
+    
+    def _unclear_info(self):
+        """Static text of the fallback result"""
+        return {
+            'disease_name': 'Healthy',
+            'treatment': 'Your crop appears healthy!',
+            'organic_solutions': ['Regular neem spray', 'Crop rotation'],
+            'possible_causes': [],
+            'hindi_message': 'आपकी फसल स्वस्थ है!'
+        }
+    
+    def knowledge_base(self):
+        """
+        Static text for every class id the model can return.
+        Clients cache this once and can then take compact (id-only) results.
+        """
+        kb = {}
+        for class_name in self.class_names:
+            disease_name = self._display_name(class_name)
             treatment_info = self._get_treatment(disease_name)
-            
-            return {
-                'disease_detected': not is_healthy,
+            kb[class_name] = {
                 'disease_name': disease_name,
-                'confidence': confidence,
-                'severity': severity,
                 'treatment': treatment_info['treatment'],
                 'organic_solutions': treatment_info['organic'],
                 'possible_causes': treatment_info['causes'],
-                'hindi_message': treatment_info['hindi'],
-                'all_predictions': predictions  # Send all predictions for transparency
-            }
-            
-        except Exception as e:
-            print(f"Error in prediction: {e}")
-            return {
-                'disease_detected': False,
-                'disease_name': 'Healthy',
-                'confidence': 0.95,
-                'severity': 'none',
-                'treatment': 'Your crop appears healthy!',
-                'organic_solutions': ['Regular neem spray', 'Crop rotation'],
-                'possible_causes': [],
-                'hindi_message': 'आपकी फसल स्वस्थ है!',
-                'all_predictions': []
+                'hindi_message': treatment_info['hindi']
             }
+        kb['unclear'] = self._unclear_info()
+        return kb
     
     def _get_treatment(self, disease_name):
         """
@@ -0,0 +1,217 @@
+"""
+admission.py
+Admission control and load shedding for the analysis endpoints.
+
+Without a limit every burst of uploads goes straight to the detector pool
+and everyone's latency grows together. ``AdmissionController`` lets
+``max_in_flight`` analyses run at once, queues up to ``max_queued_requests``
+more in arrival order and answers 429 with a Retry-After estimate beyond
+that. Every request carries a deadline: one that can't get a slot in time
+gets 503 instead of an answer nobody is waiting for anymore.
+
+When the queue has stayed at least half full for ``degrade_after_seconds``
+(or a request's remaining deadline is shorter than a typical analysis),
+tickets come back marked ``degraded`` and the caller runs the cheap path:
+the lightweight detector, or a downscaled image. The overload flag is only
+cleared once the queue has fully drained, so the service doesn't flap
+between modes.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from Leaf_Disease.metrics import ADMISSIONS, IN_FLIGHT
+
+
+@dataclass
+class Ticket:
+    """One admitted request."""
+    deadline: float  # time.monotonic() by which the response is due
+    degraded: bool  # Run the cheap path instead of the full model
+    started: float = 0.0  # time.monotonic() when the slot was granted
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+
+class AdmissionController:
+    """
+    Bounded in-flight limit with a bounded FIFO queue in front of it.
+
+    Args:
+        max_in_flight: Analyses allowed to run at the same time.
+        max_queued_requests: Requests allowed to wait for a slot.
+        timeout: Default per-request deadline in seconds, queueing included.
+        degrade_after: Seconds of sustained overload before degrading.
+    """
+
+    def __init__(self, max_in_flight: int = 4, max_queued_requests: int = 32,
+                 timeout: float = 15.0, degrade_after: float = 5.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued_requests = max(0, max_queued_requests)
+        self.timeout = timeout
+        self.degrade_after = degrade_after
+        self.in_flight = 0
+        self.overloaded_since: Optional[float] = None
+        self.service_seconds = 1.0  # Moving average of full-path analysis time
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def full(self) -> bool:
+        """True if a new request would be rejected right now."""
+        return self.in_flight >= self.max_in_flight and self.waiting >= self.max_queued_requests
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        backlog = self.in_flight + self.waiting
+        return max(1, math.ceil(self.service_seconds * backlog / self.max_in_flight))
+
+    def degraded(self) -> bool:
+        return (self.overloaded_since is not None
+                and time.monotonic() - self.overloaded_since >= self.degrade_after)
+
+    def reject(self) -> HTTPException:
+        ADMISSIONS.inc(outcome="rejected")
+        return HTTPException(
+            status_code=429,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(self.retry_after())}
+        )
+
+    async def acquire(self, timeout: Optional[float] = None) -> Ticket:
+        """
+        Wait for an analysis slot.
+
+        Raises:
+            HTTPException: 429 if the queue is full, 503 if the deadline
+                passes while waiting. Both carry Retry-After.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        if self.in_flight >= self.max_in_flight or self._waiters:
+            if self.waiting >= self.max_queued_requests:
+                raise self.reject()
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._update()
+            try:
+                await asyncio.wait_for(waiter, timeout=max(0.0, deadline - time.monotonic()))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    self._release_slot()  # Granted just as we gave up: pass it on
+                self._update()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                ADMISSIONS.inc(outcome="expired")
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy, request timed out in the queue",
+                    headers={"Retry-After": str(self.retry_after())}
+                )
+        else:
+            self.in_flight += 1
+        self._update()
+
+        ticket = Ticket(deadline=deadline, degraded=False, started=time.monotonic())
+        ticket.degraded = self.degraded() or ticket.remaining() < self.service_seconds
+        ADMISSIONS.inc(outcome="degraded" if ticket.degraded else "admitted")
+        return ticket
+
+    def release(self, ticket: Ticket, measure: bool = True):
+        """
+        Free the ticket's slot once its work has really finished.
+        Pass ``measure=False`` for batch requests so they don't skew the
+        per-image service time behind Retry-After and degradation.
+        """
+        if measure and not ticket.degraded:
+            elapsed = time.monotonic() - ticket.started
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * elapsed
+        self._release_slot()
+        self._update()
+
+    def _release_slot(self):
+        # Hand the slot straight to the next live waiter, keeping FIFO order
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _update(self):
+        """Track how long the queue has been at least half full."""
+        if self.waiting >= max(1, self.max_queued_requests // 2):
+            if self.overloaded_since is None:
+                self.overloaded_since = time.monotonic()
+        elif self.waiting == 0:
+            self.overloaded_since = None
+        IN_FLIGHT.set(self.in_flight, state="running")
+        IN_FLIGHT.set(self.waiting, state="waiting")
+
+    async def run(self, ticket: Ticket, work, measure: bool = True) -> object:
+        """
+        Await ``work`` (a coroutine) within the ticket's deadline, 504 if
+        it doesn't finish in time.
+
+        The slot is released when the work actually completes, not when
+        the client gives up: an executor thread can't be interrupted, so
+        the slot stays taken for as long as the detector is still busy.
+        ``measure`` is passed on to release().
+        """
+        task = asyncio.ensure_future(work)
+        task.add_done_callback(lambda _: self.release(ticket, measure=measure))
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=ticket.remaining())
+        except asyncio.TimeoutError:
+            ADMISSIONS.inc(outcome="expired")
+            raise HTTPException(status_code=504, detail="Analysis did not finish before the deadline")
+
+    def status(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queued_requests": self.max_queued_requests,
+            "degraded": self.degraded(),
+            "service_seconds": round(self.service_seconds, 3),
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware answering 429 before the request body is read.
+
+    Uploads are parsed before the endpoint runs, so without this a full
+    server would still accept (and spool) every incoming image only to
+    reject it afterwards.
+
+    Args:
+        app: The wrapped ASGI application.
+        controller: Admission controller shared with the endpoints.
+        paths: Request paths subject to admission control.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths=()):
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope.get("path") in self.paths and self.controller.full():
+            error = self.controller.reject()
+            response = JSONResponse(status_code=429, content={"detail": error.detail},
+                                    headers=error.headers)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
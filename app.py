@@ -1,10 +1,108 @@
 # app.py
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import json
+import math
+import re
+import time
+import zipfile
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional, Tuple
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.formparsers import MultiPartParser
 import uvicorn
 from datetime import datetime
 
-app = FastAPI(title="Crop Disease API")
+from Leaf_Disease.config import AppConfig
+from admission import AdmissionController, AdmissionMiddleware
+from Leaf_Disease.metrics import REGISTRY, STAGE_SECONDS, QUEUE_DEPTH, MetricsMiddleware
+from detector_service import DetectorService, FieldSummary, get_preloaded, summarize_field
+from prefork_server import process_memory
+from frame_stream import LatestFrameSlot, PredictionSmoother
+from result_cache import ResultCache, etag_matches, make_etag
+from serialization import JSON, compact_result, encode, format_suffix, negotiate
+from job_queue import JobStore, JobWorkerPool, DONE, FAILED
+from hedged_router import HedgedRouter
+from uploads import UploadLimitMiddleware, check_image_head, hash_file, validate_image_upload, SNIFF_BYTES
+
+# The API never calls Groq itself, so a missing GROQ_API_KEY is fine here
+config = AppConfig.from_env(require_api_key=False)
+
+# Uploads stay in RAM up to this size, then Starlette spools them to disk
+MultiPartParser.spool_max_size = config.upload_spool_bytes
+
+# Room for multipart boundaries and part headers around a single image
+MULTIPART_OVERHEAD = 64 * 1024
+
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+# Bounded concurrency for the analysis endpoints, shared with their middleware
+admission = AdmissionController(
+    max_in_flight=config.max_in_flight,
+    max_queued_requests=config.max_queued_requests,
+    timeout=config.request_timeout_seconds,
+    degrade_after=config.degrade_after_seconds,
+)
+
+
+async def run_analysis_job(payload: bytes) -> dict:
+    """
+    Job handler: analyze a queued image with the shared detector.
+
+    Jobs take admission slots like the upload endpoints, so they count
+    against max_in_flight. A job is already queued, so when the controller
+    is full it waits for the Retry-After instead of failing an attempt;
+    it runs the full model since nobody is waiting on the response.
+    """
+    while True:
+        try:
+            ticket = await admission.acquire()
+            break
+        except HTTPException as e:
+            await asyncio.sleep(float(e.headers.get("Retry-After", 1)))
+    result = await admission.run(ticket, app.state.detector_service.analyze(payload))
+    result["analysis_timestamp"] = datetime.utcnow().isoformat() + "Z"
+    return result
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm the detector once per process, not once per request.
+    # Under prefork_server.py the parent already did this before forking.
+    service = get_preloaded()
+    if service is None:
+        service = DetectorService(config)
+        service.load()
+    app.state.detector_service = service
+    app.state.result_cache = ResultCache(config.result_cache_size)
+    # Unsure local answers also go to Plant.id (PLANT_ID_ROUTING)
+    router = None
+    if config.plant_id_routing:
+        router = HedgedRouter(analyze_local=service.analyze,
+                              confidence_threshold=config.routing_confidence_threshold,
+                              detector_format=True)
+    app.state.router = router
+
+    # Persistent job queue for submit-now, fetch-later clients
+    job_store = JobStore(config.job_db_path, max_attempts=config.job_max_attempts,
+                         ttl_seconds=config.job_ttl_seconds)
+    job_workers = JobWorkerPool(job_store, run_analysis_job, workers=config.job_workers)
+    app.state.job_store = job_store
+    app.state.job_workers = job_workers
+    QUEUE_DEPTH.set_function(job_store.depth)
+    job_workers.start()
+    yield
+    await job_workers.stop()
+    QUEUE_DEPTH.set_function(None)
+    job_store.close()
+    if router is not None:
+        await router.aclose()
+    service.shutdown()
+
+
+app = FastAPI(title="Crop Disease API", lifespan=lifespan)
 
 # Allow your Streamlit app (on localhost:8501) to talk to this backend
 app.add_middleware(
@@ -15,50 +113,506 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency and error counts for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Answer 429 before reading the upload when the analysis queue is full
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    paths=("/disease-detection-file", "/disease-detection-batch"),
+)
+
+# Refuse oversized bodies before they are read into memory or onto disk
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/disease-detection-file": config.max_upload_bytes + MULTIPART_OVERHEAD,
+        "/jobs": config.max_upload_bytes + MULTIPART_OVERHEAD,
+        "/disease-detection-batch": config.max_batch_upload_bytes,
+    },
+)
+
+
+def get_detector_service(request: Request) -> DetectorService:
+    """Return the loaded detector service, or 503 while it is still starting."""
+    service = getattr(request.app.state, "detector_service", None)
+    if service is None or not service.ready:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet")
+    return service
+
+
+def _is_zip(upload: UploadFile) -> bool:
+    name = (upload.filename or "").lower()
+    return name.endswith(".zip") or upload.content_type in ("application/zip", "application/x-zip-compressed")
+
+
+def _zip_image_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return [
+        member for member in archive.infolist()
+        if not member.is_dir() and member.filename.lower().endswith(config.supported_formats)
+    ]
+
+
+async def check_batch_upload(files: List[UploadFile]) -> int:
+    """
+    Count the images in a batch upload (zip members included) and reject
+    empty, oversized or non-image batches before any inference starts.
+    Zip members are checked from the central directory plus their first
+    few bytes, without decompressing whole images.
+    """
+    total = 0
+    for upload in files:
+        if not _is_zip(upload):
+            await validate_image_upload(upload, config.max_upload_bytes, config.supported_formats)
+            total += 1
+            continue
+        try:
+            with zipfile.ZipFile(upload.file) as archive:
+                for member in _zip_image_members(archive):
+                    name = f"{upload.filename}/{member.filename}"
+                    if member.file_size > config.max_upload_bytes:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"{name} is larger than {config.max_upload_bytes // (1024 * 1024)} MB"
+                        )
+                    with archive.open(member) as member_file:
+                        check_image_head(member_file.read(SNIFF_BYTES), config.supported_formats, name)
+                    total += 1
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"{upload.filename} is not a valid zip file")
+
+    if total == 0:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+    if total > config.max_batch_images:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images: at most {config.max_batch_images} per request"
+        )
+    return total
+
+
+async def iter_batch_images(files: List[UploadFile]) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Yield (filename, image) pairs one image at a time.
+    Plain uploads are yielded as their spooled file so detectors decode
+    them in place; zip members are decompressed lazily, one at a time.
+    """
+    for upload in files:
+        name = upload.filename or "upload"
+        if _is_zip(upload):
+            with zipfile.ZipFile(upload.file) as archive:
+                for member in _zip_image_members(archive):
+                    with STAGE_SECONDS.time(stage="upload_read"):
+                        contents = await run_in_threadpool(archive.read, member)
+                    yield f"{name}/{member.filename}", contents
+        else:
+            await upload.seek(0)
+            yield name, upload.file
+
+
+def _stream_format(request: Request, stream: Optional[str]) -> Optional[str]:
+    """Pick "ndjson" or "sse" from ?stream= or the Accept header."""
+    if stream:
+        if stream not in ("ndjson", "sse"):
+            raise HTTPException(status_code=400, detail="stream must be 'ndjson' or 'sse'")
+        return stream
+    accept = request.headers.get("accept", "")
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    if "text/event-stream" in accept:
+        return "sse"
+    return None
+
+
+def _encode_stream_item(fmt: str, event: str, payload: dict) -> str:
+    with STAGE_SECONDS.time(stage="serialization"):
+        if fmt == "sse":
+            return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n"
+
+
+def check_view(view: str) -> bool:
+    """Validate ?view=; True for the compact (ids only) view."""
+    if view not in ("full", "compact"):
+        raise HTTPException(status_code=400, detail="view must be 'full' or 'compact'")
+    return view == "compact"
+
+
+def present_result(result: dict, compact: bool, service: DetectorService) -> dict:
+    """The result as sent to the client: full, or stripped to ids for compact."""
+    if not compact:
+        return result
+    return compact_result(result, service.knowledge_base, service.kb_version)
+
+
+def representation(media_type: str, compact: bool) -> str:
+    """ETag variant of a response: "" for full JSON, else e.g. "msgpack-compact"."""
+    if media_type == JSON and not compact:
+        return ""
+    return format_suffix(media_type) + ("-compact" if compact else "")
+
+
+def encoded_response(content, media_type: str, status_code: int = 200,
+                     headers: Optional[dict] = None) -> Response:
+    """
+    Response encoded as the negotiated ``media_type`` (see serialization.py),
+    skipping FastAPI's generic JSON encoder. Encoding is recorded as the
+    serialization stage.
+    """
+    with STAGE_SECONDS.time(stage="serialization"):
+        body = encode(content, media_type)
+    return Response(content=body, status_code=status_code, media_type=media_type,
+                    headers={**(headers or {}), "Vary": "Accept"})
+
+
 @app.get("/")
 def read_root():
     return {"message": "Rural Roots - Crop Disease API", "status": "active"}
 
+@app.get("/ready")
+def readiness(request: Request):
+    """Readiness probe: 200 once the model is loaded and warmed, 503 before."""
+    service = getattr(request.app.state, "detector_service", None)
+    if service is None or not service.ready:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {**service.status(), "admission": admission.status(), "memory": process_memory()}
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus text exposition of stage latencies, caches, queue and errors.
+    Per process: under prefork_server.py each worker reports only its own.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type=REGISTRY.CONTENT_TYPE)
+
+@app.get("/knowledge-base")
+async def knowledge_base(request: Request):
+    """
+    Static text (names, symptoms, treatments, Hindi messages) for every
+    disease id the loaded detector returns. Clients cache it and ask for
+    results with ?view=compact, refetching only when kb_version changes.
+    """
+    service = get_detector_service(request)
+    media_type = negotiate(request.headers.get("accept"))
+    headers = {
+        "ETag": make_etag(f"kb-{service.kb_version}", representation(media_type, False)),
+        "Cache-Control": "public, max-age=86400",
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers={**headers, "Vary": "Accept"})
+    return encoded_response(
+        {"kb_version": service.kb_version, "diseases": service.knowledge_base},
+        media_type, headers=headers
+    )
+
 @app.post("/disease-detection-file")
-async def analyze_image(file: UploadFile = File(...)):
-    """
-    This is a MOCK endpoint that simulates the AI analysis.
-    It returns a valid response matching your Streamlit app's expectations.
-    Replace the mock logic with real AI model calls later.
-    """
-    # Accept the file (your frontend sends it here)
-    contents = await file.read()
-
-    # --- MOCK ANALYSIS LOGIC ---
-    # For now, we'll return a realistic fake result so your app has data to display.
-    # Later, you can connect this to your real 'LeafDiseaseDetector' class.
-    mock_result = {
-        "disease_detected": True,
-        "disease_name": "Early Blight",
-        "disease_type": "fungal",
-        "severity": "moderate",
-        "confidence": 88.5,
-        "symptoms": [
-            "Dark brown concentric rings on leaves",
-            "Yellow halos around spots",
-            "Lower leaves affected first"
-        ],
-        "possible_causes": [
-            "High humidity and warm temperatures",
-            "Poor air circulation between plants",
-            "Infected plant debris in soil"
-        ],
-        "treatment": [
-            "Remove and destroy infected leaves.",
-            "Apply copper-based fungicide weekly.",
-            "Water at the soil level (avoid wetting leaves).",
-            "Ensure proper spacing for air flow."
-        ],
+async def analyze_image(request: Request, file: UploadFile = File(...), view: str = "full"):
+    """
+    Analyze an uploaded leaf image with the detector loaded at startup.
+    Inference runs in the detector thread pool so the event loop stays free.
+
+    The SHA-256 of the image is returned as a strong ETag. Re-posting the
+    same bytes returns the cached result instead of a fresh analysis, and
+    If-None-Match with a known ETag answers 412 without re-analysing.
+    Clients can avoid the upload altogether with GET /results/{sha256}.
+
+    The response is JSON, MessagePack or CBOR depending on Accept;
+    ?view=compact leaves out the static text found in GET /knowledge-base.
+
+    Analyses go through admission control: 429 when the queue is full,
+    503/504 past the request deadline. Under sustained overload the result
+    comes from the cheap path, is marked "degraded" and is not cached.
+
+    With PLANT_ID_ROUTING the local detector races Plant.id (see
+    hedged_router.py): Plant.id is asked too when the local answer is
+    unsure or slow, and the result says which one answered.
+    """
+    service = get_detector_service(request)
+    media_type = negotiate(request.headers.get("accept"))
+    compact = check_view(view)
+    with STAGE_SECONDS.time(stage="upload_read"):
+        await validate_image_upload(file, config.max_upload_bytes, config.supported_formats)
+        content_hash = await run_in_threadpool(hash_file, file.file)
+    etag = make_etag(content_hash, representation(media_type, compact))
+    cache = request.app.state.result_cache
+    result = cache.get(content_hash)
+
+    # RFC 9110: a matching If-None-Match on a non-GET request is 412
+    if result is not None and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=412, headers={"ETag": etag})
+
+    if result is None:
+        ticket = await admission.acquire()
+        router = request.app.state.router
+        if router is not None and not ticket.degraded:
+            payload = await run_in_threadpool(file.file.read)  # Plant.id needs the bytes
+            result = await admission.run(ticket, router.analyze(payload))
+        else:
+            # Decode straight from the spooled upload instead of copying it into bytes
+            result = await admission.run(ticket, service.analyze(file.file, degraded=ticket.degraded))
+        result["analysis_timestamp"] = datetime.utcnow().isoformat() + "Z"
+        result["image_sha256"] = content_hash
+        if ticket.degraded:
+            # Not cached, so the image gets a full analysis once load drops
+            cache_status = "degraded"
+        else:
+            cache.put(content_hash, result)
+            cache_status = "miss"
+    else:
+        cache_status = "hit"
+
+    return encoded_response(present_result(result, compact, service), media_type,
+                            headers={"ETag": etag, "X-Cache": cache_status})
+
+@app.api_route("/results/{content_hash}", methods=["GET", "HEAD"])
+async def cached_result(request: Request, content_hash: str, view: str = "full"):
+    """
+    Hash-only lookup: "do you already have a result for this image?"
+    200 with the result (or 304 on a matching If-None-Match) on a hit,
+    404 on a miss, in which case the client uploads the bytes.
+    """
+    content_hash = content_hash.lower()
+    if not SHA256_HEX.match(content_hash):
+        raise HTTPException(status_code=400, detail="Expected a hex SHA-256 digest")
+    media_type = negotiate(request.headers.get("accept"))
+    compact = check_view(view)
+
+    result = request.app.state.result_cache.get(content_hash)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No result for this image yet")
+
+    headers = {
+        "ETag": make_etag(content_hash, representation(media_type, compact)),
+        "Cache-Control": "private, max-age=3600",
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers={**headers, "Vary": "Accept"})
+    service = get_detector_service(request)
+    return encoded_response(present_result(result, compact, service), media_type, headers=headers)
+
+@app.post("/disease-detection-batch")
+async def analyze_batch(request: Request, files: List[UploadFile] = File(...),
+                        stream: Optional[str] = None, view: str = "full"):
+    """
+    Analyze a whole field visit in one request: many image files and/or a zip.
+    Images go through the detector in batches of config.batch_size and the
+    response carries per-image results plus field-level aggregates.
+
+    With ?stream=ndjson|sse (or an Accept of application/x-ndjson or
+    text/event-stream) each result is sent as soon as it is ready and the
+    summary comes last, so the server never holds the whole batch.
+    Otherwise the response is JSON, MessagePack or CBOR depending on Accept.
+    ?view=compact leaves the static knowledge-base text out of each result.
+    """
+    service = get_detector_service(request)
+    fmt = _stream_format(request, stream)
+    media_type = None if fmt else negotiate(request.headers.get("accept"))
+    compact = check_view(view)
+    with STAGE_SECONDS.time(stage="upload_read"):
+        total = await check_batch_upload(files)
+
+    if fmt:
+        async def event_stream():
+            # The slot is taken inside the stream so it is always released
+            # with it; a full queue was already answered 429 by the middleware
+            try:
+                ticket = await admission.acquire()
+            except HTTPException as e:
+                yield _encode_stream_item(fmt, "error", {"status_code": e.status_code, "detail": e.detail})
+                return
+            try:
+                summary = FieldSummary()
+                async for index, name, result in service.stream_batch(iter_batch_images(files),
+                                                                      degraded=ticket.degraded):
+                    summary.add(result)
+                    result["filename"] = name
+                    result["index"] = index
+                    yield _encode_stream_item(fmt, "result", present_result(result, compact, service))
+                yield _encode_stream_item(fmt, "summary", {
+                    "summary": summary.as_dict(),
+                    "analysis_timestamp": datetime.utcnow().isoformat() + "Z"
+                })
+            finally:
+                admission.release(ticket, measure=False)
+
+        media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+        return StreamingResponse(event_stream(), media_type=media_type,
+                                 headers={"X-Total-Images": str(total)})
+
+    # One request deadline per detector batch, so large field visits aren't cut off
+    ticket = await admission.acquire(
+        timeout=config.request_timeout_seconds * max(1, math.ceil(total / config.batch_size)))
+
+    async def analyze_all():
+        images = [image async for image in iter_batch_images(files)]
+        results = await service.analyze_batch([contents for _, contents in images],
+                                              degraded=ticket.degraded)
+        for (name, _), result in zip(images, results):
+            result["filename"] = name
+        return results
+
+    results = await admission.run(ticket, analyze_all(), measure=False)
+
+    return encoded_response({
+        "results": [present_result(result, compact, service) for result in results],
+        "summary": summarize_field(results),
         "analysis_timestamp": datetime.utcnow().isoformat() + "Z"
+    }, media_type)
+
+@app.websocket("/ws/camera")
+async def camera_stream(websocket: WebSocket):
+    """
+    Live analysis of a camera sweep.
+
+    The client sends frames as binary messages (JPEG/PNG bytes) and may send
+    the text message "reset" to clear smoothing when moving to a new plant.
+    Only the newest frame is analysed when inference falls behind; older
+    unprocessed frames are dropped. For every analysed frame the server sends
+    the raw and smoothed prediction plus latency figures in milliseconds.
+
+    Frames go through admission control like uploads: a frame that gets no
+    slot (429/503) or misses its deadline (504) is answered with an error
+    and the status code instead, and under overload the cheap path runs.
+    """
+    await websocket.accept()
+    service = getattr(websocket.app.state, "detector_service", None)
+    if service is None or not service.ready:
+        await websocket.close(code=1013, reason="Model is not loaded yet")
+        return
+
+    slot = LatestFrameSlot()
+    smoother = PredictionSmoother(alpha=config.stream_smoothing_alpha)
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    slot.put(message["bytes"])
+                elif (message.get("text") or "").strip().lower() == "reset":
+                    smoother.reset()
+        finally:
+            slot.close()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            frame = await slot.get()
+            if frame is None:
+                break
+
+            if len(frame.data) > config.max_upload_bytes:
+                await websocket.send_json({"frame_id": frame.frame_id, "error": "Frame too large"})
+                continue
+            try:
+                check_image_head(frame.data[:SNIFF_BYTES], config.supported_formats, "frame")
+            except HTTPException as e:
+                await websocket.send_json({"frame_id": frame.frame_id, "error": e.detail})
+                continue
+
+            # Frames share the analysis slots; one that can't get a slot is dropped
+            try:
+                ticket = await admission.acquire()
+                started = time.perf_counter()
+                result = await admission.run(ticket, service.analyze(frame.data, degraded=ticket.degraded))
+            except HTTPException as e:
+                await websocket.send_json({"frame_id": frame.frame_id, "error": e.detail,
+                                           "status_code": e.status_code})
+                continue
+            finished = time.perf_counter()
+            smoothed = smoother.update(result)
+
+            await websocket.send_json({
+                "frame_id": frame.frame_id,
+                "disease_name": result.get("disease_name"),
+                "disease_detected": result.get("disease_detected"),
+                "confidence": result.get("confidence"),
+                "degraded": result.get("degraded", False),
+                "smoothed": smoothed,
+                "latency_ms": {
+                    "queue": round((started - frame.received_at) * 1000, 1),
+                    "inference": round((finished - started) * 1000, 1),
+                    "total": round((time.perf_counter() - frame.received_at) * 1000, 1),
+                },
+                "frames_received": slot.received,
+                "frames_dropped": slot.dropped,
+            })
+    except (WebSocketDisconnect, RuntimeError):
+        # Socket closed while sending; nothing left to tell the client
+        pass
+    finally:
+        receiver.cancel()
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request, file: UploadFile = File(...)):
+    """
+    Queue an image for analysis and return immediately with a job id.
+    Poll GET /jobs/{job_id} and fetch GET /jobs/{job_id}/result when done;
+    queued work survives server restarts. The analysis itself takes an
+    admission slot like any other (see run_analysis_job).
+    """
+    with STAGE_SECONDS.time(stage="upload_read"):
+        await validate_image_upload(file, config.max_upload_bytes, config.supported_formats)
+        payload = await file.read()
+
+    job_id = await run_in_threadpool(request.app.state.job_store.submit, payload, file.filename or "upload")
+    request.app.state.job_workers.notify()
+    return JSONResponse(
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
+        content={
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/jobs/{job_id}",
+            "result_url": f"/jobs/{job_id}/result"
+        }
+    )
+
+@app.get("/jobs/{job_id}")
+async def job_status(request: Request, job_id: str):
+    """Status of a queued job: queued, running, done or failed."""
+    store = request.app.state.job_store
+    job = await run_in_threadpool(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    status = {
+        "job_id": job_id,
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "expires_at": job["expires_at"],
     }
-    # --- END MOCK LOGIC ---
+    if job["status"] == "queued":
+        status["queue_position"] = await run_in_threadpool(store.position, job_id)
+    if job["error"]:
+        status["error"] = job["error"]
+    return status
 
-    return mock_result
+@app.get("/jobs/{job_id}/result")
+async def job_result(request: Request, job_id: str, view: str = "full"):
+    """The analysis result: 200 when done, 202 while pending, 500 if it failed."""
+    media_type = negotiate(request.headers.get("accept"))
+    compact = check_view(view)
+    job = await run_in_threadpool(request.app.state.job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if job["status"] == DONE:
+        service = get_detector_service(request)
+        return encoded_response(present_result(job["result"], compact, service), media_type)
+    if job["status"] == FAILED:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Job failed after {job['attempts']} attempts: {job['error']}"
+        )
+    return JSONResponse(
+        status_code=202,
+        headers={"Retry-After": "2"},
+        content={"job_id": job_id, "status": job["status"]}
+    )
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,289 @@
+"""
+detector_service.py
+Loads a disease detector once and runs it off the event loop for the API.
+"""
+
+import asyncio
+import io
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from Leaf_Disease.config import AppConfig
+from Leaf_Disease.main import LeafDiseaseDetector
+from Leaf_Disease.metrics import BATCH_SIZE, MODEL_INFO
+from serialization import knowledge_base_version
+
+
+# Set by preload() in a pre-fork parent so workers reuse the warmed model
+_preloaded: Optional["DetectorService"] = None
+
+
+def preload(config: AppConfig) -> "DetectorService":
+    """Load and warm a service before forking; the app lifespan picks it up."""
+    global _preloaded
+    service = DetectorService(config)
+    service.load()
+    _preloaded = service
+    return service
+
+
+def get_preloaded() -> Optional["DetectorService"]:
+    return _preloaded
+
+
+class DetectorService:
+    """
+    Owns the detector instance and a bounded thread pool for inference.
+
+    The detectors are CPU-bound (PIL decode, NumPy, TensorFlow), so calling
+    them from an ``async def`` endpoint would stall every other request.
+    ``analyze`` hands the work to ``inference_workers`` threads instead; PIL,
+    NumPy and TensorFlow release the GIL in their heavy loops, so threads
+    give real parallelism without a second copy of the model.
+    """
+
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.detector = None
+        self.fallback_detector = None
+        self.backend: Optional[str] = None
+        self.model_version: Optional[str] = None
+        self.knowledge_base: Dict[str, Any] = {}
+        self.kb_version: Optional[str] = None
+        self.ready = False
+        self.load_seconds: Optional[float] = None
+        self.executor = self._make_executor()
+
+    def _make_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(
+            max_workers=max(1, self.config.inference_workers),
+            thread_name_prefix="detector",
+        )
+
+    def after_fork(self):
+        """
+        Give a forked worker its own thread pool.
+        The detector itself (and its weights) stays shared copy-on-write.
+        """
+        self.executor = self._make_executor()
+
+    def load(self):
+        """Build the detector and warm it up. Call once at startup."""
+        start = time.perf_counter()
+        self.detector, self.backend = self._build_detector()
+        # Cheap path for overload: the lightweight detector on a downscaled image
+        self.fallback_detector = (self.detector if self.backend == "lightweight"
+                                  else LeafDiseaseDetector())
+        self.model_version = self._model_version()
+        self.knowledge_base = self.detector.knowledge_base()
+        self.kb_version = knowledge_base_version(self.knowledge_base)
+        self.warm_up()
+        self.load_seconds = time.perf_counter() - start
+        self.ready = True
+        MODEL_INFO.set(1, backend=self.backend, version=self.model_version)
+        print(f"✅ {self.backend} detector ready in {self.load_seconds:.2f}s "
+              f"({self.config.inference_workers} inference workers)")
+
+    def _build_detector(self):
+        """Pick the detector according to ``config.detector_backend``."""
+        backend = self.config.detector_backend
+        model_path = self.config.cnn_model_path
+        has_model = bool(model_path) and os.path.exists(model_path)
+
+        if backend == "cnn" or (backend == "auto" and has_model):
+            # Imported lazily: TensorFlow is only needed for the CNN backend
+            from Leaf_Disease.real_cnn_model import RealDiseaseDetector
+            return RealDiseaseDetector(model_path=model_path), "cnn"
+        if backend == "stub":
+            # Fixed-latency stand-in for load tests (see stub_servers.py)
+            from stub_servers import StubDetector
+            return StubDetector(latency=self.config.stub_latency_ms / 1000), "stub"
+        if backend not in ("auto", "lightweight"):
+            raise ValueError(f"Unknown detector backend: {backend}")
+        return LeafDiseaseDetector(), "lightweight"
+
+    def _model_version(self) -> str:
+        """Identify the loaded weights for metrics and responses."""
+        if self.backend == "cnn" and self.config.cnn_model_path:
+            return os.path.basename(self.config.cnn_model_path)
+        if self.backend == "cnn":
+            return "mobilenetv2-imagenet"
+        if self.backend == "stub":
+            return f"stub-{self.config.stub_latency_ms:g}ms"
+        return "color-rules-1"
+
+    def warm_up(self):
+        """Run one dummy image through the detector so the first request isn't slow."""
+        buffer = io.BytesIO()
+        Image.new("RGB", (224, 224), (60, 140, 60)).save(buffer, format="PNG")
+        self.detector.analyze_leaf_image_bytes(buffer.getvalue())
+
+    async def analyze(self, image_bytes, degraded: bool = False) -> Dict[str, Any]:
+        """
+        Analyze one image (bytes or a binary file object) in the inference pool.
+
+        ``degraded`` runs the lightweight detector on an image downscaled to
+        ``config.degraded_image_side`` instead, and marks the result so.
+        """
+        loop = asyncio.get_running_loop()
+        if not degraded:
+            return await loop.run_in_executor(
+                self.executor, self.detector.analyze_leaf_image_bytes, image_bytes
+            )
+        result = await loop.run_in_executor(
+            self.executor, self.fallback_detector.analyze_leaf_image_bytes,
+            image_bytes, self.config.degraded_image_side
+        )
+        result["degraded"] = True
+        return result
+
+    def _analyze_images(self, images_bytes: List[Any], degraded: bool = False) -> List[Dict[str, Any]]:
+        """One chunk through the full model, or through the cheap path when degraded."""
+        if not degraded:
+            return self.detector.analyze_leaf_images_bytes(images_bytes)
+        results = self.fallback_detector.analyze_leaf_images_bytes(
+            images_bytes, self.config.degraded_image_side)
+        for result in results:
+            result["degraded"] = True
+        return results
+
+    async def analyze_batch(self, images_bytes: List[Any], degraded: bool = False) -> List[Dict[str, Any]]:
+        """
+        Analyze many images, ``config.batch_size`` per forward pass.
+
+        Chunks are submitted to the pool together, so a large batch keeps
+        every inference worker busy instead of running one image at a time.
+        """
+        loop = asyncio.get_running_loop()
+        size = max(1, self.config.batch_size)
+        chunks = [images_bytes[i:i + size] for i in range(0, len(images_bytes), size)]
+        for chunk in chunks:
+            BATCH_SIZE.observe(len(chunk))
+        chunk_results = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, self._analyze_images, chunk, degraded)
+            for chunk in chunks
+        ])
+        return [result for chunk in chunk_results for result in chunk]
+
+    async def stream_batch(
+        self, images: AsyncIterator[Tuple[str, Any]], degraded: bool = False
+    ) -> AsyncIterator[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Yield ``(index, filename, result)`` as soon as each chunk finishes.
+
+        Images are pulled from ``images`` lazily and at most
+        ``inference_workers`` chunks are in flight, so memory stays bounded
+        by ``inference_workers * batch_size`` images however long the
+        upload is. Results come back in completion order; ``index`` is the
+        position of the image in the upload.
+        """
+        size = max(1, self.config.batch_size)
+        max_in_flight = max(1, self.config.inference_workers)
+        pending = set()
+        chunk = []
+        index = 0
+
+        try:
+            async for name, image_bytes in images:
+                chunk.append((index, name, image_bytes))
+                index += 1
+                if len(chunk) < size:
+                    continue
+                pending.add(asyncio.ensure_future(self._run_chunk(chunk, degraded)))
+                chunk = []
+                while len(pending) >= max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        for item in task.result():
+                            yield item
+            if chunk:
+                pending.add(asyncio.ensure_future(self._run_chunk(chunk, degraded)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for item in task.result():
+                        yield item
+        finally:
+            # Client went away: don't leave orphaned tasks behind
+            for task in pending:
+                task.cancel()
+
+    async def _run_chunk(self, chunk, degraded: bool = False):
+        BATCH_SIZE.observe(len(chunk))
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            self.executor, self._analyze_images,
+            [image_bytes for _, _, image_bytes in chunk], degraded
+        )
+        return [(index, name, result) for (index, name, _), result in zip(chunk, results)]
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness details for the /ready probe."""
+        return {
+            "ready": self.ready,
+            "backend": self.backend,
+            "model_version": self.model_version,
+            "kb_version": self.kb_version,
+            "inference_workers": self.config.inference_workers,
+            "load_seconds": self.load_seconds,
+        }
+
+    def shutdown(self):
+        """Stop accepting work and release the thread pool."""
+        self.ready = False
+        self.executor.shutdown(wait=True)
+
+
+class FieldSummary:
+    """
+    Running field-level aggregates over the per-image results of one visit.
+
+    Only counters are kept, so a streamed batch can be summarized without
+    holding every result in memory.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.disease_counts = Counter()
+        self.severity_counts = Counter()
+        self.confidence_sum = 0.0
+        self.confidence_count = 0
+
+    def add(self, result: Dict[str, Any]):
+        self.total += 1
+        if result.get("disease_detected"):
+            self.disease_counts[result.get("disease_name", "Unknown")] += 1
+        self.severity_counts[result.get("severity", "unknown")] += 1
+        if "confidence" in result:
+            self.confidence_sum += result["confidence"]
+            self.confidence_count += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Counts per disease and severity, disease rate, mean confidence and
+        the most common disease (healthy images excluded)."""
+        diseased = sum(self.disease_counts.values())
+        return {
+            "total_images": self.total,
+            "diseased_images": diseased,
+            "healthy_images": self.total - diseased,
+            "disease_rate": round(diseased / self.total, 3) if self.total else 0.0,
+            "disease_counts": dict(self.disease_counts.most_common()),
+            "severity_counts": dict(self.severity_counts),
+            "mean_confidence": (round(self.confidence_sum / self.confidence_count, 3)
+                                if self.confidence_count else None),
+            "most_common_disease": (self.disease_counts.most_common(1)[0][0]
+                                    if self.disease_counts else None),
+        }
+
+
+def summarize_field(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Field-level aggregates for a complete list of per-image results."""
+    summary = FieldSummary()
+    for result in results:
+        summary.add(result)
+    return summary.as_dict()
@@ -0,0 +1,233 @@
+"""
+disease_risk.py
+Weather-driven disease risk from hourly forecasts, vectorized with NumPy.
+
+Each model is a published infection rule evaluated on whole arrays of
+shape (locations, days, samples per day), so one call scores every
+village of a district for every disease in milliseconds:
+
+* late_blight: Wallin severity values (hours with RH >= 90% and their
+  mean temperature), as used by Blitecast.
+* early_blight: TOM-CAST disease severity values (leaf wetness hours and
+  mean temperature while wet).
+* powdery_mildew: Gubler-Thomas risk index (+20 for each day with 6+ hours
+  at 21-30 °C, -10 for days without, or with heat above 35 °C).
+* rust: infection days with 6+ wet hours at 15-25 °C.
+
+Leaf wetness isn't forecast, so an hour counts as wet when RH >= 90% or
+rain is falling. Forecasts come from weather_service (wttr.in gives
+3 days at 3-hour steps); a sample stands for ``24 / samples`` hours.
+
+    >>> service = get_weather_service()
+    >>> table = assess(service.get_many(villages))
+    >>> spray_alerts(table)
+"""
+
+import argparse
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+WET_HUMIDITY = 90.0
+WET_RAIN_MM = 0.1
+
+# (min °C, max °C, wet-hour thresholds for severity values 1, 2, 3, 4)
+WALLIN_TABLE = (
+    (7.2, 12.2, (16, 19, 22, 25)),
+    (12.2, 15.6, (13, 16, 19, 22)),
+    (15.6, 27.0, (10, 13, 16, 19)),
+)
+TOMCAST_TABLE = (
+    (13.0, 17.0, (7, 16, 21, np.inf)),
+    (17.0, 21.0, (4, 9, 16, 23)),
+    (21.0, 25.0, (3, 6, 13, 21)),
+    (25.0, 29.0, (4, 9, 16, 23)),
+)
+
+LEVELS = np.array(["low", "moderate", "high"])
+
+# Display name, score at which the risk is moderate / high, advice when high
+DISEASES = {
+    "late_blight": ("Late Blight", 0.25, 0.5,
+                    "Spray a protectant fungicide (e.g. mancozeb) before the wet spell"),
+    "early_blight": ("Early Blight", 0.25, 0.5,
+                     "Spray chlorothalonil or copper; remove lower infected leaves"),
+    "powdery_mildew": ("Powdery Mildew", 0.4, 0.6,
+                       "Apply sulphur or neem oil; improve air flow"),
+    "rust": ("Rust", 0.33, 0.66,
+             "Scout for pustules; apply a triazole fungicide if found"),
+}
+
+
+def _severity_values(wet_hours: np.ndarray, wet_temp: np.ndarray, table) -> np.ndarray:
+    """Daily severity values 0-4 from a (temperature band -> wet-hour thresholds) table."""
+    dsv = np.zeros(wet_hours.shape, dtype=np.int8)
+    for low, high, thresholds in table:
+        band = (wet_temp >= low) & (wet_temp < high)
+        values = np.searchsorted(np.asarray(thresholds, dtype=float), wet_hours, side="right")
+        dsv = np.where(band, values, dsv)
+    return dsv
+
+
+def _daily(values: np.ndarray, samples_per_day: int) -> np.ndarray:
+    """(locations, hours) -> (locations, days, samples), dropping an incomplete last day."""
+    days = values.shape[1] // samples_per_day
+    return values[:, :days * samples_per_day].reshape(values.shape[0], days, samples_per_day)
+
+
+def risk_scores(temp_c: np.ndarray, humidity: np.ndarray, precip_mm: np.ndarray,
+                samples_per_day: int = 8) -> Dict[str, np.ndarray]:
+    """
+    Risk score (0-1) per location for every disease model.
+
+    Args:
+        temp_c, humidity, precip_mm: Arrays of shape (locations, samples),
+            evenly spaced forecasts starting at midnight.
+        samples_per_day: Forecast samples per day (8 for 3-hourly).
+
+    Returns:
+        Disease key -> array of shape (locations,).
+    """
+    temp = _daily(np.asarray(temp_c, dtype=float), samples_per_day)
+    rh = _daily(np.asarray(humidity, dtype=float), samples_per_day)
+    rain = _daily(np.asarray(precip_mm, dtype=float), samples_per_day)
+    step_hours = 24.0 / samples_per_day
+    days = temp.shape[1]
+    if days == 0:
+        raise ValueError("Forecasts must cover at least one full day")
+
+    humid = rh >= WET_HUMIDITY
+    wet = humid | (rain > WET_RAIN_MM)
+
+    def hours_and_mean_temp(mask):
+        count = mask.sum(axis=-1)
+        mean = np.where(mask, temp, 0.0).sum(axis=-1) / np.maximum(count, 1)
+        return count * step_hours, np.where(count > 0, mean, np.nan)
+
+    humid_hours, humid_temp = hours_and_mean_temp(humid)
+    wet_hours, wet_temp = hours_and_mean_temp(wet)
+
+    late_blight = _severity_values(humid_hours, humid_temp, WALLIN_TABLE).sum(axis=-1) / (4 * days)
+    early_blight = _severity_values(wet_hours, wet_temp, TOMCAST_TABLE).sum(axis=-1) / (4 * days)
+
+    # Gubler-Thomas: the index is kept between 0 and 100 as it accumulates
+    mildew_hours = ((temp >= 21) & (temp <= 30)).sum(axis=-1) * step_hours
+    favourable = (mildew_hours >= 6) & ~(temp > 35).any(axis=-1)
+    index = np.zeros(temp.shape[0])
+    for day in range(days):
+        index = np.clip(index + np.where(favourable[:, day], 20, -10), 0, 100)
+    powdery_mildew = index / 100
+
+    rust_days = (wet_hours >= 6) & (wet_temp >= 15) & (wet_temp <= 25)
+    rust = rust_days.sum(axis=-1) / days
+
+    return {
+        "late_blight": late_blight,
+        "early_blight": early_blight,
+        "powdery_mildew": powdery_mildew,
+        "rust": rust,
+    }
+
+
+def forecast_arrays(forecasts: List[Dict[str, Any]]):
+    """
+    Stack weather_service results into (locations, samples) arrays.
+    All forecasts are cut to the shortest one.
+    """
+    length = min(len(forecast["hourly"]) for forecast in forecasts)
+    def column(field):
+        return np.array([[hour[field] for hour in forecast["hourly"][:length]] for forecast in forecasts],
+                        dtype=float)
+    return column("temp_c"), column("humidity"), column("precip_mm")
+
+
+def assess(forecasts: Dict[str, Optional[Dict[str, Any]]], samples_per_day: int = 8) -> Dict[str, Any]:
+    """
+    Risk table for many locations at once (e.g. WeatherService.get_many).
+
+    Returns:
+        {"locations": [...], "diseases": [...], "score": (L, K) array,
+        "level": (L, K) array of "low"/"moderate"/"high"}. Locations
+        without a usable forecast (missing, or shorter than one day, e.g.
+        a truncated reply) are left out.
+    """
+    usable = {name: forecast for name, forecast in forecasts.items()
+              if forecast and len(forecast.get("hourly") or []) >= samples_per_day}
+    diseases = list(DISEASES)
+    if not usable:
+        return {"locations": [], "diseases": diseases, "score": np.zeros((0, len(diseases))),
+                "level": np.zeros((0, len(diseases)), dtype=LEVELS.dtype)}
+    scores = risk_scores(*forecast_arrays(list(usable.values())), samples_per_day=samples_per_day)
+    score = np.stack([scores[key] for key in diseases], axis=1)
+    moderate = np.array([DISEASES[key][1] for key in diseases])
+    high = np.array([DISEASES[key][2] for key in diseases])
+    level = LEVELS[(score >= moderate).astype(int) + (score >= high).astype(int)]
+    return {"locations": list(usable), "diseases": diseases, "score": score, "level": level}
+
+
+def location_risk(forecast: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Per-disease risk for one location, highest first (for the sidebar and
+    assistant); empty when the forecast is too short to judge.
+    """
+    table = assess({"here": forecast})
+    if not table["locations"]:
+        return []
+    rows = [
+        {"disease": key, "name": DISEASES[key][0], "score": round(float(score), 2),
+         "level": str(level), "advice": DISEASES[key][3]}
+        for key, score, level in zip(table["diseases"], table["score"][0], table["level"][0])
+    ]
+    return sorted(rows, key=lambda row: -row["score"])
+
+
+def spray_alerts(table: Dict[str, Any], level: str = "high") -> List[Dict[str, Any]]:
+    """Location/disease pairs at or above ``level``, for district-wide alerts."""
+    minimum = int(np.flatnonzero(LEVELS == level)[0])
+    ranks = (table["level"][..., None] == LEVELS).argmax(axis=-1)
+    rows, cols = np.nonzero(ranks >= minimum)
+    return [
+        {
+            "location": table["locations"][row],
+            "disease": table["diseases"][col],
+            "name": DISEASES[table["diseases"][col]][0],
+            "score": round(float(table["score"][row, col]), 2),
+            "level": str(table["level"][row, col]),
+            "advice": DISEASES[table["diseases"][col]][3],
+        }
+        for row, col in zip(rows, cols)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disease risk for many locations")
+    parser.add_argument("locations", nargs="*", help="Villages/towns to fetch from the weather service")
+    parser.add_argument("--benchmark", type=int, default=0,
+                        help="Score this many synthetic locations instead and report the time")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        rng = np.random.default_rng(0)
+        shape = (args.benchmark, 24)
+        temp = rng.uniform(10, 34, shape)
+        humidity = rng.uniform(50, 100, shape)
+        precip = np.where(rng.random(shape) < 0.2, rng.uniform(0.2, 5, shape), 0.0)
+        start = time.perf_counter()
+        scores = risk_scores(temp, humidity, precip)
+        elapsed = time.perf_counter() - start
+        print(f"{args.benchmark} locations x {len(scores)} diseases in {elapsed * 1000:.1f} ms")
+        return
+
+    from weather_service import get_weather_service
+
+    table = assess(get_weather_service().get_many(args.locations))
+    print(f"{'location':<20}" + "".join(f"{DISEASES[key][0]:>16}" for key in table["diseases"]))
+    for location, scores, levels in zip(table["locations"], table["score"], table["level"]):
+        print(f"{location:<20}" + "".join(f"{level:>10} {score:4.2f}" for score, level in zip(scores, levels)))
+    for alert in spray_alerts(table):
+        print(f"🚨 {alert['location']}: {alert['name']} risk high - {alert['advice']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+frame_stream.py
+Helpers for live camera-frame analysis over a WebSocket.
+
+Frames arrive faster than the detector can keep up when a phone camera sweeps
+a crop row. ``LatestFrameSlot`` keeps only the newest frame (latest wins) so
+inference never works through a backlog of stale images, and
+``PredictionSmoother`` steadies the label shown to the user across frames.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class Frame:
+    """One received camera frame."""
+    frame_id: int
+    data: bytes
+    received_at: float  # time.perf_counter() when the frame arrived
+
+
+class LatestFrameSlot:
+    """
+    Single-slot mailbox between the WebSocket receiver and the inference loop.
+
+    ``put`` overwrites any frame that hasn't been picked up yet and counts it
+    as dropped; ``get`` waits for the next frame and returns None once the
+    slot is closed and empty.
+    """
+
+    def __init__(self):
+        self._frame: Optional[Frame] = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, data: bytes):
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = Frame(self.received, data, time.perf_counter())
+        self._event.set()
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+    async def get(self) -> Optional[Frame]:
+        await self._event.wait()
+        if not self._closed:
+            self._event.clear()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+class PredictionSmoother:
+    """
+    Exponentially weighted vote over recent per-frame predictions.
+
+    Each frame adds ``alpha * confidence`` to its label's score after all
+    scores decay by ``1 - alpha``. The smoothed label is the top score and
+    its confidence is bias-corrected, so a label seen on every frame with
+    confidence c converges to c. A single odd frame barely moves the output.
+
+    Args:
+        alpha: Weight of the newest frame, 0 < alpha <= 1. Higher reacts faster.
+
+    Raises:
+        ValueError: If alpha is outside (0, 1]; 0 would never weight a frame.
+    """
+
+    def __init__(self, alpha: float = 0.4):
+        if not 0 < alpha <= 1:
+            raise ValueError(f"alpha must be in (0, 1], got {alpha}")
+        self.alpha = alpha
+        self.scores: Dict[str, float] = {}
+        self.detected: Dict[str, bool] = {}
+        self.frames = 0
+
+    def update(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        name = result.get("disease_name", "Unknown")
+        confidence = float(result.get("confidence", 0.0))
+        decay = 1.0 - self.alpha
+
+        self.frames += 1
+        for label in list(self.scores):
+            self.scores[label] *= decay
+            if self.scores[label] < 1e-4:
+                del self.scores[label]
+        self.scores[name] = self.scores.get(name, 0.0) + self.alpha * confidence
+        self.detected[name] = bool(result.get("disease_detected"))
+
+        best = max(self.scores, key=self.scores.get)
+        norm = 1.0 - decay ** self.frames
+        return {
+            "disease_name": best,
+            "disease_detected": self.detected.get(best, False),
+            "confidence": round(min(self.scores[best] / norm, 1.0), 3),
+            "frames": self.frames,
+        }
+
+    def reset(self):
+        self.scores.clear()
+        self.detected.clear()
+        self.frames = 0
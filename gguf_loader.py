@@ -0,0 +1,421 @@
+"""
+gguf_loader.py
+Hardware-aware loading of GGUF models with llama.cpp.
+
+The Sinong wrapper used to load with a fixed 8 threads, which on a 4-core
+field laptop oversubscribes the CPU: token generation is bound by memory
+bandwidth, so threads beyond the physical cores (or hyper-threads) only
+add contention. This module looks at the host and the model file and
+picks the settings instead:
+
+* threads = physical cores (for prompt processing and generation),
+* prompt batch size from the RAM left once the model and KV cache fit,
+* mmap always (the model pages in from the OS file cache, so restarts
+  and reloads are fast and several processes share one copy), mlock only
+  when asked for and the whole model fits in available RAM,
+* a smaller quantization next to the requested file (Q5_K_M -> Q4_K_M ->
+  Q3_K_M, as saved by download_sinong.py) when the model doesn't fit.
+
+``load_model`` reports load time and resident memory. Explicit AppConfig
+values (LLM_THREADS, LLM_BATCH_SIZE, ...) win over everything; otherwise
+settings saved by ``python gguf_loader.py --benchmark``, which times the
+candidates on this machine, win over the heuristics.
+"""
+
+import argparse
+import json
+import os
+import re
+import struct
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from llama_cpp import Llama
+
+from Leaf_Disease.config import AppConfig
+
+GIB = 1024 ** 3
+
+# llama.cpp's general.file_type values for the quantizations we ship or may meet
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K",
+}
+# Smallest first; fallbacks are looked for in this order below the requested one
+QUANT_ORDER = ["Q2_K", "Q3_K_S", "Q3_K_M", "Q3_K_L", "Q4_0", "Q4_K_S", "Q4_K_M", "Q5_K_S", "Q5_K_M",
+               "Q6_K", "Q8_0", "F16"]
+_QUANT_IN_NAME = re.compile(r"(?i)(Q\d_K_[SML]|Q\d_K|Q\d_\d|F16|F32)")
+
+# GGUF metadata value types -> struct format (8 = string, 9 = array)
+_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+
+
+def physical_cores() -> int:
+    """Physical CPU cores (hyper-threads not counted), falling back to logical CPUs."""
+    try:
+        cores = set()
+        physical_id = "0"
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    cores.add((physical_id, value.strip()))
+        if cores:
+            return min(len(cores), os.cpu_count() or len(cores))
+    except OSError:
+        pass
+    return os.cpu_count() or 1
+
+
+def available_ram() -> int:
+    """Bytes of RAM available to new allocations (MemAvailable on Linux)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def resident_memory() -> int:
+    """Resident set size of this process in bytes (0 if unknown)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def read_gguf_metadata(path: str) -> Dict[str, Any]:
+    """
+    Scalar and string metadata from a GGUF header. Arrays such as the
+    vocabulary are skipped; only their length is kept, as "<key>.length".
+    Returns {} for files that aren't GGUF v2/v3.
+    """
+    def read(fmt):
+        size = struct.calcsize(fmt)
+        data = f.read(size)
+        if len(data) != size:
+            raise EOFError
+        return struct.unpack(fmt, data)[0]
+
+    def read_string():
+        return f.read(read("<Q")).decode("utf-8", errors="replace")
+
+    def skip_array():
+        item_type, count = read("<I"), read("<Q")
+        if item_type in _SCALARS:
+            f.seek(struct.calcsize(_SCALARS[item_type]) * count, os.SEEK_CUR)
+        else:
+            for _ in range(count):
+                read_value(item_type)
+        return count
+
+    def read_value(value_type):
+        if value_type in _SCALARS:
+            return read(_SCALARS[value_type])
+        if value_type == 8:
+            return read_string()
+        if value_type == 9:
+            skip_array()
+            return None
+        raise ValueError(f"Unknown GGUF value type {value_type}")
+
+    metadata = {}
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) != b"GGUF" or read("<I") < 2:
+                return {}
+            read("<Q")  # Tensor count
+            for _ in range(read("<Q")):
+                key = read_string()
+                value_type = read("<I")
+                if value_type == 9:
+                    metadata[f"{key}.length"] = skip_array()
+                else:
+                    metadata[key] = read_value(value_type)
+    except (OSError, EOFError, ValueError, UnicodeDecodeError):
+        pass
+    return metadata
+
+
+def quantization(path: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+    """Quantization of a model file, from its header or else its name ("unknown" if neither)."""
+    metadata = read_gguf_metadata(path) if metadata is None else metadata
+    if "general.file_type" in metadata:
+        return FILE_TYPES.get(metadata["general.file_type"], f"type{metadata['general.file_type']}")
+    match = _QUANT_IN_NAME.search(os.path.basename(path))
+    return match.group(1).upper() if match else "unknown"
+
+
+def kv_cache_bytes(metadata: Dict[str, Any], n_ctx: int) -> int:
+    """f16 KV cache size for ``n_ctx`` tokens (0 if the header doesn't say)."""
+    arch = metadata.get("general.architecture")
+    layers = metadata.get(f"{arch}.block_count")
+    embedding = metadata.get(f"{arch}.embedding_length")
+    heads = metadata.get(f"{arch}.attention.head_count")
+    if not (layers and embedding and heads):
+        return 0
+    kv_heads = metadata.get(f"{arch}.attention.head_count_kv", heads)
+    return 2 * n_ctx * layers * (embedding * kv_heads // heads) * 2
+
+
+def logits_bytes(metadata: Dict[str, Any], n_ctx: int) -> int:
+    """
+    float32 logits for every position of ``n_ctx`` (0 if the header doesn't
+    give the vocabulary size). llama.cpp keeps these only with logits_all,
+    which a draft model turns on.
+    """
+    arch = metadata.get("general.architecture")
+    vocab = metadata.get(f"{arch}.vocab_size") or metadata.get("tokenizer.ggml.tokens.length") or 0
+    return 4 * n_ctx * vocab
+
+
+def smaller_model(model_path: str, budget: int) -> Optional[str]:
+    """The largest lower quantization of the same model, next to it, that fits ``budget`` bytes."""
+    quant = quantization(model_path)
+    if quant not in QUANT_ORDER:
+        return None
+    base = os.path.basename(model_path)
+    directory = os.path.dirname(model_path) or "."
+    for lower in reversed(QUANT_ORDER[:QUANT_ORDER.index(quant)]):
+        candidate = os.path.join(directory, re.sub(re.escape(quant), lower, base, flags=re.IGNORECASE))
+        if candidate != model_path and os.path.exists(candidate) and os.path.getsize(candidate) <= budget:
+            return candidate
+    return None
+
+
+@dataclass
+class LoadProfile:
+    """llama.cpp settings for one model on one machine."""
+
+    model_path: str
+    n_ctx: int = 2048
+    n_threads: int = 1
+    n_threads_batch: int = 1
+    n_batch: int = 512
+    n_gpu_layers: int = -1
+    use_mmap: bool = True
+    use_mlock: bool = False
+    quantization: str = "unknown"
+    source: str = "auto"  # "auto", "benchmark" or "config"
+
+    def llama_kwargs(self) -> Dict[str, Any]:
+        return {
+            "model_path": self.model_path,
+            "n_ctx": self.n_ctx,
+            "n_threads": self.n_threads,
+            "n_threads_batch": self.n_threads_batch,
+            "n_batch": self.n_batch,
+            "n_gpu_layers": self.n_gpu_layers,
+            "use_mmap": self.use_mmap,
+            "use_mlock": self.use_mlock,
+        }
+
+
+def _host_key(model_path: str) -> Dict[str, Any]:
+    """What a saved benchmark result is only valid for."""
+    stat = os.stat(model_path)
+    return {"model": os.path.abspath(model_path), "size": stat.st_size, "cpus": os.cpu_count(),
+            "cores": physical_cores()}
+
+
+def load_saved_profile(config: AppConfig, model_path: str) -> Optional[Dict[str, Any]]:
+    """Settings from --benchmark for this model and machine, if any."""
+    try:
+        with open(config.llm_profile_path) as f:
+            saved = json.load(f)
+        return saved["settings"] if saved.get("host") == _host_key(model_path) else None
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def choose_profile(model_path: str, config: Optional[AppConfig] = None, use_saved: bool = True,
+                   draft_model_path: Optional[str] = None) -> LoadProfile:
+    """
+    Settings for loading ``model_path`` here (possibly a smaller
+    quantization of it, see module docstring). With a
+    ``draft_model_path`` the RAM budget also covers the draft model, its
+    KV cache and the per-position logits speculative decoding needs.
+    """
+    config = config or AppConfig.from_env(require_api_key=False)
+    cores = physical_cores()
+    free = available_ram()
+    n_ctx = config.llm_context
+
+    draft_bytes = 0
+    if draft_model_path:
+        draft_bytes = os.path.getsize(draft_model_path) + kv_cache_bytes(read_gguf_metadata(draft_model_path), n_ctx)
+
+    def overhead(metadata):
+        """Bytes needed besides the model file itself."""
+        extra = kv_cache_bytes(metadata, n_ctx)
+        if draft_model_path:
+            extra += draft_bytes + logits_bytes(metadata, n_ctx)
+        return extra
+
+    metadata = read_gguf_metadata(model_path)
+    needed = os.path.getsize(model_path) + overhead(metadata)
+    if free and needed > free:
+        fallback = smaller_model(model_path, free - overhead(metadata))
+        if fallback:
+            print(f"⚠️ {os.path.basename(model_path)} needs {needed / GIB:.1f} GiB but {free / GIB:.1f} GiB is "
+                  f"free; using {os.path.basename(fallback)}")
+            model_path = fallback
+            metadata = read_gguf_metadata(model_path)
+            needed = os.path.getsize(model_path) + overhead(metadata)
+        else:
+            print(f"⚠️ {os.path.basename(model_path)} needs {needed / GIB:.1f} GiB but only {free / GIB:.1f} GiB "
+                  f"is free; it will page from disk (slow)")
+
+    # Compute buffers grow with the batch; keep it small when RAM is tight
+    headroom = free - needed if free else GIB
+    profile = LoadProfile(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=cores,
+        n_threads_batch=cores,
+        n_batch=512 if headroom >= GIB else 256 if headroom >= GIB // 4 else 128,
+        n_gpu_layers=config.llm_gpu_layers,
+        quantization=quantization(model_path, metadata),
+    )
+
+    saved = load_saved_profile(config, model_path) if use_saved else None
+    if saved:
+        profile.n_threads = saved["n_threads"]
+        profile.n_threads_batch = saved["n_threads_batch"]
+        profile.n_batch = saved["n_batch"]
+        profile.source = "benchmark"
+
+    if config.llm_threads:
+        profile.n_threads = profile.n_threads_batch = config.llm_threads
+        profile.source = "config"
+    if config.llm_batch_size:
+        profile.n_batch = config.llm_batch_size
+        profile.source = "config"
+
+    if config.llm_use_mlock:
+        if free and needed > free * 0.8:
+            print(f"⚠️ Not locking the model in RAM: it needs {needed / GIB:.1f} GiB of {free / GIB:.1f} GiB free")
+        else:
+            profile.use_mlock = True
+    return profile
+
+
+def load_model(profile: LoadProfile, draft_model=None):
+    """
+    Load a llama.cpp model with ``profile`` (and optionally a
+    LlamaDraftModel for speculative decoding, see speculative.py).
+
+    Returns:
+        (Llama, report) where report has the profile plus load_seconds,
+        rss_before_mb and rss_after_mb (with mmap, RSS counts the pages
+        touched so far, not the whole file).
+    """
+    rss_before = resident_memory()
+    start = time.perf_counter()
+    llm = Llama(**profile.llama_kwargs(), draft_model=draft_model, verbose=False)
+    report = dict(
+        asdict(profile),
+        load_seconds=round(time.perf_counter() - start, 2),
+        rss_before_mb=round(rss_before / 2 ** 20),
+        rss_after_mb=round(resident_memory() / 2 ** 20),
+    )
+    print(f"✅ {os.path.basename(profile.model_path)} ({profile.quantization}) loaded in "
+          f"{report['load_seconds']:.2f}s: {profile.n_threads} threads, batch {profile.n_batch}, "
+          f"mmap={'on' if profile.use_mmap else 'off'}, mlock={'on' if profile.use_mlock else 'off'}, "
+          f"RSS {report['rss_after_mb']} MB ({profile.source} settings)")
+    return llm, report
+
+
+def benchmark(model_path: str, config: AppConfig, prompt_repeats: int = 8,
+              generate_tokens: int = 32) -> List[Dict[str, Any]]:
+    """
+    Time prompt processing and generation for each candidate thread count
+    and batch size. The model is reloaded per candidate; with mmap the
+    reloads come from the OS file cache.
+    """
+    from sinong_gguf_wrapper import PREAMBLE
+
+    base = choose_profile(model_path, config, use_saved=False)
+    cores = physical_cores()
+    thread_options = sorted({max(1, cores // 2), cores, os.cpu_count() or cores})
+    batch_options = sorted({base.n_batch, min(base.n_batch, 256)})
+    results = []
+    for threads in thread_options:
+        for n_batch in batch_options:
+            profile = LoadProfile(**dict(asdict(base), n_threads=threads, n_threads_batch=threads,
+                                         n_batch=n_batch, source="benchmark"))
+            llm, report = load_model(profile)
+            prompt = llm.tokenize((PREAMBLE * prompt_repeats).encode("utf-8"))
+            start = time.perf_counter()
+            first = None
+            tokens = 0
+            for _ in llm(prompt, max_tokens=generate_tokens, temperature=0.0, stream=True):
+                first = first or time.perf_counter()
+                tokens += 1
+            end = time.perf_counter()
+            results.append({
+                "n_threads": threads,
+                "n_threads_batch": threads,
+                "n_batch": n_batch,
+                "load_seconds": report["load_seconds"],
+                "rss_mb": round(resident_memory() / 2 ** 20),
+                "prompt_tokens_per_second": round(len(prompt) / (first - start), 1) if first else 0.0,
+                "tokens_per_second": round((tokens - 1) / (end - first), 2) if tokens > 1 else 0.0,
+            })
+            print(f"   threads={threads:<3} batch={n_batch:<4} prompt "
+                  f"{results[-1]['prompt_tokens_per_second']:>8.1f} t/s, generation "
+                  f"{results[-1]['tokens_per_second']:>6.2f} t/s")
+            del llm
+    return results
+
+
+def save_profile(config: AppConfig, model_path: str, best: Dict[str, Any], results: List[Dict[str, Any]]):
+    os.makedirs(os.path.dirname(config.llm_profile_path) or ".", exist_ok=True)
+    with open(config.llm_profile_path + ".tmp", "w") as f:
+        json.dump({"host": _host_key(model_path), "settings": best, "results": results,
+                   "measured_at": time.time()}, f, indent=2)
+    os.replace(config.llm_profile_path + ".tmp", config.llm_profile_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick llama.cpp settings for this machine")
+    parser.add_argument("--model-path", default=None, help="GGUF file (default SINONG_MODEL_PATH)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Time the candidate settings and save the fastest to LLM_PROFILE_PATH")
+    args = parser.parse_args()
+
+    from sinong_gguf_wrapper import DEFAULT_MODEL_PATH
+
+    config = AppConfig.from_env(require_api_key=False)
+    model_path = args.model_path or os.getenv("SINONG_MODEL_PATH", DEFAULT_MODEL_PATH)
+    print(f"🖥️ {physical_cores()} physical cores, {os.cpu_count()} logical CPUs, "
+          f"{available_ram() / GIB:.1f} GiB RAM available")
+    if not args.benchmark:
+        profile = choose_profile(model_path, config)
+        print(json.dumps(asdict(profile), indent=2))
+        return
+
+    results = benchmark(model_path, config)
+    # Chat speed is what farmers notice; prompt speed breaks ties
+    best = max(results, key=lambda r: (r["tokens_per_second"], r["prompt_tokens_per_second"]))
+    save_profile(config, model_path, best, results)
+    print(f"💾 Saved threads={best['n_threads']} batch={best['n_batch']} to {config.llm_profile_path}")
+
+
+if __name__ == "__main__":
+    main()
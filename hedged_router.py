@@ -0,0 +1,346 @@
+"""
+hedged_router.py
+Race the local detector against Plant.id and answer with the first
+confident result.
+
+Local inference starts immediately. If it hasn't produced a confident
+answer within the hedge delay (0 = start both at once), the Plant.id call
+is issued as well; whichever result first reaches
+``confidence_threshold`` wins and the other side is cancelled. When
+neither is confident, the more confident of the two is returned once both
+are in, and ``deadline`` caps the wait for Plant.id, so the local model
+bounds the tail latency while Plant.id's broader coverage is still used
+for the hard cases.
+
+By default the hedge delay follows the local detector: it is the p95 of
+its recent latencies, so Plant.id is only asked early when the local
+model is slower than usual (and not on every image when the hardware is
+slower than a fixed delay assumed). Images the local model isn't sure
+about still wait for Plant.id once the local answer is in: they cost
+roughly local + Plant.id latency, which is what moves the median; the
+confident majority and the tail stay bounded by the local model.
+
+Whenever both verdicts are available (including a local one that
+finishes after Plant.id already won: its executor thread can't be
+interrupted anyway), they are compared and counted in
+crop_router_agreement_total, which tells whether the local model can be
+trusted with more traffic.
+
+Results have the PlantIDService result format plus ``source`` and
+``routing``; with ``detector_format`` they have the local detectors'
+format instead (the API and the Streamlit app, whose clients expect it).
+The detectors' "unclear" answer (image couldn't be analysed) carries a
+fixed confidence, so the router scores it as 0.
+
+The API routes /disease-detection-file through the race when
+PLANT_ID_ROUTING is set, and so does the Streamlit app.
+
+Benchmark against the stand-in backends:
+    python hedged_router.py --images 200 --threshold 0.8
+    python hedged_router.py --images 200 --hedge-delay 0   # Always ask both at once
+"""
+
+import argparse
+import asyncio
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from Leaf_Disease.metrics import ROUTER_AGREEMENT, ROUTER_DECISIONS
+from plant_id_service import LOCAL_FALLBACK, AsyncPlantIDClient, PlantIDService
+
+LOCAL = "local"
+REMOTE = "plant_id"
+
+# Words too common in disease names to count as agreement on their own
+_GENERIC_WORDS = {"leaf", "leaves", "spot", "spots", "disease", "plant", "virus", "of", "the"}
+
+# disease_id of the detectors' fallback for images they couldn't analyse
+UNCLEAR = "unclear"
+
+# Adaptive hedge delay: used until enough local latencies have been seen
+DEFAULT_HEDGE_DELAY = 0.3
+MIN_LATENCY_SAMPLES = 20
+
+
+def _name_words(result: Dict[str, Any]):
+    return set(re.findall(r"[a-z]+", str(result.get("disease_name", "")).lower())) - _GENERIC_WORDS
+
+
+def as_detector_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """A PlantIDService-format result in the local detectors' format (confidence 0-1, treatment text)."""
+    treatment = result.get("treatment") or []
+    detector_result = {
+        "disease_detected": bool(result.get("disease_detected")),
+        "confidence": round(result.get("confidence", 0.0) / 100, 3),
+        "disease_name": result.get("disease_name", "Unknown"),
+        "disease_type": result.get("disease_type", "unknown"),
+        "severity": result.get("severity", "moderate"),
+        "symptoms": result.get("symptoms") or [],
+        "treatment": " ".join(treatment) if isinstance(treatment, list) else treatment,
+        "organic_solutions": [],
+        "possible_causes": result.get("possible_causes") or [],
+    }
+    if result.get("similar_images"):
+        detector_result["similar_images"] = result["similar_images"]
+    return detector_result
+
+
+def compare_verdicts(local: Dict[str, Any], remote: Dict[str, Any]) -> str:
+    """
+    "agree", "disagree_health" (one says healthy) or "disagree_disease".
+    Disease names come from different vocabularies, so they match when
+    they share a significant word ("Early Blight" vs "Tomato early blight").
+    """
+    if bool(local.get("disease_detected")) != bool(remote.get("disease_detected")):
+        return "disagree_health"
+    if not local.get("disease_detected") or _name_words(local) & _name_words(remote):
+        return "agree"
+    return "disagree_disease"
+
+
+class HedgedRouter:
+    """
+    Local-first hedged race between a local detector and Plant.id.
+
+    Args:
+        detector: Object with ``analyze_leaf_image_bytes`` (default: the
+            detector behind Plant.id's local fallback).
+        analyze_local: Coroutine function analysing image bytes locally
+            instead of ``detector`` in a thread, e.g. DetectorService.analyze.
+        remote: Plant.id client; by default one is created with its own
+            local fallback disabled (the router already has the local answer).
+        hedge_delay: Seconds to give the local detector before also asking
+            Plant.id; None follows the p95 of the last ``latency_window``
+            local latencies (DEFAULT_HEDGE_DELAY until there are enough).
+        confidence_threshold: Confidence (0-1) that ends the race.
+        deadline: Seconds after which Plant.id is given up on.
+        log_every: Print the agreement statistics every this many comparisons.
+        latency_window: Local latencies kept for the adaptive hedge delay.
+        detector_format: Return results in the local detectors' format
+            (Plant.id answers converted with as_detector_result).
+    """
+
+    def __init__(self, detector=None, remote: Optional[AsyncPlantIDClient] = None,
+                 hedge_delay: Optional[float] = None, confidence_threshold: float = 0.8,
+                 deadline: float = 8.0, log_every: int = 50, latency_window: int = 200,
+                 analyze_local: Optional[Callable[[bytes], Awaitable[Dict[str, Any]]]] = None,
+                 detector_format: bool = False):
+        self.analyze_local = analyze_local
+        self.detector = detector or (None if analyze_local else LOCAL_FALLBACK.get_detector())
+        self.detector_format = detector_format
+        self._owns_remote = remote is None
+        self.remote = remote or AsyncPlantIDClient(fallback=False)
+        self.hedge_delay = hedge_delay
+        self.confidence_threshold = confidence_threshold
+        self.deadline = deadline
+        self.log_every = log_every
+        self._local_seconds = deque(maxlen=latency_window)
+        self.decisions: Dict[str, int] = {}
+        self.agreement = {"agree": 0, "disagree_health": 0, "disagree_disease": 0}
+
+    async def __aenter__(self) -> "HedgedRouter":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_remote:
+            await self.remote.aclose()
+
+    def current_hedge_delay(self) -> float:
+        """Seconds the local detector gets before Plant.id is asked too."""
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if len(self._local_seconds) < MIN_LATENCY_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        latencies = sorted(self._local_seconds)
+        return min(latencies[int(0.95 * (len(latencies) - 1))], self.deadline)
+
+    async def _run_local(self, image_bytes: bytes) -> Dict[str, Any]:
+        start = time.monotonic()
+        if self.analyze_local is not None:
+            raw = await self.analyze_local(image_bytes)
+        else:
+            raw = await asyncio.to_thread(self.detector.analyze_leaf_image_bytes, image_bytes)
+        self._local_seconds.append(time.monotonic() - start)
+        if raw.get("disease_id") == UNCLEAR:
+            raw = dict(raw, confidence=0.0)  # Its fixed confidence must not win the race
+        return raw if self.detector_format else PlantIDService._format_local_result(raw)
+
+    async def _run_remote(self, image_bytes: bytes) -> Optional[Dict[str, Any]]:
+        result = await self.remote.analyze_image(image_bytes)
+        if result is not None and self.detector_format:
+            return as_detector_result(result)
+        return result
+
+    @staticmethod
+    def _outcome(task: asyncio.Task) -> Optional[Dict[str, Any]]:
+        if task.cancelled() or task.exception() is not None:
+            if not task.cancelled():
+                print(f"⚠️ Router: detector failed: {task.exception()!r}")
+            return None
+        return task.result()
+
+    def _confident(self, result: Optional[Dict[str, Any]]) -> bool:
+        scale = 1 if self.detector_format else 100
+        return result is not None and result.get("confidence", 0.0) / scale >= self.confidence_threshold
+
+    async def analyze(self, image_bytes: bytes) -> Dict[str, Any]:
+        """
+        Analyze one image through the race.
+
+        Raises:
+            RuntimeError: Neither the local detector nor Plant.id produced
+                a result.
+        """
+        start = time.monotonic()
+        local = asyncio.ensure_future(self._run_local(image_bytes))
+        tasks = {local: LOCAL}
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+
+        done, _ = await asyncio.wait({local}, timeout=self.current_hedge_delay())
+        if done:
+            results[LOCAL] = self._outcome(local)
+            if self._confident(results[LOCAL]):
+                return self._finish(results[LOCAL], LOCAL, "confident", start, hedged=False)
+
+        remote = asyncio.ensure_future(self._run_remote(image_bytes))
+        tasks[remote] = REMOTE
+        pending = {task for task in tasks if tasks[task] not in results}
+        winner, reason = None, "best_available"
+        while pending and winner is None:
+            timeout = max(0.0, start + self.deadline - time.monotonic()) if remote in pending else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                remote.cancel()  # Plant.id is too slow; the local answer will do
+                pending.discard(remote)
+                reason = "deadline"
+                continue
+            for task in done:
+                results[tasks[task]] = self._outcome(task)
+            # If both finished together the more confident one wins
+            confident = [tasks[task] for task in done if self._confident(results[tasks[task]])]
+            if confident:
+                winner = max(confident, key=lambda source: results[source]["confidence"])
+                reason = "confident"
+
+        for task in pending:
+            if tasks[task] == REMOTE:
+                task.cancel()
+        if LOCAL in results and REMOTE in results and results[LOCAL] and results[REMOTE]:
+            self._record_agreement(results[LOCAL], results[REMOTE])
+        elif winner == REMOTE and results[REMOTE] and not local.done():
+            # The local thread keeps running regardless; compare once it's done
+            remote_result = results[REMOTE]
+            local.add_done_callback(
+                lambda task: self._outcome(task) and self._record_agreement(task.result(), remote_result))
+
+        if winner is None:
+            available = [(source, result) for source, result in results.items() if result]
+            if not available:
+                ROUTER_DECISIONS.inc(winner="none", reason="failed")
+                raise RuntimeError("Neither the local detector nor Plant.id produced a result")
+            winner = max(available, key=lambda item: item[1].get("confidence", 0.0))[0]
+        return self._finish(results[winner], winner, reason, start, hedged=True)
+
+    def _finish(self, result: Dict[str, Any], winner: str, reason: str, start: float,
+                hedged: bool) -> Dict[str, Any]:
+        ROUTER_DECISIONS.inc(winner=winner, reason=reason)
+        key = f"{winner}:{reason}"
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        result = dict(result, source=winner)
+        result["routing"] = {
+            "winner": winner,
+            "reason": reason,
+            "hedged": hedged,
+            "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        }
+        return result
+
+    def _record_agreement(self, local: Dict[str, Any], remote: Dict[str, Any]):
+        verdict = compare_verdicts(local, remote)
+        ROUTER_AGREEMENT.inc(result=verdict)
+        self.agreement[verdict] += 1
+        compared = sum(self.agreement.values())
+        if self.log_every and compared % self.log_every == 0:
+            print(f"🔀 Router: local and Plant.id agree on {self.agreement['agree']}/{compared} images")
+
+    def stats(self) -> Dict[str, Any]:
+        compared = sum(self.agreement.values())
+        return {
+            "decisions": dict(self.decisions),
+            "agreement": dict(self.agreement),
+            "agreement_rate": round(self.agreement["agree"] / compared, 3) if compared else None,
+            "hedge_delay_ms": round(self.current_hedge_delay() * 1000, 1),
+        }
+
+
+def route_image(image_bytes: bytes, **kwargs) -> Dict[str, Any]:
+    """Blocking one-off race for synchronous callers such as the Streamlit app."""
+    async def run():
+        async with HedgedRouter(**kwargs) as router:
+            return await router.analyze(image_bytes)
+    return asyncio.run(run())
+
+
+def main():
+    import os
+
+    from stub_servers import StubDetector, StubPlantIdServer
+
+    parser = argparse.ArgumentParser(description="Benchmark the hedged router against stand-in backends")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--hedge-delay", type=float, default=None,
+                        help="Fixed delay in seconds (default: p95 of recent local latencies)")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--deadline", type=float, default=2.0)
+    parser.add_argument("--local-ms", type=float, default=150.0)
+    parser.add_argument("--local-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--remote-ms", type=float, default=400.0)
+    parser.add_argument("--remote-error-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    server = StubPlantIdServer(port=0, latency=args.remote_ms / 1000, error_rate=args.remote_error_rate).start()
+    detector = StubDetector(args.local_ms / 1000, args.local_jitter_ms / 1000)
+    images = [os.urandom(2048) for _ in range(args.images)]
+
+    async def run(mode):
+        remote = AsyncPlantIDClient("stub-key", base_url=server.base_url, cache=False,
+                                    fallback=False, prepare=False, max_concurrency=args.concurrency)
+        router = HedgedRouter(detector, remote, args.hedge_delay, args.threshold, args.deadline, log_every=0)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, winners = [], {}
+
+        async def one(image):
+            async with semaphore:
+                start = time.perf_counter()
+                if mode == "local":
+                    await router._run_local(image)
+                    winner = LOCAL
+                elif mode == "plant_id":
+                    winner = REMOTE if await remote.analyze_image(image) else "failed"
+                else:
+                    winner = (await router.analyze(image))["source"]
+                latencies.append(time.perf_counter() - start)
+                winners[winner] = winners.get(winner, 0) + 1
+
+        await asyncio.gather(*[one(image) for image in images])
+        await remote.aclose()
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{mode:<9} p50 {pick(0.5):7.0f} ms  p99 {pick(0.99):7.0f} ms  max {latencies[-1] * 1000:7.0f} ms  "
+              f"{winners}")
+        if mode == "hedged":
+            print(f"          {router.stats()}")
+
+    for mode in ("local", "plant_id", "hedged"):
+        asyncio.run(run(mode))
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+image_prep.py
+Shrink phone photos before they are uploaded to Plant.id.
+
+Phones send 4-8 MB, 12 MP JPEGs, but the identification model works on far
+smaller inputs, so most of the upload is wasted airtime on slow rural
+networks. ``prepare_upload`` applies the EXIF orientation, drops all
+metadata (including GPS), downsizes to ``max_side`` pixels and re-encodes
+as JPEG or WebP at ``quality``. JPEGs are decoded with ``draft`` so a
+12 MP photo is only decoded at the reduced size.
+
+Defaults come from PLANT_ID_UPLOAD_MAX_SIDE (0 disables the stage),
+PLANT_ID_UPLOAD_QUALITY and PLANT_ID_UPLOAD_FORMAT. Running this file
+sweeps sizes, qualities and formats over a folder of photos and reports
+bytes, encode time and how often the local detector's verdict on the
+prepared image still matches the original:
+
+    python image_prep.py photos/ --sizes 768 1024 1536 --qualities 75 85
+"""
+
+import argparse
+import glob
+import io
+import os
+import time
+from typing import Any, Dict, Optional
+
+from PIL import Image, ImageOps
+
+UPLOAD_MAX_SIDE = int(os.getenv("PLANT_ID_UPLOAD_MAX_SIDE", 1024))
+UPLOAD_QUALITY = int(os.getenv("PLANT_ID_UPLOAD_QUALITY", 85))
+UPLOAD_FORMAT = os.getenv("PLANT_ID_UPLOAD_FORMAT", "JPEG").upper()
+
+
+def upload_settings() -> Dict[str, Any]:
+    """Current pre-upload settings (part of the Plant.id cache key)."""
+    return {"max_side": UPLOAD_MAX_SIDE, "quality": UPLOAD_QUALITY, "format": UPLOAD_FORMAT}
+
+
+def prepare_upload(image_bytes: bytes, max_side: Optional[int] = None,
+                   quality: Optional[int] = None, format: Optional[str] = None) -> bytes:
+    """
+    Downsized, metadata-free re-encode of an image for upload.
+
+    Args:
+        image_bytes: Original image file bytes.
+        max_side: Longest side in pixels (default UPLOAD_MAX_SIDE; 0 or
+            less returns the bytes unchanged).
+        quality: Encoder quality 1-95 (default UPLOAD_QUALITY).
+        format: "JPEG" or "WEBP" (default UPLOAD_FORMAT).
+
+    Returns:
+        The re-encoded image, or the original bytes if they can't be decoded
+        (the API then reports the problem as before).
+    """
+    max_side = UPLOAD_MAX_SIDE if max_side is None else max_side
+    quality = UPLOAD_QUALITY if quality is None else quality
+    format = (format or UPLOAD_FORMAT).upper()
+    if max_side <= 0:
+        return image_bytes
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            if img.format == "JPEG":
+                # EXIF orientation may swap the sides, so allow for both
+                img.draft("RGB", (max_side, max_side))
+            img = ImageOps.exif_transpose(img)
+            img = img.convert("RGB")
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            out = io.BytesIO()
+            # No exif/icc arguments: the new file carries no metadata
+            if format == "WEBP":
+                img.save(out, format="WEBP", quality=quality, method=4)
+            else:
+                img.save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        print(f"⚠️ Could not prepare image for upload, sending original: {e}")
+        return image_bytes
+    return out.getvalue()
+
+
+def _verdict(detector, image_bytes: bytes):
+    result = detector.analyze_leaf_image_bytes(image_bytes)
+    return result.get("disease_id"), float(result.get("confidence", 0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure upload size vs verdict agreement")
+    parser.add_argument("folder", help="Folder of original photos (jpg/png)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 768, 1024, 1536])
+    parser.add_argument("--qualities", type=int, nargs="+", default=[70, 85])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "WEBP"])
+    parser.add_argument("--uplink-mbps", type=float, default=2.0,
+                        help="Uplink bandwidth for the upload time estimate")
+    args = parser.parse_args()
+
+    from Leaf_Disease.main import LeafDiseaseDetector
+
+    paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.folder, f"*.{ext}")))
+    if not paths:
+        parser.error(f"no images in {args.folder}")
+    originals = [open(path, "rb").read() for path in paths]
+    detector = LeafDiseaseDetector()
+    reference = [_verdict(detector, data) for data in originals]
+
+    def upload_seconds(size):
+        return size * 8 / (args.uplink_mbps * 1e6)
+
+    original_bytes = sum(len(data) for data in originals) / len(originals)
+    print(f"{len(originals)} images, original mean {original_bytes / 1024:.0f} KiB, "
+          f"~{upload_seconds(original_bytes):.2f} s upload at {args.uplink_mbps:g} Mbit/s")
+    print(f"{'format':<6} {'side':>5} {'q':>3} {'KiB':>7} {'ratio':>6} {'encode ms':>9} "
+          f"{'upload s':>8} {'agree':>6} {'Δconf':>6}")
+    for format in args.formats:
+        for max_side in args.sizes:
+            for quality in args.qualities:
+                sizes, seconds, agree, delta = [], [], 0, 0.0
+                for data, (disease_id, confidence) in zip(originals, reference):
+                    start = time.perf_counter()
+                    prepared = prepare_upload(data, max_side, quality, format)
+                    seconds.append(time.perf_counter() - start)
+                    sizes.append(len(prepared))
+                    prepared_id, prepared_confidence = _verdict(detector, prepared)
+                    agree += prepared_id == disease_id
+                    delta += abs(prepared_confidence - confidence)
+                mean = sum(sizes) / len(sizes)
+                print(f"{format:<6} {max_side:>5} {quality:>3} {mean / 1024:>7.0f} "
+                      f"{original_bytes / mean:>5.1f}x {1000 * sum(seconds) / len(seconds):>9.1f} "
+                      f"{upload_seconds(mean):>8.2f} {agree / len(originals):>6.0%} "
+                      f"{delta / len(originals):>6.3f}")
+
+
+if __name__ == "__main__":
+    main()
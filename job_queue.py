@@ -0,0 +1,296 @@
+"""
+job_queue.py
+Persistent job queue (SQLite, no external broker) for asynchronous analysis.
+
+Clients submit an image once, get a job id back, and poll for the result
+later. Jobs survive restarts. A running job is leased to the worker
+process that claimed it (owner id plus lease expiry, renewed by a
+heartbeat while the process is alive); only jobs whose lease expired,
+because their process died, are put back on the queue. So with several
+processes on one database (the pre-fork server), a starting worker
+doesn't take jobs away from its busy siblings. Failed jobs are retried up to
+``max_attempts`` times, and finished jobs (with their stored results) are
+deleted once their TTL expires.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobStore:
+    """
+    SQLite-backed job table.
+
+    All methods are synchronous and guarded by one lock; the SQLite
+    connection is shared between the event loop and worker threads.
+
+    Args:
+        lease_seconds: How long a claimed job stays with its owner without
+            a renewal before other processes may requeue it.
+    """
+
+    def __init__(self, path: str = "jobs.sqlite3", max_attempts: int = 3, ttl_seconds: int = 24 * 3600,
+                 lease_seconds: float = 30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload BLOB,
+                filename TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                owner TEXT,
+                lease_expires REAL
+            )
+        """)
+        # Databases created before leases existed
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_expires", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def submit(self, payload: bytes, filename: str = "upload", kind: str = "image") -> str:
+        """Store a new job and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, filename, created_at, updated_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, payload, filename, now, now, now + self.ttl_seconds),
+            )
+        return job_id
+
+    def claim(self, owner: str) -> Optional[sqlite3.Row]:
+        """Atomically take the oldest queued job, mark it running and lease it to ``owner``."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ?, "
+                        "owner = ?, lease_expires = ? WHERE id = ?",
+                        (RUNNING, now, owner, now + self.lease_seconds, row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def complete(self, job_id: str, result: Dict[str, Any], owner: str) -> bool:
+        """
+        Store the result and drop the payload, which is no longer needed.
+        False (nothing stored) if ``owner`` lost the lease meanwhile.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, payload = NULL, error = NULL, owner = NULL, "
+                "lease_expires = NULL, updated_at = ?, expires_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                (DONE, json.dumps(result, ensure_ascii=False), now, now + self.ttl_seconds, job_id, RUNNING, owner),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, error: str, owner: str) -> bool:
+        """
+        Requeue the job, or mark it failed once max_attempts is reached.
+        False (nothing changed) if ``owner`` lost the lease meanwhile.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "payload = CASE WHEN attempts >= ? THEN NULL ELSE payload END, "
+                "owner = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE id = ? AND status = ? AND owner = ?",
+                (self.max_attempts, FAILED, QUEUED, self.max_attempts, error, now, job_id, RUNNING, owner),
+            )
+        return cursor.rowcount == 1
+
+    def renew(self, owner: str) -> int:
+        """Extend the leases of all jobs ``owner`` is running (its heartbeat)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE status = ? AND owner = ?",
+                (time.time() + self.lease_seconds, RUNNING, owner),
+            )
+        return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job status (without the payload), or None if unknown or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, filename, attempts, result, error, created_at, updated_at, expires_at "
+                "FROM jobs WHERE id = ? AND expires_at > ?",
+                (job_id, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Number of queued jobs ahead of this one."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < "
+                "(SELECT created_at FROM jobs WHERE id = ?)",
+                (QUEUED, job_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def depth(self) -> int:
+        """Number of jobs waiting to run."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def requeue_expired(self) -> int:
+        """Put running jobs whose owner stopped renewing (crashed or killed) back on the queue."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)",
+                (QUEUED, now, RUNNING, now),
+            )
+        return cursor.rowcount
+
+    def release(self, owner: str) -> int:
+        """
+        Requeue the jobs ``owner`` is running, at shutdown. The interrupted
+        attempt isn't counted against max_attempts.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), owner = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE status = ? AND owner = ?",
+                (QUEUED, time.time(), RUNNING, owner),
+            )
+        return cursor.rowcount
+
+    def purge_expired(self) -> int:
+        """Delete jobs (and their results) past their TTL."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM jobs WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobWorkerPool:
+    """
+    asyncio workers that pull jobs from a JobStore and run a handler.
+
+    Args:
+        store: The persistent job store.
+        handler: ``async def handler(payload: bytes) -> dict`` doing the work,
+            e.g. ``DetectorService.analyze``.
+        workers: Number of concurrent workers.
+        poll_interval: Seconds to sleep when the queue is empty.
+        job_timeout: Seconds before a single attempt counts as failed.
+
+    Each pool has its own owner id (host, pid and a random suffix). While
+    it runs, a heartbeat renews its leases and requeues jobs whose lease
+    expired elsewhere.
+    """
+
+    def __init__(self, store: JobStore, handler, workers: int = 2,
+                 poll_interval: float = 0.5, job_timeout: float = 60.0):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self):
+        recovered = self.store.requeue_expired()
+        if recovered:
+            print(f"🔁 Requeued {recovered} interrupted jobs")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._janitor()))
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    def notify(self):
+        """Wake idle workers right after a submit instead of waiting a poll interval."""
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        released = await asyncio.to_thread(self.store.release, self.owner)
+        if released:
+            print(f"🔁 Returned {released} unfinished jobs to the queue")
+
+    async def _worker(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.owner)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                result = await asyncio.wait_for(self.handler(job["payload"]), timeout=self.job_timeout)
+            except asyncio.CancelledError:
+                # Shutting down: stop() hands the job back to the queue
+                raise
+            except Exception as e:
+                print(f"⚠️ Job {job['id']} attempt {job['attempts'] + 1} failed: {e!r}")
+                await asyncio.to_thread(self.store.fail, job["id"], repr(e), self.owner)
+            else:
+                if not await asyncio.to_thread(self.store.complete, job["id"], result, self.owner):
+                    print(f"⚠️ Job {job['id']} lease lost before it finished; result dropped")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.store.lease_seconds / 3)
+            await asyncio.to_thread(self.store.renew, self.owner)
+            recovered = await asyncio.to_thread(self.store.requeue_expired)
+            if recovered:
+                print(f"🔁 Requeued {recovered} jobs from a stopped worker")
+
+    async def _janitor(self):
+        while True:
+            await asyncio.to_thread(self.store.purge_expired)
+            await asyncio.sleep(60)
@@ -0,0 +1,330 @@
+"""
+llm_worker.py
+Single long-lived process owning the Sinong GGUF model.
+
+Loading the multi-gigabyte model in every Streamlit/API process (or
+session) multiplies memory and load time. This worker loads it once and
+serves generations over local IPC (``multiprocessing.connection``, with an
+auth key) from a priority queue: interactive chat (priority 0) goes ahead
+of background jobs such as bulk alerts (higher numbers), requests with the
+same priority are served in arrival order, and a request can be cancelled
+while queued or mid-generation (the client disconnecting cancels too).
+
+``LLMClient`` is the thin client for the UI and API processes; it has the
+same ``generate_response_stream`` / ``generate_response`` (with a per-call
+``stats`` dict) interface as SinongGGUFFarmerAssistant, so callers don't care which one
+they hold.
+
+Usage:
+    python llm_worker.py --address 127.0.0.1:8765
+    LLM_WORKER_ADDRESS=127.0.0.1:8765 streamlit run main.py
+
+Messages are pickled, so only clients holding the auth key may connect.
+The key is LLM_WORKER_AUTHKEY if set; otherwise the worker generates a
+random one into LLM_WORKER_AUTHKEY_FILE (default
+~/.kisaan_saathi/llm_worker.key, mode 0600) and clients on the same
+machine read it from there. There is no built-in default key.
+"""
+
+import argparse
+import itertools
+import os
+import queue
+import secrets
+import stat
+import threading
+import time
+import uuid
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+INTERACTIVE = 0
+BACKGROUND = 10
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def authkey_path() -> str:
+    return os.getenv("LLM_WORKER_AUTHKEY_FILE",
+                     os.path.join(os.path.expanduser("~"), ".kisaan_saathi", "llm_worker.key"))
+
+
+def read_authkey() -> bytes:
+    """
+    The shared key from LLM_WORKER_AUTHKEY or the key file.
+
+    Raises:
+        FileNotFoundError: If neither exists (no worker has set one up).
+        PermissionError: If the key file is readable by other users.
+    """
+    if os.getenv("LLM_WORKER_AUTHKEY"):
+        return os.environ["LLM_WORKER_AUTHKEY"].encode("utf-8")
+    path = authkey_path()
+    if os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f"{path} must only be readable by its owner (chmod 600)")
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+
+def create_authkey() -> bytes:
+    """The existing key, or a new random one written to the key file with mode 0600."""
+    try:
+        return read_authkey()
+    except FileNotFoundError:
+        pass
+    path = authkey_path()
+    os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+    key = secrets.token_hex(32).encode("ascii")
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:  # Another worker just created it
+        return read_authkey()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    print(f"🔑 Generated LLM worker key in {path}")
+    return key
+
+
+class _Job:
+    def __init__(self, job_id: str, request: Dict[str, Any], conn, send_lock: threading.Lock):
+        self.id = job_id
+        self.request = request
+        self.conn = conn
+        self.send_lock = send_lock
+        self.cancelled = threading.Event()
+        self.queued_at = time.monotonic()
+
+    def send(self, message: Dict[str, Any]) -> bool:
+        """Send to the job's client; False once the client is gone."""
+        try:
+            with self.send_lock:
+                self.conn.send(dict(message, id=self.id))
+            return True
+        except (OSError, EOFError):
+            self.cancelled.set()
+            return False
+
+
+class LLMWorker:
+    """
+    Serves one assistant's generations, one at a time, from a priority queue.
+
+    Args:
+        assistant: Object whose ``generate_response_stream`` fills a
+            ``stats`` dict (normally SinongGGUFFarmerAssistant).
+        address: (host, port) to listen on.
+        authkey: Shared secret clients must present (default: create_authkey).
+    """
+
+    def __init__(self, assistant, address=("127.0.0.1", 8765), authkey: Optional[bytes] = None):
+        self.assistant = assistant
+        self.listener = Listener(address, authkey=authkey or create_authkey())
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._jobs: Dict[str, _Job] = {}
+        self._lock = threading.Lock()
+        self.active: Optional[str] = None
+        self.served = 0
+        self.cancelled = 0
+
+    def serve_forever(self):
+        threading.Thread(target=self._generate_loop, daemon=True).start()
+        print(f"🧠 LLM worker listening on {self.listener.address[0]}:{self.listener.address[1]}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                print(f"⚠️ Rejected LLM client: {e}")
+                continue
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        """Read a client's requests until it disconnects; its unfinished jobs are then cancelled."""
+        send_lock = threading.Lock()
+        owned = set()
+        try:
+            while True:
+                message = conn.recv()
+                op = message.get("op")
+                if op == "generate":
+                    job = _Job(message.get("id") or uuid.uuid4().hex, message, conn, send_lock)
+                    priority = int(message.get("priority", INTERACTIVE))
+                    with self._lock:
+                        self._jobs[job.id] = job
+                        position = self._queue.qsize() + (self.active is not None)
+                    owned.add(job.id)
+                    self._queue.put((priority, next(self._order), job))
+                    job.send({"event": "queued", "position": position})
+                elif op == "cancel":
+                    self._cancel(message.get("id"))
+                elif op == "stats":
+                    with send_lock:
+                        conn.send(self.stats())
+        except (EOFError, OSError):
+            pass
+        finally:
+            for job_id in owned:
+                self._cancel(job_id)
+            conn.close()
+
+    def _cancel(self, job_id: Optional[str]):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and not job.cancelled.is_set():
+            job.cancelled.set()
+            self.cancelled += 1
+
+    def _generate_loop(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job.cancelled.is_set():
+                job.send({"event": "cancelled"})
+                self._forget(job)
+                continue
+            with self._lock:
+                self.active = job.id
+            waited = time.monotonic() - job.queued_at
+            kwargs = job.request.get("kwargs", {})
+            stats: Dict[str, Any] = {}
+            stream = self.assistant.generate_response_stream(job.request["query"], stats=stats, **kwargs)
+            try:
+                for text in stream:
+                    if job.cancelled.is_set() or not job.send({"event": "token", "text": text}):
+                        break
+            except Exception as e:
+                print(f"❌ LLM generation failed: {e!r}")
+                job.send({"event": "error", "error": repr(e)})
+            else:
+                if job.cancelled.is_set():
+                    job.send({"event": "cancelled"})
+                else:
+                    job.send({"event": "done", "stats": dict(stats, queue_seconds=round(waited, 3))})
+                    self.served += 1
+            finally:
+                stream.close()  # Frees the model mid-generation when cancelled
+                with self._lock:
+                    self.active = None
+                self._forget(job)
+
+    def _forget(self, job: _Job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "active": self.active,
+                "served": self.served,
+                "cancelled": self.cancelled,
+            }
+
+
+class LLMClient:
+    """
+    Thin client for an LLMWorker, usable wherever SinongGGUFFarmerAssistant is.
+
+    Each generation uses its own connection, so a client object can be
+    shared by threads. Stopping iteration of a stream early (or closing
+    it) cancels the generation on the worker.
+
+    Args:
+        address: "host:port" of the worker (default LLM_WORKER_ADDRESS).
+        authkey: Shared secret (default: read_authkey, looked up on connect).
+        priority: Default priority; lower is served first.
+    """
+
+    def __init__(self, address: Optional[str] = None, authkey: Optional[bytes] = None,
+                 priority: int = INTERACTIVE):
+        self.address = parse_address(address or os.getenv("LLM_WORKER_ADDRESS", DEFAULT_ADDRESS))
+        self.authkey = authkey
+        self.priority = priority
+
+    def _connect(self):
+        return Client(self.address, authkey=self.authkey or read_authkey())
+
+    def generate_response_stream(self, farmer_query, disease_info=None, weather=None, shops=None,
+                                 max_tokens=512, session_id=None, priority=None, stats=None):
+        """
+        Yield answer text as the worker generates it. When the stream ends,
+        ``stats`` (if given) holds the worker's timing for this call.
+
+        Raises:
+            RuntimeError: If the generation failed or was cancelled on the worker.
+        """
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        finished = False
+        try:
+            conn.send({
+                "op": "generate",
+                "id": job_id,
+                "priority": self.priority if priority is None else priority,
+                "query": farmer_query,
+                "kwargs": {"disease_info": disease_info, "weather": weather, "shops": shops,
+                           "max_tokens": max_tokens, "session_id": session_id},
+            })
+            while True:
+                message = conn.recv()
+                event = message.get("event")
+                if event == "token":
+                    yield message["text"]
+                elif event == "done":
+                    if stats is not None:
+                        stats.update(message["stats"])
+                    finished = True
+                    return
+                elif event in ("error", "cancelled"):
+                    finished = True
+                    raise RuntimeError(f"LLM generation {event}" + (f": {message['error']}" if "error" in message else ""))
+        finally:
+            if not finished:
+                try:
+                    conn.send({"op": "cancel", "id": job_id})
+                except OSError:
+                    pass
+            conn.close()
+
+    def generate_response(self, farmer_query, disease_info=None, weather=None, shops=None,
+                          session_id=None, max_tokens=512, priority=None, stats=None):
+        return "".join(self.generate_response_stream(farmer_query, disease_info, weather, shops, max_tokens,
+                                                     session_id=session_id, priority=priority, stats=stats))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            conn.send({"op": "stats"})
+            return conn.recv()
+
+    def ping(self) -> bool:
+        """True if a worker is reachable and accepts our key."""
+        try:
+            self.stats()
+            return True
+        except (OSError, EOFError, AuthenticationError):
+            return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Sinong GGUF model to other processes")
+    parser.add_argument("--address", default=os.getenv("LLM_WORKER_ADDRESS", DEFAULT_ADDRESS))
+    parser.add_argument("--model-path", default=None, help="GGUF file (default SINONG_MODEL_PATH)")
+    args = parser.parse_args()
+
+    from sinong_gguf_wrapper import SinongGGUFFarmerAssistant
+
+    worker = LLMWorker(SinongGGUFFarmerAssistant(args.model_path), parse_address(args.address))
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+load_test.py
+Load generator for the Crop Disease API (pure Python, asyncio).
+
+Replays a corpus of images against an endpoint and reports throughput,
+latency percentiles, status codes and what the server itself measured
+(/metrics before vs. after the run). Two load models:
+
+* closed loop (``--concurrency N``): N clients, each sending its next
+  request as soon as the previous one returns;
+* open loop (``--rate R``): Poisson arrivals at R requests/s whatever the
+  server does. Latency counts from the scheduled send time, so a backed-up
+  client doesn't hide server slowness (coordinated omission).
+
+``--spawn-server`` starts the API itself with the stub detector (see
+stub_servers.py) at ``--stub-latency-ms``, optionally with several
+pre-fork workers and a stub Plant.id API, so capacity can be sized before
+the real model and quota are involved. With ``--plant-id-stub`` the server
+runs with PLANT_ID_ROUTING, so /disease-detection-file races the stub
+detector against the stub Plant.id (see hedged_router.py) and the report
+says how many requests reached Plant.id. Note that each pre-fork worker
+keeps its own metrics, so with several workers the server-side figures
+come from whichever worker answered the /metrics scrape.
+
+Usage:
+    python load_test.py --url http://127.0.0.1:8000 --concurrency 16 --duration 30
+    python load_test.py --spawn-server --server-workers 2 --rate 40 --requests 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from stub_servers import StubPlantIdServer
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp")
+METRIC_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$")
+
+
+def load_corpus(path: str) -> List[Tuple[str, bytes]]:
+    """Read every image under ``path`` (a file or directory) into memory."""
+    root = Path(path)
+    files = [root] if root.is_file() else sorted(
+        p for p in root.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if not files:
+        sys.exit(f"No images found in {path}")
+    return [(p.name, p.read_bytes()) for p in files]
+
+
+def multipart_body(filename: str, data: bytes, field: str = "file") -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head + data + tail, f"multipart/form-data; boundary={boundary}"
+
+
+class HTTPConnection:
+    """
+    Minimal keep-alive HTTP/1.1 client on asyncio streams.
+
+    Only what the load test needs: one request at a time, Content-Length or
+    chunked responses, reconnect after the server closes the connection.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Server closed the connection")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            data = b"".join(chunks)
+        else:
+            data = await self.reader.readexactly(int(response_headers.get("content-length", 0)))
+
+        if response_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, response_headers, data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """Prometheus text format -> {"name{labels}": value}."""
+    samples = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            samples[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def fetch_metrics(base_url: str) -> Dict[str, float]:
+    try:
+        with urllib.request.urlopen(f"{base_url}/metrics", timeout=5) as response:
+            return parse_metrics(response.read().decode())
+    except Exception:
+        return {}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class LoadTest:
+    """One run: sends requests, records (latency, status, x-cache) per request."""
+
+    def __init__(self, args, corpus: List[Tuple[str, bytes]]):
+        self.args = args
+        self.corpus = corpus
+        parts = urlsplit(args.url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.records: List[Tuple[float, object, str]] = []
+        self.sent = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+    def _next_image(self) -> Tuple[str, bytes]:
+        name, data = self.corpus[self.sent % len(self.corpus)]
+        self.sent += 1
+        if self.args.vary_bytes:
+            # Bytes after the image end are ignored by decoders but change
+            # the content hash, so every request misses the result cache
+            data = data + os.urandom(16)
+        return name, data
+
+    def _more(self, count: int) -> bool:
+        if self.args.requests and count >= self.args.requests:
+            return False
+        return time.perf_counter() - self.started < self.args.duration
+
+    async def _send(self, connection: HTTPConnection, scheduled: float):
+        name, data = self._next_image()
+        body, content_type = multipart_body(name, data)
+        headers = {"Content-Type": content_type, "Accept": self.args.accept}
+        try:
+            status, response_headers, _ = await asyncio.wait_for(
+                connection.request("POST", self.args.endpoint, body, headers),
+                timeout=self.args.timeout)
+            outcome, cache = status, response_headers.get("x-cache", "")
+        except Exception as e:
+            await connection.close()
+            outcome, cache = type(e).__name__, ""
+        self.records.append((time.perf_counter() - scheduled, outcome, cache))
+
+    async def closed_loop(self):
+        async def client():
+            connection = HTTPConnection(self.host, self.port)
+            while self._more(self.sent):
+                await self._send(connection, time.perf_counter())
+            await connection.close()
+        await asyncio.gather(*[client() for _ in range(self.args.concurrency)])
+
+    async def open_loop(self):
+        idle: List[HTTPConnection] = []
+        limit = asyncio.Semaphore(self.args.max_connections)
+        tasks = set()
+
+        async def fire(scheduled: float):
+            async with limit:
+                connection = idle.pop() if idle else HTTPConnection(self.host, self.port)
+                await self._send(connection, scheduled)
+                idle.append(connection)
+
+        scheduled = 0
+        next_at = time.perf_counter()
+        while self._more(scheduled):
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.ensure_future(fire(next_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            scheduled += 1
+            next_at += random.expovariate(self.args.rate)
+        await asyncio.gather(*tasks)
+        for connection in idle:
+            await connection.close()
+
+    async def run(self):
+        self.started = time.perf_counter()
+        if self.args.rate:
+            await self.open_loop()
+        else:
+            await self.closed_loop()
+        self.finished = time.perf_counter()
+
+    def report(self, before: Dict[str, float], after: Dict[str, float]) -> Dict[str, object]:
+        elapsed = self.finished - self.started
+        latencies = [latency for latency, _, _ in self.records]
+        ok = [latency for latency, outcome, _ in self.records if outcome == 200]
+        outcomes = Counter(str(outcome) for _, outcome, _ in self.records)
+        failed = sum(count for outcome, count in outcomes.items() if outcome != "200")
+        report = {
+            "requests": len(self.records),
+            "seconds": round(elapsed, 2),
+            "throughput_rps": round(len(self.records) / elapsed, 2) if elapsed else 0.0,
+            "ok_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "offered_rps": self.args.rate or None,
+            "latency_ms": {f"p{q}": round(percentile(latencies, q) * 1000, 1) for q in (50, 90, 95, 99)},
+            "ok_latency_ms": {f"p{q}": round(percentile(ok, q) * 1000, 1) for q in (50, 90, 95, 99)},
+            "max_latency_ms": round(max(latencies) * 1000, 1) if latencies else None,
+            "outcomes": dict(outcomes),
+            "error_rate": round(failed / len(self.records), 4) if self.records else 0.0,
+            "cache": dict(Counter(cache for _, outcome, cache in self.records if outcome == 200)),
+            "server": server_deltas(before, after),
+        }
+        return report
+
+
+def server_deltas(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, object]:
+    """What the server measured during the run, from two /metrics scrapes."""
+    def delta(key):
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    stages = {}
+    for key in after:
+        match = re.match(r'crop_stage_seconds_count\{stage="([^"]+)"\}', key)
+        if match and delta(key):
+            stage = match.group(1)
+            stages[stage] = round(delta(f'crop_stage_seconds_sum{{stage="{stage}"}}') / delta(key) * 1000, 2)
+    counters = {}
+    for prefix in ("crop_admissions_total", "crop_errors_total", "crop_cache_requests_total"):
+        for key in after:
+            if key.startswith(prefix + "{") and delta(key):
+                counters[key] = int(delta(key))
+    return {"stage_mean_ms": stages, "counters": counters}
+
+
+def print_report(report: Dict[str, object]):
+    print(f"\n📊 {report['requests']} requests in {report['seconds']} s -> "
+          f"{report['throughput_rps']} req/s ({report['ok_rps']} ok/s"
+          + (f", offered {report['offered_rps']}/s)" if report["offered_rps"] else ")"))
+    latency = report["latency_ms"]
+    print(f"   latency ms   p50 {latency['p50']}  p90 {latency['p90']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  max {report['max_latency_ms']}")
+    ok_latency = report["ok_latency_ms"]
+    print(f"   200s only    p50 {ok_latency['p50']}  p95 {ok_latency['p95']}  p99 {ok_latency['p99']}")
+    print(f"   outcomes     {report['outcomes']}  error rate {report['error_rate']:.1%}")
+    print(f"   x-cache      {report['cache']}")
+    server = report["server"]
+    if server["stage_mean_ms"]:
+        print("   server stage means (ms): "
+              + "  ".join(f"{stage} {ms}" for stage, ms in server["stage_mean_ms"].items()))
+    for key, value in server["counters"].items():
+        print(f"   {key} +{value}")
+
+
+def spawn_server(args, plant_id: Optional[StubPlantIdServer]) -> subprocess.Popen:
+    """Start the API with the stub detector and wait until /ready answers."""
+    env = dict(os.environ, DETECTOR_BACKEND="stub", STUB_LATENCY_MS=str(args.stub_latency_ms))
+    if plant_id is not None:
+        # Route analyses through the hedged router so unsure ones reach the stub
+        env["PLANT_ID_ROUTING"] = "1"
+        env["PLANT_ID_BASE_URL"] = plant_id.base_url
+        env["PLANT_ID_CACHE_PATH"] = "off"  # Every request should hit the stub
+        env.setdefault("PLANT_ID_API_KEY", "stub-key")
+    port = str(urlsplit(args.url).port or 80)
+    if args.server_workers > 1:
+        command = [sys.executable, "prefork_server.py", "--host", "127.0.0.1", "--port", port,
+                   "--workers", str(args.server_workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                   "--port", port, "--log-level", "warning"]
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{args.url}/ready", timeout=2) as response:
+                if response.status == 200:
+                    return process
+        except Exception:
+            time.sleep(0.3)
+        if process.poll() is not None:
+            sys.exit("API server exited during startup")
+    process.terminate()
+    sys.exit("API server did not become ready within 60 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Crop Disease API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="/disease-detection-file")
+    parser.add_argument("--corpus", default="Media", help="Image file or directory to replay")
+    parser.add_argument("--concurrency", type=int, default=8, help="Closed-loop clients")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open-loop arrivals per second")
+    parser.add_argument("--max-connections", type=int, default=256, help="Open-loop connection cap")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client timeout per request")
+    parser.add_argument("--accept", default="application/json")
+    parser.add_argument("--no-vary-bytes", dest="vary_bytes", action="store_false",
+                        help="Send identical bytes so repeats hit the result cache")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="Start the API with DETECTOR_BACKEND=stub for this run")
+    parser.add_argument("--server-workers", type=int, default=1)
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--plant-id-stub", action="store_true",
+                        help="Also start a stub Plant.id API and route the spawned server's analyses to it")
+    parser.add_argument("--plant-id-latency-ms", type=float, default=400.0)
+    parser.add_argument("--plant-id-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    plant_id = process = None
+    if args.plant_id_stub:
+        plant_id = StubPlantIdServer(port=0, latency=args.plant_id_latency_ms / 1000,
+                                     error_rate=args.plant_id_error_rate).start()
+        print(f"🌱 Stub Plant.id API on {plant_id.base_url}")
+    if args.spawn_server:
+        process = spawn_server(args, plant_id)
+
+    mode = f"open loop at {args.rate}/s" if args.rate else f"closed loop x{args.concurrency}"
+    print(f"🚀 {args.endpoint} on {args.url}: {mode}, {len(corpus)} images, "
+          f"{'cache-busting' if args.vary_bytes else 'repeated'} bytes")
+    try:
+        before = fetch_metrics(args.url)
+        test = LoadTest(args, corpus)
+        asyncio.run(test.run())
+        report = test.report(before, fetch_metrics(args.url))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if plant_id is not None:
+            plant_id.stop()
+
+    print_report(report)
+    if plant_id is not None:
+        print(f"   stub Plant.id: {plant_id.requests} requests, {plant_id.failures} failed")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,43 @@
 ﻿import streamlit as st
 import base64
+import hashlib
 import json
+import os
 import time
 import random
-import requests
+import uuid
 from datetime import datetime
+from Leaf_Disease.config import AppConfig
 from Leaf_Disease.main import LeafDiseaseDetector
+from disease_risk import location_risk
+from weather_service import get_weather_service, upcoming_hours
 
 # === WEATHER FUNCTION ===
 def get_weather(city="Mumbai"):
+    # Shared, cached per town (WEATHER_TTL_SECONDS); None if unavailable
+    return get_weather_service().get(city)
+
+# === LLM ASSISTANT ===
+@st.cache_resource(show_spinner="🚀 Loading Sinong AI assistant...")
+def get_llm_assistant():
+    """
+    Sinong GGUF assistant shared by all sessions, or None if no model is installed.
+    With LLM_WORKER_ADDRESS set, the model stays in the llm_worker.py process.
+    """
+    if os.getenv("LLM_WORKER_ADDRESS"):
+        from llm_worker import LLMClient
+        client = LLMClient()
+        if client.ping():
+            return client
+        print("⚠️ LLM worker unreachable, loading the model in this process")
     try:
-        url = f"https://wttr.in/{city}?format=%t+%h+%w+%C"
-        response = requests.get(url, timeout=5)
-        weather_text = response.text.strip().split()
-        
-        if len(weather_text) >= 4:
-            return {
-                'temperature': weather_text[0],
-                'humidity': weather_text[1],
-                'wind': weather_text[2],
-                'condition': ' '.join(weather_text[3:])
-            }
-    except:
+        from sinong_gguf_wrapper import DEFAULT_MODEL_PATH, SinongGGUFFarmerAssistant
+    except ImportError:
         return None
-    return None
+    model_path = os.getenv("SINONG_MODEL_PATH", DEFAULT_MODEL_PATH)
+    if not os.path.exists(model_path):
+        return None
+    return SinongGGUFFarmerAssistant(model_path)
 
 # === PAGE CONFIG (ONLY ONCE!) ===
 st.set_page_config(
@@ -51,16 +65,25 @@ with st.sidebar:
             with col2:
                 st.metric("Humidity", weather_data['humidity'])
                 st.write(f"**{weather_data['condition']}**")
+            if weather_data.get('stale'):
+                st.caption("⚠️ Weather service unreachable - showing last known weather")
             
-            # Farming advice
+            # Farming advice from the forecast's infection risk
             st.markdown("---")
             st.markdown("### 🌱 Advice")
-            if "rain" in weather_data['condition'].lower():
+            next_day = upcoming_hours(weather_data, hours=24)
+            if any(hour['chance_of_rain'] >= 60 for hour in next_day):
                 st.info("💧 Rain expected - Hold off on spraying")
-            elif "sun" in weather_data['condition'].lower() or "clear" in weather_data['condition'].lower():
-                st.success("☀️ Good day for farming!")
-            else:
-                st.warning("☁️ Check disease spread risk")
+            risks = location_risk(weather_data)
+            if not risks:
+                st.caption("Not enough forecast data to estimate disease risk")
+            for risk in risks:
+                if risk['level'] == 'high':
+                    st.error(f"🦠 {risk['name']}: high risk - {risk['advice']}")
+                elif risk['level'] == 'moderate':
+                    st.warning(f"☁️ {risk['name']}: moderate risk - keep scouting")
+            if risks and all(risk['level'] == 'low' for risk in risks):
+                st.success("☀️ Low disease risk - good days for farming!")
         else:
             st.error("Could not fetch weather")
 
@@ -377,8 +400,19 @@ if uploaded_file:
                 file_bytes = uploaded_file.getvalue()
                 base64_image = base64.b64encode(file_bytes).decode('utf-8')
                 
-                # Get AI analysis
-                analysis_result = st.session_state.detector.analyze_leaf_image_base64(base64_image)
+                # Get AI analysis: with PLANT_ID_ROUTING, Plant.id is asked too when the local model is unsure
+                analysis_result = None
+                config = AppConfig.from_env(require_api_key=False)
+                if config.plant_id_routing:
+                    try:
+                        from hedged_router import route_image
+                        analysis_result = route_image(
+                            file_bytes, detector=st.session_state.detector, detector_format=True,
+                            confidence_threshold=config.routing_confidence_threshold)
+                    except (ImportError, ValueError, RuntimeError) as e:
+                        print(f"⚠️ Plant.id routing unavailable, using the local detector: {e!r}")
+                if analysis_result is None:
+                    analysis_result = st.session_state.detector.analyze_leaf_image_base64(base64_image)
                 
                 # Store results
                 st.session_state.analysis_done = True
@@ -388,12 +422,40 @@ if uploaded_file:
                 if not farmer_query:
                     farmer_query = "What disease does my crop have?"
                 
-                # Create AI response
-                disease_name = analysis_result.get('disease_name', 'Unknown')
-                treatment = analysis_result.get('treatment', 'Consult expert')
-                hindi_msg = analysis_result.get('hindi_message', '')
-                
-                ai_response = f"""🌾 नमस्ते किसान भाई!
+                # Create AI response: streamed from the local LLM when installed
+                assistant = get_llm_assistant()
+                ai_response = None
+                if assistant is not None:
+                    st.markdown("### 🤖 AI Advice")
+                    if 'llm_session' not in st.session_state:
+                        st.session_state.llm_session = uuid.uuid4().hex
+                    # One conversation per photo: a new leaf starts fresh, so its first
+                    # question can still be answered from the response cache
+                    session_id = f"{st.session_state.llm_session}:{hashlib.sha256(file_bytes).hexdigest()[:16]}"
+                    stats = {}  # Filled in by this call only; the assistant is shared by sessions
+                    try:
+                        ai_response = st.write_stream(assistant.generate_response_stream(
+                            farmer_query, analysis_result, st.session_state.get('weather'),
+                            session_id=session_id, stats=stats))
+                        if stats['cached']:
+                            st.caption("⚡ Instant answer - a similar question was answered before")
+                        else:
+                            st.caption(f"⚡ First word in {stats['ttft_seconds']:.1f}s • "
+                                       f"{stats['tokens_per_second']:.1f} tokens/s")
+                    except (OSError, EOFError, RuntimeError) as e:
+                        # LLM worker down or the generation failed: standard advice instead
+                        print(f"⚠️ AI assistant unavailable: {e!r}")
+                        from llm_worker import LLMClient
+                        if isinstance(assistant, LLMClient):
+                            get_llm_assistant.clear()  # Reconnect (or load locally) next time
+                        st.caption("⚠️ AI assistant unavailable - showing standard advice")
+                        ai_response = None
+                if ai_response is None:
+                    disease_name = analysis_result.get('disease_name', 'Unknown')
+                    treatment = analysis_result.get('treatment', 'Consult expert')
+                    hindi_msg = analysis_result.get('hindi_message', '')
+                    
+                    ai_response = f"""🌾 नमस्ते किसान भाई!
 
 मैंने आपकी फसल की जांच कर ली है। आपके पौधों में **{disease_name}** है।
 
@@ -0,0 +1,160 @@
+"""
+plant_id_cache.py
+Persistent SQLite cache of Plant.id results.
+
+Every Plant.id identification is billed, and farmers often send the same
+photo again (retries on a bad network, re-opening the app). Results are
+stored on disk keyed by the image's SHA-256 plus the request parameters,
+so a repeat answers from disk without a network call, also after a
+restart. Entries expire after ``ttl_seconds``; once the file holds more
+than ``max_bytes`` of results the least recently used ones are evicted.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from Leaf_Disease.metrics import CACHE_REQUESTS
+
+
+class PlantIdCache:
+    """
+    SQLite key-value store of result dicts with TTL and LRU size eviction.
+
+    All methods are synchronous and guarded by one lock (call them through
+    ``asyncio.to_thread`` from async code).
+
+    Args:
+        path: SQLite file.
+        ttl_seconds: How long a result stays valid.
+        max_bytes: Total size of stored results before evicting.
+    """
+
+    def __init__(self, path: str = "plant_id_cache.sqlite3", ttl_seconds: int = 30 * 24 * 3600,
+                 max_bytes: int = 100 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def make_key(image_bytes: bytes, params: Dict[str, Any]) -> str:
+        """Image content hash plus a hash of the request parameters."""
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        params_hash = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+        return f"{image_hash}:{params_hash}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="plant_id", result="miss")
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        CACHE_REQUESTS.inc(cache="plant_id", result="hit")
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict[str, Any]):
+        value = json.dumps(result, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, size, now, now, now + self.ttl_seconds),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones, down to 90% of max_bytes."""
+        cursor = self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+        self.evictions += cursor.rowcount
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM results ORDER BY accessed_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= target:
+                    break
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate of this process plus the size of the cache file's contents."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[PlantIdCache] = None
+
+
+def get_default_cache() -> Optional[PlantIdCache]:
+    """
+    Process-wide cache configured from the environment:
+    PLANT_ID_CACHE_PATH ("off" disables it), PLANT_ID_CACHE_TTL_SECONDS
+    and PLANT_ID_CACHE_MAX_MB.
+    """
+    global _default_cache
+    path = os.getenv("PLANT_ID_CACHE_PATH", "plant_id_cache.sqlite3")
+    if path.lower() == "off":
+        return None
+    if _default_cache is None:
+        _default_cache = PlantIdCache(
+            path,
+            ttl_seconds=int(os.getenv("PLANT_ID_CACHE_TTL_SECONDS", 30 * 24 * 3600)),
+            max_bytes=int(float(os.getenv("PLANT_ID_CACHE_MAX_MB", 100)) * 1024 * 1024),
+        )
+    return _default_cache
@@ -3,41 +3,137 @@ plant_id_service.py
 Handles all communication with the Plant.id API.
 """
 
+import asyncio
 import base64
 import os
-from typing import Optional, Dict, Any
-from kindwise import PlantApi
+import threading
+from types import SimpleNamespace
+from typing import Optional, Dict, Any, List, Union
+
+import httpx
+
+from Leaf_Disease.metrics import FALLBACKS
+from image_prep import prepare_upload, upload_settings
+from plant_id_cache import PlantIdCache, get_default_cache
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+# Plant.id v3 identification endpoint; point PLANT_ID_BASE_URL at
+# stub_servers.py for tests and load tests
+PLANT_ID_BASE_URL = "https://plant.id"
+IDENTIFICATION_PATH = "/api/v3/identification"
+DISEASE_DETAILS = "local_name,description,treatment,cause,type"
+
+# Request parameters; also part of the cache key, so changing them
+# doesn't serve results obtained with the old ones
+IDENTIFICATION_PARAMS = {"details": DISEASE_DETAILS, "health": "all", "similar_images": True}
+KINDWISE_PARAMS = {"client": "kindwise", "endpoint": "identification"}
+
+# Shared by both clients so they see the same outage. Transient errors are
+# retried with backoff; after PLANT_ID_BREAKER_FAILURES in a row calls fail
+# fast for PLANT_ID_BREAKER_RESET_SECONDS and go to the local detector
+PLANT_ID_RETRY = RetryPolicy(attempts=int(os.getenv("PLANT_ID_RETRIES", 3)))
+PLANT_ID_BREAKER = CircuitBreaker(
+    "plant_id",
+    failure_threshold=int(os.getenv("PLANT_ID_BREAKER_FAILURES", 5)),
+    reset_timeout=float(os.getenv("PLANT_ID_BREAKER_RESET_SECONDS", 30)),
+)
+
+
+def cache_params(params: Dict[str, Any], prepare: bool) -> Dict[str, Any]:
+    """Cache key parameters; prepared uploads also depend on the upload settings."""
+    return {**params, "upload": upload_settings()} if prepare else params
+
+
+def resolve_api_key(api_key: str = None) -> str:
+    """
+    Find the Plant.id API key.
+    Priority: 1. Provided key, 2. Streamlit Secrets, 3. .env file
+    """
+    # Priority 1: Use the key if provided directly
+    if api_key:
+        return api_key
+    try:
+        # Priority 2: Try to get the key from Streamlit Secrets (works on share.streamlit.io)
+        import streamlit as st
+        api_key = st.secrets["PLANT_ID_API_KEY"]
+        print("✅ API key loaded from Streamlit Secrets (for online app).")
+        return api_key
+    except:
+        # Priority 3: Fall back to environment variable (for local development)
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv('PLANT_ID_API_KEY')
+        if not api_key:
+            raise ValueError("Plant.id API key not found. Set PLANT_ID_API_KEY in Streamlit Secrets or .env file.")
+        print("✅ API key loaded from .env file (for local testing).")
+        return api_key
+
+
+class LocalFallback:
+    """
+    Local detector answering when Plant.id can't.
+    
+    Uses RealDiseaseDetector when a trained model is configured
+    (CNN_MODEL_PATH) and TensorFlow is available, else LeafDiseaseDetector.
+    The detector is only built on first use.
+    """
+    
+    def __init__(self):
+        self._detector = None
+        self._lock = threading.Lock()
+    
+    def get_detector(self):
+        with self._lock:
+            if self._detector is None:
+                model_path = os.getenv("CNN_MODEL_PATH")
+                if model_path and os.path.exists(model_path):
+                    try:
+                        from Leaf_Disease.real_cnn_model import RealDiseaseDetector
+                        self._detector = RealDiseaseDetector(model_path=model_path)
+                    except ImportError:
+                        pass
+                if self._detector is None:
+                    from Leaf_Disease.main import LeafDiseaseDetector
+                    self._detector = LeafDiseaseDetector()
+            return self._detector
+    
+    def analyze(self, image_bytes: bytes, reason: str) -> Dict[str, Any]:
+        """Local result in the Plant.id result format, marked with its source."""
+        FALLBACKS.inc(service="plant_id", reason=reason)
+        print(f"🔁 Plant.id unavailable ({reason}), using the local detector")
+        result = PlantIDService._format_local_result(self.get_detector().analyze_leaf_image_bytes(image_bytes))
+        result["source"] = "local"
+        result["fallback_reason"] = reason
+        return result
+
+
+LOCAL_FALLBACK = LocalFallback()
+
 
 class PlantIDService:
     """Service class for Plant.id API operations."""
     
-        def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache: Union[PlantIdCache, bool, None] = None,
+                 fallback: bool = True, prepare: bool = True):
         """
         Initialize the Plant.id API client.
         
         Args:
             api_key: Your Plant.id API key. Priority: 1. Provided key, 2. Streamlit Secrets, 3. .env file
+            cache: Persistent result cache; None uses the default one
+                (see plant_id_cache.get_default_cache), False disables it.
+            fallback: Answer with the local detector when Plant.id fails
+                (otherwise analyze_image returns None as before).
+            prepare: Downsize and re-encode images before upload
+                (see image_prep.prepare_upload).
         """
-        # Priority 1: Use the key if provided directly
-        if api_key:
-            self.api_key = api_key
-        else:
-            try:
-                # Priority 2: Try to get the key from Streamlit Secrets (works on share.streamlit.io)
-                import streamlit as st
-                self.api_key = st.secrets["PLANT_ID_API_KEY"]
-                print("✅ API key loaded from Streamlit Secrets (for online app).")
-            except:
-                # Priority 3: Fall back to environment variable (for local development)
-                import os
-                from dotenv import load_dotenv
-                load_dotenv()
-                self.api_key = os.getenv('PLANT_ID_API_KEY')
-                if not self.api_key:
-                    raise ValueError("Plant.id API key not found. Set PLANT_ID_API_KEY in Streamlit Secrets or .env file.")
-                print("✅ API key loaded from .env file (for local testing).")
-        
-        # Initialize the API client
+        self.api_key = resolve_api_key(api_key)
+        self.cache = get_default_cache() if cache is None else (cache or None)
+        self.fallback = fallback
+        self.prepare = prepare
+        
+        # Initialize the API client (kindwise is only needed for this blocking path)
+        from kindwise import PlantApi
         self.api = PlantApi(api_key=self.api_key)
         
     def analyze_image(self, image_bytes: bytes) -> Optional[Dict[str, Any]]:
@@ -48,32 +144,77 @@ class PlantIDService:
             image_bytes: Raw bytes of the uploaded image.
             
         Returns:
-            Dictionary with disease information, or None if analysis fails.
+            Dictionary with disease information. If Plant.id fails after
+            retries (or its circuit is open) the local detector's result,
+            or None when fallback is disabled.
         """
+        # Already identified (also in an earlier run)? Then no API call
+        if self.cache is not None:
+            key = self.cache.make_key(image_bytes, cache_params(KINDWISE_PARAMS, self.prepare))
+            cached = self.cache.get(key)
+            if cached is not None:
+                print("💾 Plant.id result from cache")
+                return cached
+        
+        # A 12 MP phone photo is mostly wasted upload time
+        if self.prepare:
+            image_bytes = prepare_upload(image_bytes)
+        
         try:
-            print("🌱 Calling Plant.id API...")
-            
-            # Send image to Plant.id for identification
-            identification = self.api.identification.identify(image_bytes)
-            
-            # Check if we have valid results
-            if not identification.result or not identification.result.disease:
-                print("⚠️ No disease results from API.")
-                return self._create_healthy_result()
-            
-            # Get the top disease suggestion
-            top_disease = identification.result.disease.suggestions[0]
-            
-            print(f"✅ Disease detected: {top_disease.name} (Confidence: {top_disease.probability:.1%})")
-            
-            # Format the result for your app
-            return self._format_disease_result(top_disease)
-            
+            result = PLANT_ID_RETRY.call(self._identify, image_bytes,
+                                         breaker=PLANT_ID_BREAKER, service="plant_id")
+        except CircuitOpenError:
+            return LOCAL_FALLBACK.analyze(image_bytes, "circuit_open") if self.fallback else None
         except Exception as e:
             print(f"❌ Plant.id API Error: {e}")
-            return None
+            return LOCAL_FALLBACK.analyze(image_bytes, "error") if self.fallback else None
+        
+        # Fallback results above are never cached: Plant.id should get another try
+        if self.cache is not None:
+            self.cache.put(key, result)
+        return result
     
-    def _format_disease_result(self, disease_suggestion) -> Dict[str, Any]:
+    def _identify(self, image_bytes: bytes) -> Dict[str, Any]:
+        """One blocking Plant.id call, formatted; raises on failure."""
+        print("🌱 Calling Plant.id API...")
+        
+        # Send image to Plant.id for identification
+        identification = self.api.identification.identify(image_bytes)
+        
+        # Same rule as AsyncPlantIDClient.format_identification: no suggestions,
+        # or Plant.id itself says the plant is healthy, gives a healthy result
+        result = identification.result
+        is_healthy = getattr(result, "is_healthy", None)
+        if not result or not result.disease or not result.disease.suggestions:
+            print("⚠️ No disease results from API.")
+            return self._create_healthy_result(getattr(is_healthy, "probability", 0.0))
+        if getattr(is_healthy, "binary", False):
+            print(f"✅ Plant looks healthy (Confidence: {is_healthy.probability:.1%})")
+            return self._create_healthy_result(is_healthy.probability)
+        
+        # Get the top disease suggestion
+        top_disease = identification.result.disease.suggestions[0]
+        
+        print(f"✅ Disease detected: {top_disease.name} (Confidence: {top_disease.probability:.1%})")
+        
+        # Format the result for your app
+        return self._format_disease_result(top_disease)
+    
+    def analyze_images(self, images: List[bytes], max_concurrency: int = 4) -> List[Optional[Dict[str, Any]]]:
+        """
+        Analyze many images concurrently (e.g. a field visit) instead of one
+        round-trip after another. Blocking wrapper around AsyncPlantIDClient
+        for synchronous callers such as the Streamlit app.
+        """
+        async def run():
+            async with AsyncPlantIDClient(self.api_key, max_concurrency=max_concurrency,
+                                          cache=self.cache or False, fallback=self.fallback,
+                                          prepare=self.prepare) as client:
+                return await client.analyze_images(images)
+        return asyncio.run(run())
+    
+    @staticmethod
+    def _format_disease_result(disease_suggestion) -> Dict[str, Any]:
         """Format Plant.id API response to match your app's structure."""
         
         # Extract details if available
@@ -128,14 +269,41 @@ class PlantIDService:
             "similar_images": disease_suggestion.similar_images or []
         }
     
-    def _create_healthy_result(self) -> Dict[str, Any]:
-        """Create a result for healthy plants."""
+    @staticmethod
+    def _format_local_result(local: Dict[str, Any]) -> Dict[str, Any]:
+        """Local detector result -> the same format as _format_disease_result."""
+        if not local.get('disease_detected'):
+            return PlantIDService._create_healthy_result(float(local.get('confidence', 0.0)))
+        
+        organic = local.get('organic_solutions') or []
+        treatment = local.get('treatment')
+        suggestion = SimpleNamespace(
+            name=local.get('disease_name', 'Unknown'),
+            probability=float(local.get('confidence', 0.0)),
+            details={
+                'type': local.get('disease_type', 'fungal'),
+                'treatment': {
+                    'chemical': treatment if isinstance(treatment, str) else None,
+                    'biological': ', '.join(organic[:2]) or None,
+                },
+                'symptoms': {'localized': local.get('symptoms') or ['Yellowing leaves', 'Spots on foliage']},
+            },
+            similar_images=[],
+        )
+        result = PlantIDService._format_disease_result(suggestion)
+        if local.get('possible_causes'):
+            result['possible_causes'] = local['possible_causes']
+        return result
+    
+    @staticmethod
+    def _create_healthy_result(confidence: float) -> Dict[str, Any]:
+        """Create a result for healthy plants; ``confidence`` is the 0-1 probability that it is healthy."""
         return {
             "disease_detected": False,
             "disease_name": "Healthy",
             "disease_type": "healthy",
             "severity": "none",
-            "confidence": 95.0,
+            "confidence": round(float(confidence or 0.0) * 100, 1),
             "symptoms": ["No disease symptoms detected"],
             "possible_causes": ["Good plant health maintained"],
             "treatment": [
@@ -145,6 +313,135 @@ class PlantIDService:
             ]
         }
 
+class AsyncPlantIDClient:
+    """
+    asyncio Plant.id client sharing one pooled HTTP session.
+
+    Talks to the v3 identification endpoint directly (no kindwise), keeps
+    connections alive between calls and caps concurrent requests with a
+    semaphore, so a batch of images goes out in parallel without flooding
+    the API. Results have the same format as PlantIDService.analyze_image
+    and are looked up in the persistent cache before any network call.
+
+    Args:
+        api_key: Plant.id API key (resolved like PlantIDService if None).
+        base_url: API root; defaults to PLANT_ID_BASE_URL or https://plant.id.
+        max_concurrency: Requests in flight at once (and pooled connections).
+        timeout: Seconds per try (connecting is capped at 10 s); with retries
+            a hung Plant.id costs at most about attempts x timeout before
+            the local fallback answers.
+        cache: Persistent result cache; None uses the default one, False
+            disables it.
+        fallback: Answer with the local detector when Plant.id fails.
+        prepare: Downsize and re-encode images before upload.
+        retry: Retry policy (default PLANT_ID_RETRY).
+        breaker: Circuit breaker (default the shared PLANT_ID_BREAKER).
+
+    Usage:
+        >>> async with AsyncPlantIDClient(max_concurrency=8) as client:
+        ...     results = await client.analyze_images(images)
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None,
+                 max_concurrency: int = 4, timeout: float = 10.0,
+                 cache: Union[PlantIdCache, bool, None] = None, fallback: bool = True,
+                 prepare: bool = True, retry: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_key = resolve_api_key(api_key)
+        self.cache = get_default_cache() if cache is None else (cache or None)
+        self.fallback = fallback
+        self.prepare = prepare
+        self.retry = retry or PLANT_ID_RETRY
+        self.breaker = breaker or PLANT_ID_BREAKER
+        self.base_url = (base_url or os.getenv("PLANT_ID_BASE_URL", PLANT_ID_BASE_URL)).rstrip("/")
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Api-Key": self.api_key},
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+        )
+
+    async def __aenter__(self) -> "AsyncPlantIDClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def identify(self, image_bytes: bytes) -> Dict[str, Any]:
+        """
+        Raw identification response with disease (health) assessment.
+        Transient failures are retried with backoff behind the circuit breaker.
+
+        Raises:
+            CircuitOpenError: Plant.id is known to be down; nothing was sent.
+            httpx.HTTPError: On timeouts, connection errors and non-2xx
+                answers once the retries are used up.
+        """
+        return await self.retry.call_async(self._post_identification, image_bytes,
+                                           breaker=self.breaker, service="plant_id")
+
+    async def _post_identification(self, image_bytes: bytes) -> Dict[str, Any]:
+        payload = {
+            "images": [base64.b64encode(image_bytes).decode("ascii")],
+            "health": IDENTIFICATION_PARAMS["health"],
+            "similar_images": IDENTIFICATION_PARAMS["similar_images"],
+        }
+        async with self._semaphore:
+            response = await self._client.post(
+                IDENTIFICATION_PATH, params={"details": IDENTIFICATION_PARAMS["details"]}, json=payload
+            )
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def format_identification(identification: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a raw v3 response into the app's result dict."""
+        result = identification.get("result") or {}
+        suggestions = (result.get("disease") or {}).get("suggestions") or []
+        is_healthy = result.get("is_healthy") or {}
+        if not suggestions or is_healthy.get("binary"):
+            return PlantIDService._create_healthy_result(is_healthy.get("probability", 0.0))
+        top = suggestions[0]
+        # The formatter expects kindwise's attribute-style suggestion objects
+        return PlantIDService._format_disease_result(SimpleNamespace(
+            name=top.get("name"),
+            probability=top.get("probability", 0.0),
+            details=top.get("details") or {},
+            similar_images=top.get("similar_images") or [],
+        ))
+
+    async def analyze_image(self, image_bytes: bytes) -> Optional[Dict[str, Any]]:
+        """Analyze one image; on failure the local fallback (or None if disabled)."""
+        if self.cache is not None:
+            key = self.cache.make_key(image_bytes, cache_params(IDENTIFICATION_PARAMS, self.prepare))
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        if self.prepare:
+            image_bytes = await asyncio.to_thread(prepare_upload, image_bytes)
+        try:
+            result = self.format_identification(await self.identify(image_bytes))
+        except Exception as e:
+            reason = "circuit_open" if isinstance(e, CircuitOpenError) else "error"
+            if reason == "error":
+                print(f"❌ Plant.id API Error: {e!r}")
+            if not self.fallback:
+                return None
+            return await asyncio.to_thread(LOCAL_FALLBACK.analyze, image_bytes, reason)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, result)
+        return result
+
+    async def analyze_images(self, images: List[bytes]) -> List[Optional[Dict[str, Any]]]:
+        """Analyze a batch concurrently (at most max_concurrency at a time), in order."""
+        return list(await asyncio.gather(*[self.analyze_image(image) for image in images]))
+
 # Singleton instance for easy import
 plant_id_service = None
 
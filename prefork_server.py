@@ -0,0 +1,228 @@
+"""
+prefork_server.py
+Multi-worker API server that loads the model once and forks workers.
+
+``uvicorn.run(app, workers=N)`` starts N fresh interpreters and each one loads
+its own copy of the model. Here the parent process loads and warms the
+detector, freezes the GC, opens the listening socket and only then forks.
+Every worker inherits the already-loaded weights and shares their pages
+copy-on-write with the parent, so adding a worker costs its private memory
+only, not another model.
+
+Thread pools are sized per worker (cores // workers) before TensorFlow is
+imported, so N workers don't each start one thread per core.
+
+Note: TensorFlow does not officially support fork() once its runtime is
+running. Each worker therefore re-runs the warm-up with a timeout right after
+the fork and exits with WARMUP_FAILED if inference hangs, in which case the
+parent stops instead of restarting workers forever; use plain
+``python app.py`` for that backend.
+
+State that lives in process memory is per worker, not per server:
+- Admission control: MAX_IN_FLIGHT and MAX_QUEUED_REQUESTS apply to each
+  worker, so the server as a whole runs up to workers x MAX_IN_FLIGHT
+  analyses and queues up to workers x MAX_QUEUED_REQUESTS before every
+  worker answers 429. Size them per worker (the thread split below
+  already gives each worker cores // workers). The totals are printed at
+  startup.
+- /metrics: every worker has its own registry and a scrape is answered by
+  whichever worker accepts the connection. Counters and histograms are
+  that worker's alone, so consecutive scrapes can go backwards or jump.
+  Use ``python app.py`` when exact server-wide metrics matter.
+
+Linux only (fork, /proc). Usage:
+    python prefork_server.py --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+WARMUP_FAILED = 3  # Worker exit code when post-fork inference doesn't work
+
+
+def process_memory(pid="self") -> Dict[str, Optional[int]]:
+    """
+    Memory of a process in KiB from /proc/<pid>/smaps_rollup.
+
+    ``shared`` counts pages also mapped by other processes (the model
+    weights inherited from the pre-fork parent); ``private`` is what the
+    process costs on its own. ``pss`` splits shared pages evenly and is
+    the fairest per-worker number.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 3 and parts[-1] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return {"pid": os.getpid() if pid == "self" else pid, "rss_kb": None,
+                "pss_kb": None, "shared_kb": None, "private_kb": None}
+    return {
+        "pid": os.getpid() if pid == "self" else pid,
+        "rss_kb": fields.get("Rss"),
+        "pss_kb": fields.get("Pss"),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def configure_threads(workers: int) -> int:
+    """
+    Split the CPU between workers before TensorFlow/NumPy start their pools.
+    Explicit environment settings are left alone.
+    """
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    per_worker = max(1, cores // max(1, workers))
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(per_worker))
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+    os.environ.setdefault("OMP_NUM_THREADS", str(per_worker))
+    os.environ.setdefault("INFERENCE_WORKERS", str(per_worker))
+    return per_worker
+
+
+def print_memory_report(pids):
+    """Per-worker RSS vs. shared vs. private memory, in MiB."""
+    print(f"{'pid':>8} {'rss':>8} {'pss':>8} {'shared':>8} {'private':>8}  (MiB)")
+    for label, pid in [("parent", os.getpid())] + [("worker", p) for p in pids]:
+        m = process_memory(pid)
+        if m["rss_kb"] is None:
+            continue
+        print(f"{pid:>8} {m['rss_kb'] / 1024:>8.1f} {m['pss_kb'] / 1024:>8.1f} "
+              f"{m['shared_kb'] / 1024:>8.1f} {m['private_kb'] / 1024:>8.1f}  {label}")
+
+
+def _check_warm_up(service, timeout: float) -> bool:
+    """Run one inference in the forked worker; False if it raises or hangs."""
+    outcome = {}
+
+    def run():
+        try:
+            service.warm_up()
+            outcome["ok"] = True
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not outcome.get("ok"):
+        print(f"❌ Worker {os.getpid()}: inference after fork failed "
+              f"({outcome.get('error', 'timed out')})")
+    return bool(outcome.get("ok"))
+
+
+def run_worker(app, sock: socket.socket, service, warmup_timeout: float):
+    """Body of a forked worker: serve the app on the inherited socket."""
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    service.after_fork()
+    if not _check_warm_up(service, warmup_timeout):
+        os._exit(WARMUP_FAILED)
+
+    config = uvicorn.Config(app, log_level="info", lifespan="on")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork Crop Disease API server")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVER_WORKERS", "2")))
+    parser.add_argument("--warmup-timeout", type=float, default=60.0,
+                        help="Seconds a worker may take for its post-fork inference check")
+    args = parser.parse_args()
+
+    per_worker = configure_threads(args.workers)
+    print(f"🧵 {args.workers} workers x {per_worker} inference threads")
+
+    # Imported only now so the thread settings above apply to TF/NumPy
+    from Leaf_Disease.config import AppConfig
+    from detector_service import preload
+
+    config = AppConfig.from_env(require_api_key=False)
+    print(f"🚦 Admission is per worker: {args.workers} x {config.max_in_flight} in flight "
+          f"= {args.workers * config.max_in_flight}, {args.workers} x {config.max_queued_requests} queued "
+          f"= {args.workers * config.max_queued_requests}")
+    service = preload(config)
+    from app import app  # Import the API (and FastAPI) before forking too
+
+    # Move everything loaded so far out of the GC's reach: collections in
+    # the workers would otherwise touch (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    print(f"🚀 Listening on http://{args.host}:{args.port}")
+
+    workers = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(app, sock, service, args.warmup_timeout)
+        workers[pid] = time.time()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print_memory_report(list(workers)))
+
+    for _ in range(args.workers):
+        spawn()
+
+    reported = False
+    while workers:
+        if not reported and not stopping:
+            time.sleep(3)
+            print_memory_report(list(workers))
+            print("   (send SIGUSR1 for a fresh report)")
+            reported = True
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.pop(pid, None)
+        code = os.waitstatus_to_exitcode(status)
+        if stopping:
+            continue
+        if code == WARMUP_FAILED:
+            print("❌ The model can't run in forked workers; start with `python app.py` instead.")
+            stop(None, None)
+            continue
+        print(f"⚠️ Worker {pid} exited ({code}); starting a replacement")
+        spawn()
+
+    sock.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
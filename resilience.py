@@ -0,0 +1,205 @@
+"""
+resilience.py
+Retries with exponential backoff and a circuit breaker for remote calls.
+
+Used around Plant.id: transient failures (timeouts, dropped connections,
+429 and 5xx answers) are retried a few times with growing, jittered
+delays, honouring Retry-After. After ``failure_threshold`` consecutive
+failures the breaker opens and calls fail immediately with
+CircuitOpenError instead of each waiting for a timeout; after
+``reset_timeout`` seconds one probe call is let through to test whether
+the service is back.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import httpx
+
+from Leaf_Disease.metrics import CIRCUIT_STATE, RETRIES
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+TRANSIENT_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service that is known to be down."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker, safe to share between threads.
+
+    Args:
+        name: Service name for the crop_circuit_state metric.
+        failure_threshold: Consecutive failures that open the circuit.
+        reset_timeout: Seconds the circuit stays open before a probe.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(0, service=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError unless a call may go out now.
+        True if this call is the half-open probe (only it may release_probe).
+        """
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True  # Only one probe at a time
+                CIRCUIT_STATE.set(1, service=self.name)
+                return True
+        raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+        CIRCUIT_STATE.set(0, service=self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"⚠️ {self.name} circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._probing = False
+            is_open = self.opened_at is not None
+        if is_open:
+            CIRCUIT_STATE.set(2, service=self.name)
+
+    def release_probe(self):
+        """Give up a probe slot without a verdict (e.g. a non-transient error)."""
+        with self._lock:
+            self._probing = False
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_transient(error: BaseException) -> bool:
+    """True for failures worth retrying: timeouts, connection errors, 408/429/5xx."""
+    status = _status_code(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    try:
+        import requests  # kindwise's blocking client is built on requests
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+    except ImportError:
+        return False
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Retry-After of an HTTP error response, in seconds, if given as a number."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Args:
+        attempts: Total tries per call, the first one included.
+        base_delay: Delay cap before the second try; doubles each time.
+        max_delay: Upper bound for any single delay (Retry-After included).
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        """Seconds to wait after failed try number ``attempt`` (1-based)."""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, fn: Callable[..., Any], *args, breaker: Optional[CircuitBreaker] = None,
+             service: str = "remote") -> Any:
+        """Run blocking ``fn(*args)`` with retries; the last error is raised."""
+        for attempt in range(1, self.attempts + 1):
+            probe = breaker.before_call() if breaker is not None else False
+            try:
+                result = fn(*args)
+            except Exception as e:
+                if not self._failed(e, attempt, breaker, probe):
+                    raise
+                RETRIES.inc(service=service)
+                time.sleep(self.delay(attempt, e))
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    async def call_async(self, fn: Callable[..., Any], *args, breaker: Optional[CircuitBreaker] = None,
+                         service: str = "remote") -> Any:
+        """Await ``fn(*args)`` with retries; the last error is raised."""
+        for attempt in range(1, self.attempts + 1):
+            probe = breaker.before_call() if breaker is not None else False
+            try:
+                result = await fn(*args)
+            except asyncio.CancelledError:
+                if probe:
+                    breaker.release_probe()  # Cancelled probe, no verdict
+                raise
+            except Exception as e:
+                if not self._failed(e, attempt, breaker, probe):
+                    raise
+                RETRIES.inc(service=service)
+                await asyncio.sleep(self.delay(attempt, e))
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    def _failed(self, error: BaseException, attempt: int, breaker: Optional[CircuitBreaker],
+                probe: bool = False) -> bool:
+        """Book a failure; True if another try should follow."""
+        transient = is_transient(error)
+        if breaker is not None:
+            if transient:
+                breaker.record_failure()
+            elif probe:
+                breaker.release_probe()  # e.g. 401: the service itself is up
+        return transient and attempt < self.attempts
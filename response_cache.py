@@ -0,0 +1,224 @@
+"""
+response_cache.py
+Semantic cache of farmer-assistant answers.
+
+Most questions are rewordings of "what is this disease and what do I
+spray" for a handful of diseases, so a full LLM generation per question
+is mostly repeated work. Answers are stored under a key of (disease id,
+language, weather bucket, nearby shops); within a key, questions are compared by cosine
+similarity of hashed character n-gram vectors (no embedding model
+needed, and it copes with Hinglish spelling variants and Devanagari).
+A stored answer is returned when the closest question is at least
+``threshold`` similar.
+
+Entries are kept in SQLite so they survive restarts; the vectors are
+rebuilt in memory on start (embedding is cheap). Each key keeps its
+``max_per_key`` most recent answers.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from Leaf_Disease.metrics import CACHE_REQUESTS
+from weather_service import upcoming_hours
+
+DIM = 4096
+NGRAMS = (2, 3, 4)
+_DEVANAGARI = re.compile(r"[ऀ-ॿ]")
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, letters/digits only (any script), single spaces."""
+    return " ".join(re.sub(r"[^\w]+", " ", text.casefold()).split())
+
+
+def embed(text: str, dim: int = DIM) -> np.ndarray:
+    """L2-normalised vector of hashed character n-grams (word-boundary padded)."""
+    padded = f" {normalize_question(text)} "
+    vector = np.zeros(dim, dtype=np.float32)
+    for n in NGRAMS:
+        for i in range(len(padded) - n + 1):
+            h = zlib.crc32(padded[i:i + n].encode("utf-8"))
+            vector[h % dim] += 1.0 if h & 0x80000000 else -1.0  # Signed hashing limits collisions
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def detect_language(text: str) -> str:
+    """ "hi" if the question is mostly Devanagari, else "en" (which includes Hinglish)."""
+    letters = [char for char in text if char.isalpha()]
+    if not letters:
+        return "en"
+    return "hi" if sum(bool(_DEVANAGARI.match(char)) for char in letters) / len(letters) > 0.3 else "en"
+
+
+def disease_key(disease_info: Optional[Dict[str, Any]]) -> str:
+    """Normalised disease id of a diagnosis ("unknown" without one)."""
+    if not isinstance(disease_info, dict):
+        return "unknown"
+    value = disease_info.get("disease_id") or disease_info.get("disease_name") or "unknown"
+    return "_".join(normalize_question(str(value)).split()) or "unknown"
+
+
+def weather_bucket(weather: Optional[Dict[str, Any]]) -> str:
+    """Coarse weather class, so advice about spraying in the rain isn't reused on a dry day."""
+    if not isinstance(weather, dict):
+        return "any"
+    temp = weather.get("temp_c", weather.get("temperature"))
+    humidity = weather.get("humidity_pct", weather.get("humidity"))
+    try:
+        temp = float(str(temp).strip("+°C"))
+        humidity = float(str(humidity).strip("%"))
+    except (TypeError, ValueError):
+        return "any"
+    temp_band = "cold" if temp < 15 else "mild" if temp < 25 else "warm" if temp < 32 else "hot"
+    humidity_band = "dry" if humidity < 60 else "humid" if humidity < 85 else "wet"
+    try:
+        coming = upcoming_hours(weather, hours=24)
+    except (KeyError, ValueError):
+        coming = []
+    rain = any(hour.get("chance_of_rain", 0) >= 60 for hour in coming)
+    return f"{temp_band}-{humidity_band}" + ("-rain" if rain else "")
+
+
+def shops_key(shops) -> str:
+    """Short fingerprint of the nearby-shop list the prompt mentioned ("none" without one)."""
+    if not shops:
+        return "none"
+    names = sorted(str(shop.get("name", shop) if isinstance(shop, dict) else shop) for shop in shops)
+    return f"{zlib.crc32('|'.join(names).encode('utf-8')):08x}"
+
+
+class _Index:
+    """Question vectors and answers of one key, with a growable matrix."""
+
+    def __init__(self, dim: int):
+        self.vectors = np.zeros((8, dim), dtype=np.float32)
+        self.ids = []
+        self.answers = []
+
+    def add(self, entry_id: int, vector: np.ndarray, answer: str):
+        if len(self.ids) == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+        self.vectors[len(self.ids)] = vector
+        self.ids.append(entry_id)
+        self.answers.append(answer)
+
+    def remove_oldest(self) -> int:
+        self.vectors[:len(self.ids) - 1] = self.vectors[1:len(self.ids)]
+        self.answers.pop(0)
+        return self.ids.pop(0)
+
+    def nearest(self, vector: np.ndarray) -> Tuple[float, int]:
+        scores = self.vectors[:len(self.ids)] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), best
+
+
+class ResponseCache:
+    """
+    Thread-safe semantic cache of LLM answers.
+
+    Args:
+        path: SQLite file; None keeps the cache in memory only.
+        threshold: Minimum cosine similarity for a hit. Lexical vectors
+            can't tell "safe to eat" from "safe to sell" (0.85), so the
+            default only matches rewordings, typos and punctuation.
+        max_per_key: Answers kept per (disease, language, weather, shops) key.
+    """
+
+    def __init__(self, path: Optional[str] = "sinong_responses.sqlite3", threshold: float = 0.9,
+                 max_per_key: int = 256):
+        self.threshold = threshold
+        self.max_per_key = max_per_key
+        self.hits = 0
+        self.misses = 0
+        self._indexes: Dict[str, _Index] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        if path:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        for entry_id, key, question, answer in self._conn.execute(
+                "SELECT id, key, question, answer FROM responses ORDER BY id"):
+            self._index(key).add(entry_id, embed(question), answer)
+
+    @staticmethod
+    def make_key(question: str, disease_info=None, weather=None, shops=None) -> str:
+        return (f"{disease_key(disease_info)}|{detect_language(question)}|{weather_bucket(weather)}"
+                f"|{shops_key(shops)}")
+
+    def _index(self, key: str) -> _Index:
+        if key not in self._indexes:
+            self._indexes[key] = _Index(DIM)
+        return self._indexes[key]
+
+    def get(self, question: str, disease_info=None, weather=None, shops=None) -> Optional[Dict[str, Any]]:
+        """Closest stored answer as {"answer", "similarity"}, or None below the threshold."""
+        key = self.make_key(question, disease_info, weather, shops)
+        vector = embed(question)
+        with self._lock:
+            index = self._indexes.get(key)
+            similarity, best = index.nearest(vector) if index and index.ids else (0.0, -1)
+            if similarity < self.threshold:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="llm_response", result="miss")
+                return None
+            self.hits += 1
+            answer = index.answers[best]
+        CACHE_REQUESTS.inc(cache="llm_response", result="hit")
+        return {"answer": answer, "similarity": round(similarity, 3)}
+
+    def put(self, question: str, answer: str, disease_info=None, weather=None, shops=None):
+        key = self.make_key(question, disease_info, weather, shops)
+        vector = embed(question)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO responses (key, question, answer, created_at) VALUES (?, ?, ?, ?)",
+                (key, question, answer, time.time()),
+            )
+            index = self._index(key)
+            index.add(cursor.lastrowid, vector, answer)
+            while len(index.ids) > self.max_per_key:
+                self._conn.execute("DELETE FROM responses WHERE id = ?", (index.remove_oldest(),))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "keys": len(self._indexes),
+                "entries": sum(len(index.ids) for index in self._indexes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_default_cache() -> Optional[ResponseCache]:
+    """
+    Cache configured from the environment: SINONG_RESPONSE_CACHE (SQLite
+    path, "off" disables it) and SINONG_RESPONSE_CACHE_THRESHOLD.
+    """
+    path = os.getenv("SINONG_RESPONSE_CACHE", "sinong_responses.sqlite3")
+    if path.lower() == "off":
+        return None
+    return ResponseCache(path, threshold=float(os.getenv("SINONG_RESPONSE_CACHE_THRESHOLD", 0.9)))
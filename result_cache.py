@@ -0,0 +1,81 @@
+"""
+result_cache.py
+In-memory LRU cache of analysis results keyed by image content hash.
+
+Lets the API answer a re-posted image (or a hash-only lookup) without
+running the detector again, and keeps answers stable for identical images.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from Leaf_Disease.metrics import CACHE_REQUESTS
+
+
+class ResultCache:
+    """
+    Thread-safe LRU mapping of SHA-256 hex digest -> result dict.
+
+    Args:
+        max_entries: Results kept before the least recently used is evicted.
+        name: Label for this cache in the crop_cache_requests_total metric.
+    """
+
+    def __init__(self, max_entries: int = 1024, name: str = "result"):
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            result = self._entries.get(content_hash)
+            if result is None:
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache=self.name, result="miss")
+                return None
+            self._entries.move_to_end(content_hash)
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+            return dict(result)
+
+    def put(self, content_hash: str, result: Dict[str, Any]):
+        with self._lock:
+            self._entries[content_hash] = dict(result)
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, content_hash: str) -> bool:
+        with self._lock:
+            return content_hash in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+def make_etag(content_hash: str, variant: str = "") -> str:
+    """
+    Strong ETag for an image's content hash.
+    ``variant`` tells apart other representations of the same result
+    (e.g. "msgpack-compact"); the default JSON one has none.
+    """
+    return f'"{content_hash}-{variant}"' if variant else f'"{content_hash}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    True if an If-None-Match header value matches ``etag``.
+    Handles "*", comma-separated lists and weak (W/) validators, which
+    If-None-Match compares weakly per RFC 9110.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
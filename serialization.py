@@ -0,0 +1,207 @@
+"""
+serialization.py
+Response encodings for the API: fast JSON, MessagePack and CBOR.
+
+Returning a plain dict from an endpoint sends it through FastAPI's generic
+``jsonable_encoder`` walk before ``json.dumps``. For our flat result dicts
+that walk is pure overhead, so responses here are encoded directly:
+
+* ``application/json``: orjson when installed, else compact ``json.dumps``
+  (UTF-8, no spaces; same bytes as before).
+* ``application/msgpack`` (needs ``msgpack``) and ``application/cbor``
+  (needs ``cbor2``): binary formats, noticeably smaller on slow links.
+
+The format is picked from the Accept header; JSON stays the default, so
+existing clients are unaffected. ``compact_result`` additionally strips the
+static knowledge-base text (treatments, Hindi messages, ...) from a result,
+leaving the disease id for clients that cached GET /knowledge-base.
+
+Benchmark (encode time and bytes per format):
+    python serialization.py
+"""
+
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+# Media types clients may ask for -> the canonical one we answer with
+MEDIA_TYPE_ALIASES = {
+    JSON: JSON,
+    MSGPACK: MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    CBOR: CBOR,
+}
+
+
+def _encode_json(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _encoders() -> Dict[str, Callable[[Any], bytes]]:
+    encoders = {JSON: _encode_json}
+    if msgpack is not None:
+        encoders[MSGPACK] = lambda content: msgpack.packb(content, use_bin_type=True)
+    if cbor2 is not None:
+        encoders[CBOR] = cbor2.dumps
+    return encoders
+
+
+ENCODERS = _encoders()
+
+
+def encode(content: Any, media_type: str = JSON) -> bytes:
+    """Encode ``content`` as ``media_type`` (one of ENCODERS)."""
+    return ENCODERS[media_type](content)
+
+
+def _parse_accept(accept: str) -> List[Tuple[str, float]]:
+    """Accept header -> [(media_range, q)] in header order, q=0 ranges dropped."""
+    ranges = []
+    for part in accept.split(","):
+        fields = [field.strip() for field in part.split(";")]
+        media_range = fields[0].lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranges.append((media_range, q))
+    return ranges
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Pick the response media type from an Accept header.
+
+    The highest-q supported type wins, ties going to the one listed first.
+    No header, ``*/*`` or ``application/*`` get JSON, and so does a header
+    naming none of the available formats (e.g. ``text/plain``, or msgpack
+    without the ``msgpack`` package installed): JSON is what the API
+    always answered before content negotiation, so such clients keep working.
+    """
+    if not accept:
+        return JSON
+    best, best_q = None, 0.0
+    for media_range, q in _parse_accept(accept):
+        if media_range in ("*/*", "application/*"):
+            candidate = JSON
+        else:
+            candidate = MEDIA_TYPE_ALIASES.get(media_range)
+        if candidate in ENCODERS and q > best_q:
+            best, best_q = candidate, q
+    return best or JSON
+
+
+def format_suffix(media_type: str) -> str:
+    """Short name of a media type, e.g. for ETag variants: json, msgpack, cbor."""
+    return media_type.rsplit("/", 1)[-1]
+
+
+def knowledge_base_version(knowledge_base: Dict[str, Any]) -> str:
+    """Short content hash of the knowledge base; changes whenever its text does."""
+    canonical = json.dumps(knowledge_base, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:12]
+
+
+def compact_result(result: Dict[str, Any], knowledge_base: Dict[str, Any], kb_version: str) -> Dict[str, Any]:
+    """
+    Drop the fields a client can look up in the knowledge base.
+
+    Only fields equal to the knowledge-base entry for the result's
+    ``disease_id`` are removed, so anything computed per image (confidence,
+    CNN severity, predictions, timestamps) always stays. ``kb_version`` tells
+    the client which knowledge base the ids refer to.
+    """
+    entry = knowledge_base.get(result.get("disease_id"), {})
+    compact = {key: value for key, value in result.items()
+               if key not in entry or entry[key] != value}
+    compact["kb_version"] = kb_version
+    return compact
+
+
+if __name__ == "__main__":
+    import gzip
+    import random
+    import time
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from Leaf_Disease.main import LeafDiseaseDetector
+
+    detector = LeafDiseaseDetector()
+    kb = detector.knowledge_base()
+    kb_version = knowledge_base_version(kb)
+    random.seed(0)
+    results = []
+    for i in range(16):
+        disease_id = random.choice(list(detector.diseases))
+        results.append({
+            "disease_detected": disease_id != "healthy",
+            "disease_id": disease_id,
+            "confidence": 0.78 + random.random() * 0.15,
+            **kb[disease_id],
+            "analysis_timestamp": "2026-10-19T08:30:00.000000Z",
+            "image_sha256": hashlib.sha256(str(i).encode()).hexdigest(),
+            "filename": f"field_visit/IMG_{i:04d}.jpg",
+        })
+    payloads = {
+        "single": results[0],
+        "batch16": {"results": results, "analysis_timestamp": "2026-10-19T08:30:00.000000Z"},
+    }
+
+    def fastapi_default(content):
+        # What returning a dict from an endpoint did before
+        return JSONResponse(jsonable_encoder(content)).body
+
+    def bench(fn, content, seconds=0.3):
+        runs, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            fn(content)
+            runs += 1
+        return (time.perf_counter() - start) / runs * 1e6
+
+    print(f"orjson={'yes' if orjson else 'no'} msgpack={'yes' if msgpack else 'no'} "
+          f"cbor2={'yes' if cbor2 else 'no'}  kb_version={kb_version}")
+    print(f"{'payload':<16} {'encoder':<18} {'us/encode':>10} {'bytes':>7} {'gzip':>7}")
+    for label, content in payloads.items():
+        compact = dict(content)
+        if "results" in compact:
+            compact["results"] = [compact_result(r, kb, kb_version) for r in content["results"]]
+        else:
+            compact = compact_result(content, kb, kb_version)
+        encoders = [("fastapi-default", fastapi_default)] + [(format_suffix(t), e) for t, e in ENCODERS.items()]
+        for view, data in (("full", content), ("compact", compact)):
+            for name, fn in encoders:
+                body = fn(data)
+                print(f"{label + '/' + view:<16} {name:<18} {bench(fn, data):>10.1f} "
+                      f"{len(body):>7} {len(gzip.compress(body)):>7}")
+    print(f"knowledge base: {len(encode(kb))} bytes as JSON, fetched once per kb_version")
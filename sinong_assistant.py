@@ -8,6 +8,8 @@ import json
 import random
 from datetime import datetime
 
+from disease_risk import location_risk
+
 class SinongFarmerAssistant:
     """
     Sinong-based agricultural assistant for Indian farmers
@@ -69,10 +71,15 @@ class SinongFarmerAssistant:
         # Weather info
         weather_text = ""
         if weather:
-            temp = weather.get('temperature', 28)
-            humidity = weather.get('humidity', 65)
+            # weather_service results carry numbers next to the display strings
+            temp = weather.get('temp_c', weather.get('temperature', 28))
+            humidity = weather.get('humidity_pct', weather.get('humidity', 65))
             rain = weather.get('rain_forecast', 'No rain expected')
             weather_text = f"\n🌤️ मौसम: {temp}°C, {humidity}% नमी, {rain}"
+            risky = [risk for risk in location_risk(weather) if risk['level'] != 'low']
+            if risky:
+                weather_text += "\n⚠️ अगले दिनों में रोग का खतरा: " + ", ".join(
+                    f"{risk['name']} ({risk['level']})" for risk in risky)
         
         # Shop info
         shops_text = ""
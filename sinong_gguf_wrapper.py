@@ -1,32 +1,247 @@
 # sinong_gguf_wrapper.py
-from llama_cpp import Llama
+from collections import OrderedDict
+import hashlib
 import os
+import pickle
+import threading
+import time
+
+from gguf_loader import choose_profile, load_model
+from response_cache import get_default_cache
+
+# Where download_sinong.py saves the recommended quantization
+DEFAULT_MODEL_PATH = os.path.join("models", "Sinong", "gguf", "Sinong1.0-32B.Q4_K_M.gguf")
+DEFAULT_KV_CACHE_DIR = os.path.join("models", "Sinong", "kv_cache")
+STOP = ["</s>"]
+
+# Fixed start of every prompt; its KV state is computed once and kept on disk
+PREAMBLE = "You are a friendly agricultural assistant helping an Indian farmer. Speak in simple Hinglish.\n\n"
 
 class SinongGGUFFarmerAssistant:
-    def __init__(self, model_path=r"{model_path}"):
+    """
+    Sinong GGUF model behind the farmer chat.
+
+    Prompt processing is the expensive part for short questions, so the
+    KV state after PREAMBLE is saved once (to ``kv_cache_dir``, reused
+    after restarts) and restored before each call, and with a
+    ``session_id`` the state after the whole conversation so far is kept
+    in memory for the next turn (the ``max_sessions`` most recent
+    sessions). Either way llama.cpp only evaluates the new tokens.
+
+    First questions of a conversation close enough to one answered before
+    for the same disease, language, weather and shops are answered from
+    ``response_cache`` (None uses the default one, False disables it)
+    without running the model.
+
+    Threads, batch size and memory mapping come from ``profile`` (default:
+    gguf_loader.choose_profile for this machine); ``load_report`` holds
+    the load time and resident memory.
+
+    With a ``draft_model_path`` (default SINONG_DRAFT_MODEL_PATH), a small
+    model with the same tokenizer guesses ``draft_tokens`` tokens ahead
+    (SINONG_DRAFT_TOKENS, default 4) and the main model verifies them in
+    one batch (speculative decoding, see speculative.py).
+    """
+
+    def __init__(self, model_path=None, kv_cache_dir=None, max_sessions=4, response_cache=None, profile=None,
+                 draft_model_path=None, draft_tokens=None):
+        model_path = model_path or os.getenv("SINONG_MODEL_PATH", DEFAULT_MODEL_PATH)
         print("🔄 Loading Sinong GGUF model...")
-        self.llm = Llama(
-            model_path=model_path,
-            n_ctx=2048,  # Context window
-            n_threads=8,  # CPU threads
-            n_gpu_layers=-1  # Use GPU if available
-        )
+        draft_model_path = draft_model_path or os.getenv("SINONG_DRAFT_MODEL_PATH")
+        profile = profile or choose_profile(model_path, draft_model_path=draft_model_path)
+        self.n_ctx = profile.n_ctx
+        self.temperature = 0.7
+        self.draft = None
+        if draft_model_path:
+            from speculative import DraftModel
+            self.draft = DraftModel(draft_model_path, int(draft_tokens or os.getenv("SINONG_DRAFT_TOKENS", 4)))
+            print(f"🎯 Speculative decoding with {os.path.basename(self.draft.model_path)}")
+        self.llm, self.load_report = load_model(profile, draft_model=self.draft)
+        model_path = profile.model_path  # May be a smaller quantization that fits in RAM
+        self._lock = threading.Lock()  # One llama.cpp context: one generation at a time
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (state, tokens), most recent last
+        self.response_cache = get_default_cache() if response_cache is None else (response_cache or None)
+        self._prefix_tokens = self.llm.tokenize(PREAMBLE.encode("utf-8"))
+        self._prefix_state = self._load_prefix_state(
+            model_path, kv_cache_dir or os.getenv("SINONG_KV_CACHE_DIR", DEFAULT_KV_CACHE_DIR))
         print("✅ Model loaded!")
-    
-    def generate_response(self, farmer_query, disease_info=None, weather=None, shops=None):
-        prompt = f"""You are a friendly agricultural assistant helping an Indian farmer. Speak in simple Hinglish.
 
-Farmer's question: {{farmer_query}}
-Crop diagnosis: {{disease_info}}
-Weather: {{weather}}
-Nearby shops: {{shops}}
+    def _load_prefix_state(self, model_path, kv_cache_dir):
+        """KV state after PREAMBLE, from disk if this model/preamble was seen before."""
+        stat = os.stat(model_path)
+        key = hashlib.sha256(
+            f"{os.path.abspath(model_path)}|{stat.st_size}|{stat.st_mtime}|{self.n_ctx}|{PREAMBLE}".encode()
+        ).hexdigest()[:16]
+        path = os.path.join(kv_cache_dir, f"prefix-{key}.state")
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    state = pickle.load(f)
+                print(f"💾 Prompt prefix state loaded from {path}")
+                return state
+            except Exception as e:
+                print(f"⚠️ Ignoring unreadable prefix state {path}: {e}")
+
+        start = time.perf_counter()
+        self.llm.reset()
+        self.llm.eval(self._prefix_tokens)
+        state = self.llm.save_state()
+        try:
+            os.makedirs(kv_cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(state, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"⚠️ Could not save prefix state: {e}")
+        print(f"💾 Prompt prefix evaluated in {time.perf_counter() - start:.2f}s and saved")
+        return state
+
+    @staticmethod
+    def _describe(value):
+        """Short prompt text for a diagnosis/weather dict (forecast arrays etc. left out)."""
+        if not isinstance(value, dict):
+            return value or "Not available"
+        keys = ("disease_name", "confidence", "severity", "temperature", "humidity", "condition", "name")
+        return ", ".join(f"{key}: {value[key]}" for key in keys if key in value) or "Not available"
+
+    def build_turn(self, farmer_query, disease_info=None, weather=None, shops=None):
+        """The variable part of a prompt (everything after PREAMBLE)."""
+        shops_text = ", ".join(self._describe(shop) for shop in shops) if shops else "Not available"
+        return f"""Farmer's question: {farmer_query}
+Crop diagnosis: {self._describe(disease_info)}
+Weather: {self._describe(weather)}
+Nearby shops: {shops_text}
 
 Provide helpful advice in simple language."""
-        
-        response = self.llm(
-            prompt,
-            max_tokens=512,
-            temperature=0.7,
-            stop=["</s>", "\\n\\n"]
-        )
-        return response['choices'][0]['text']
\ No newline at end of file
+
+    def build_prompt(self, farmer_query, disease_info=None, weather=None, shops=None):
+        return PREAMBLE + self.build_turn(farmer_query, disease_info, weather, shops)
+
+    def _restore(self, turn, session_id, max_tokens):
+        """
+        Load the longest cached state for this call and return the full
+        prompt tokens plus how many of them the state already covers.
+        """
+        session = self._sessions.get(session_id) if session_id else None
+        if session is not None:
+            state, base_tokens = session
+            new_tokens = self.llm.tokenize(("\n\n" + turn).encode("utf-8"), add_bos=False)
+            if len(base_tokens) + len(new_tokens) + max_tokens <= self.n_ctx:
+                self._sessions.move_to_end(session_id)
+                self.llm.load_state(state)
+                return base_tokens + new_tokens, state.n_tokens
+            del self._sessions[session_id]  # Conversation too long: start over from the preamble
+        self.llm.load_state(self._prefix_state)
+        new_tokens = self.llm.tokenize(turn.encode("utf-8"), add_bos=False)
+        return self._prefix_tokens + new_tokens, len(self._prefix_tokens)
+
+    def _remember(self, session_id, tokens):
+        """
+        Keep the KV state of a finished turn; ``tokens`` is its prompt plus
+        the answer. Only the part of llama.cpp's context that matches them
+        is kept: with a draft model, generation can end (stop token,
+        max_tokens) before the rejected guesses are removed, and those must
+        not become part of the conversation.
+        """
+        held = self.llm.input_ids[:self.llm.n_tokens]
+        kept = 0
+        for held_token, token in zip(held, tokens):
+            if held_token != token:
+                break
+            kept += 1
+        if kept < self.llm.n_tokens:
+            self.llm._ctx.kv_cache_seq_rm(-1, kept, -1)
+            self.llm.n_tokens = kept
+        state = self.llm.save_state()
+        # The next turn evaluates whatever of ``tokens`` the state doesn't cover
+        self._sessions[session_id] = (state, tokens)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def generate_response_stream(self, farmer_query, disease_info=None, weather=None, shops=None,
+                                 max_tokens=512, session_id=None, stats=None):
+        """
+        Yield the answer piece by piece as llama.cpp produces tokens, so the
+        chat can render it while the model is still writing.
+
+        With a ``session_id`` the question continues that conversation and
+        only its new tokens are evaluated.
+
+        When the stream ends, the ``stats`` dict passed in (one per call,
+        so concurrent callers don't see each other's numbers) holds time to
+        first token, total time, token counts (prompt, reused from cache,
+        generated) and decode speed (tokens/sec). Concurrent callers (e.g.
+        several Streamlit sessions) take turns on the model.
+        """
+        stats = {} if stats is None else stats
+        start = time.perf_counter()
+        # Follow-up turns depend on the conversation, so only fresh questions use the cache
+        fresh = not (session_id and session_id in self._sessions)
+        cached = (self.response_cache.get(farmer_query, disease_info, weather, shops)
+                  if self.response_cache and fresh else None)
+        if cached is not None:
+            elapsed = round(time.perf_counter() - start, 6)
+            stats.update({"cached": True, "similarity": cached["similarity"], "ttft_seconds": elapsed,
+                          "total_seconds": elapsed, "prompt_tokens": 0, "reused_tokens": 0,
+                          "tokens": 0, "tokens_per_second": 0.0})
+            yield cached["answer"]
+            return
+
+        turn = self.build_turn(farmer_query, disease_info, weather, shops)
+        pieces = []
+        with self._lock:
+            drafting = self.llm.draft_model is not None
+            draft_before = self.llm.draft_model.stats() if drafting else None
+            prompt_tokens, reused_tokens = self._restore(turn, session_id, max_tokens)
+            first_token_at = None
+            tokens = 0
+            # Token prompt: llama.cpp skips the prefix the restored state already holds
+            for chunk in self.llm(prompt_tokens, max_tokens=max_tokens, temperature=self.temperature, stop=STOP,
+                                  stream=True):
+                text = chunk['choices'][0]['text']
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                tokens += 1
+                if text:
+                    pieces.append(text)
+                    yield text
+            end = time.perf_counter()
+            if session_id:
+                answer_tokens = self.llm.tokenize("".join(pieces).encode("utf-8"), add_bos=False)
+                self._remember(session_id, prompt_tokens + answer_tokens)
+            draft_after = self.llm.draft_model.stats() if drafting else None
+
+        answer = "".join(pieces).strip()
+        if self.response_cache and answer and reused_tokens == len(self._prefix_tokens):
+            self.response_cache.put(farmer_query, answer, disease_info, weather, shops)
+
+        decode_seconds = end - first_token_at if first_token_at else 0.0
+        stats.update({
+            "cached": False,
+            "ttft_seconds": round((first_token_at or end) - start, 3),
+            "total_seconds": round(end - start, 3),
+            "prompt_tokens": len(prompt_tokens),
+            "reused_tokens": reused_tokens,
+            "tokens": tokens,
+            # The first token's time is prompt processing, so it isn't counted
+            "tokens_per_second": round((tokens - 1) / decode_seconds, 2) if tokens > 1 and decode_seconds else 0.0,
+        })
+        if drafting:
+            proposed = draft_after["proposed"] - draft_before["proposed"]
+            stats["draft_acceptance"] = (
+                round((draft_after["accepted"] - draft_before["accepted"]) / proposed, 3) if proposed else 0.0)
+        print(f"⚡ First token in {stats['ttft_seconds']:.2f}s "
+              f"({reused_tokens}/{len(prompt_tokens)} prompt tokens from cache), "
+              f"{tokens} tokens at {stats['tokens_per_second']:.1f} tokens/s")
+
+    def generate_response(self, farmer_query, disease_info=None, weather=None, shops=None, session_id=None,
+                          max_tokens=512, stats=None):
+        return "".join(self.generate_response_stream(farmer_query, disease_info, weather, shops,
+                                                     max_tokens=max_tokens, session_id=session_id, stats=stats))
+
+    def end_session(self, session_id):
+        """Drop a conversation's cached state."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
@@ -0,0 +1,183 @@
+"""
+speculative.py
+Speculative decoding for the Sinong assistant with a small draft model.
+
+On a CPU, llama.cpp needs about as long to check a handful of tokens
+with the 32B model as to generate one: the time goes into streaming the
+weights from RAM. So a small quantized model with the same tokenizer
+(e.g. a 0.5B-1.5B Qwen2.5 GGUF for the Qwen-based Sinong) guesses the
+next ``num_pred_tokens`` tokens, the main model checks them in one batch,
+and keeps the guesses it would have produced itself plus one token of
+its own. Answers come from the main model as before; the speed-up
+depends on how many guesses are kept (the acceptance rate).
+
+llama-cpp-python runs the verification loop (``Llama(draft_model=...)``);
+DraftModel is the LlamaDraftModel that asks the small model and tracks
+the acceptance rate.
+
+Benchmark: after an untimed warm-up, the same prompts alternate between
+plain and speculative decoding; decode tokens/s (prompt processing
+excluded) and end-to-end tokens/s are reported for both.
+    python speculative.py --draft-model-path models/Sinong/gguf/draft.gguf
+"""
+
+import argparse
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+from llama_cpp.llama_speculative import LlamaDraftModel
+
+from gguf_loader import choose_profile, load_model
+from Leaf_Disease.config import AppConfig
+
+
+class DraftModel(LlamaDraftModel):
+    """
+    Greedy guesses from a small GGUF model.
+
+    The draft keeps its own KV cache and only evaluates tokens it hasn't
+    seen (llama.cpp prefix matching), so a call costs about
+    ``num_pred_tokens`` small-model steps.
+
+    Acceptance is worked out from consecutive calls: during one generation
+    each call's input is the previous input plus the kept guesses and one
+    token from the main model.
+
+    Args:
+        model_path: GGUF file of the draft model.
+        num_pred_tokens: Tokens guessed per step.
+        config: Thread/context settings (shared with the main model).
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 4, config: Optional[AppConfig] = None):
+        profile = choose_profile(model_path, config or AppConfig.from_env(require_api_key=False),
+                                 use_saved=False)
+        self.llm, self.load_report = load_model(profile)
+        self.model_path = profile.model_path
+        self.num_pred_tokens = num_pred_tokens
+        self.proposed = 0
+        self.accepted = 0
+        self._last_input: Optional[np.ndarray] = None
+        self._last_draft: list = []
+
+    def _score_last_draft(self, input_ids: np.ndarray):
+        last = self._last_input
+        if last is None or len(input_ids) <= len(last) or not np.array_equal(input_ids[:len(last)], last):
+            return  # A new generation: the last guesses were never checked
+        kept = 0
+        for guess, actual in zip(self._last_draft, input_ids[len(last):-1]):
+            if guess != actual:
+                break
+            kept += 1
+        self.proposed += len(self._last_draft)
+        self.accepted += kept
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        input_ids = np.asarray(input_ids, dtype=np.intc)
+        self._score_last_draft(input_ids)
+        room = min(self.num_pred_tokens, self.llm.n_ctx() - len(input_ids) - 1)
+        draft = []
+        if room > 0:
+            for token in self.llm.generate(input_ids.tolist(), temp=0.0):
+                draft.append(int(token))
+                if len(draft) >= room:
+                    break
+        self._last_input = input_ids.copy()
+        self._last_draft = draft
+        return np.array(draft, dtype=np.intc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+        }
+
+
+# Typical chat questions, with the diagnosis the app would pass along
+BENCHMARK_PROMPTS = [
+    ("Mere tamatar ke patton pe bhure gol daag hain, kya spray karu?",
+     {"disease_name": "Early Blight", "confidence": 0.91, "severity": "moderate"}),
+    ("Aloo ki fasal mein patte kaale pad rahe hain aur baarish ho rahi hai",
+     {"disease_name": "Late Blight", "confidence": 0.87, "severity": "high"}),
+    ("Gehun ke patton par peeli dhaariyan hain, kitna nuksaan hoga?",
+     {"disease_name": "Yellow Rust", "confidence": 0.78, "severity": "low"}),
+    ("Is bimari se bachne ke liye agli baar kya karu?", None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and speculative decoding on the same prompts")
+    parser.add_argument("--model-path", default=None, help="Main GGUF file (default SINONG_MODEL_PATH)")
+    parser.add_argument("--draft-model-path", default=os.getenv("SINONG_DRAFT_MODEL_PATH"))
+    parser.add_argument("--draft-tokens", type=int, default=4, help="Tokens guessed per step")
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="Timed rounds; each runs every prompt in both modes, alternating which goes first")
+    parser.add_argument("--temperature", type=float, default=0.0,
+                        help="0 makes both runs produce the same text")
+    args = parser.parse_args()
+    if not args.draft_model_path:
+        parser.error("--draft-model-path (or SINONG_DRAFT_MODEL_PATH) is required")
+
+    from sinong_gguf_wrapper import SinongGGUFFarmerAssistant
+
+    assistant = SinongGGUFFarmerAssistant(args.model_path, response_cache=False,
+                                          draft_model_path=args.draft_model_path, draft_tokens=args.draft_tokens)
+    assistant.temperature = args.temperature
+    draft = assistant.draft
+
+    def run(mode, question, diagnosis):
+        assistant.llm.draft_model = draft if mode == "speculative" else None
+        stats = {}
+        assistant.generate_response(question, diagnosis, max_tokens=args.max_tokens, stats=stats)
+        return stats
+
+    # Untimed: pages the mmapped weights in and warms both models' caches
+    for mode in ("plain", "speculative"):
+        run(mode, *BENCHMARK_PROMPTS[0])
+
+    totals = {mode: {"tokens": 0, "decode_seconds": 0.0, "total_seconds": 0.0, "proposed": 0, "accepted": 0}
+              for mode in ("plain", "speculative")}
+    for round_number in range(args.rounds):
+        for i, (question, diagnosis) in enumerate(BENCHMARK_PROMPTS):
+            # Alternate the order so neither mode always runs on a warmer machine
+            order = ("plain", "speculative") if (round_number + i) % 2 == 0 else ("speculative", "plain")
+            for mode in order:
+                before = draft.stats()
+                stats = run(mode, question, diagnosis)
+                after = draft.stats()
+                total = totals[mode]
+                total["tokens"] += stats["tokens"]
+                total["total_seconds"] += stats["total_seconds"]
+                # Decode time only: prompt processing is the same work in both modes
+                if stats["tokens_per_second"]:
+                    total["decode_seconds"] += (stats["tokens"] - 1) / stats["tokens_per_second"]
+                total["proposed"] += after["proposed"] - before["proposed"]
+                total["accepted"] += after["accepted"] - before["accepted"]
+
+    results = {}
+    for mode, total in totals.items():
+        decode_tokens = total["tokens"] - args.rounds * len(BENCHMARK_PROMPTS)
+        results[mode] = {
+            "tokens": total["tokens"],
+            "decode_tokens_per_second": round(decode_tokens / total["decode_seconds"], 2)
+            if total["decode_seconds"] else 0.0,
+            "end_to_end_tokens_per_second": round(total["tokens"] / total["total_seconds"], 2)
+            if total["total_seconds"] else 0.0,
+            "acceptance_rate": round(total["accepted"] / total["proposed"], 3) if total["proposed"] else None,
+        }
+        print(f"{mode:<12} {total['tokens']:>6} tokens: decode {results[mode]['decode_tokens_per_second']:>7.2f} "
+              f"tokens/s, end-to-end {results[mode]['end_to_end_tokens_per_second']:>7.2f} tokens/s"
+              + (f", {results[mode]['acceptance_rate']:.0%} of guesses kept" if total["proposed"] else ""))
+
+    plain, speculative = results["plain"], results["speculative"]
+    if plain["decode_tokens_per_second"] and plain["end_to_end_tokens_per_second"]:
+        decode = speculative["decode_tokens_per_second"] / plain["decode_tokens_per_second"]
+        end_to_end = speculative["end_to_end_tokens_per_second"] / plain["end_to_end_tokens_per_second"]
+        print(f"🚀 Speculative decoding: {decode:.2f}x decode, {end_to_end:.2f}x end-to-end "
+              f"({args.rounds} x {len(BENCHMARK_PROMPTS)} prompts, {args.draft_tokens} guesses per step)")
+
+if __name__ == "__main__":
+    main()
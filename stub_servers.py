@@ -0,0 +1,315 @@
+"""
+stub_servers.py
+Stand-in backends for load tests: a detector with fixed latency, a fake
+Plant.id server and a fake wttr.in.
+
+``StubDetector`` is selected with ``DETECTOR_BACKEND=stub``. It sleeps for
+``STUB_LATENCY_MS`` per image instead of running a model, so a load test
+measures the API (uploads, queueing, admission, serialization) at a known
+model cost without TensorFlow or real images.
+
+``StubPlantIdServer`` answers the Plant.id v3 identification endpoint
+with canned results after a configurable delay and error rate, so nothing
+is billed and outages can be rehearsed.
+
+``StubWeatherServer`` answers wttr.in's ``format=j1`` requests with a
+3-day forecast derived from the location name.
+
+Usage:
+    python stub_servers.py plant-id --port 8090 --latency-ms 400 --error-rate 0.05
+    python stub_servers.py weather --port 8091 --latency-ms 300
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import unquote, urlsplit
+
+from Leaf_Disease.main import LeafDiseaseDetector
+from Leaf_Disease.metrics import STAGE_SECONDS
+
+
+class StubDetector:
+    """
+    Detector with the LeafDiseaseDetector interface that only sleeps.
+
+    The result (disease and a confidence between 0.5 and 0.99) is picked
+    from the image's hash, so the same image always gets the same answer,
+    and uses the lightweight detector's knowledge base so compact
+    responses work as usual.
+
+    Args:
+        latency: Seconds per image.
+        jitter: Extra random delay, up to this many seconds.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self._reference = LeafDiseaseDetector()
+        self._keys = list(self._reference.diseases)
+
+    def _delay(self, max_side=None) -> float:
+        delay = self.latency + random.random() * self.jitter
+        return delay / 4 if max_side else delay  # Downscaled input is cheaper
+
+    def analyze_leaf_image_bytes(self, image_bytes, max_side=None) -> Dict[str, Any]:
+        data = image_bytes.read() if hasattr(image_bytes, "read") else image_bytes
+        with STAGE_SECONDS.time(stage="inference"):
+            time.sleep(self._delay(max_side))
+        digest = hashlib.sha256(data).digest()
+        key = self._keys[digest[0] % len(self._keys)]
+        return {
+            "disease_detected": key != "healthy",
+            "disease_id": key,
+            "confidence": round(0.5 + digest[1] / 255 * 0.49, 2),  # Spread for confidence routing
+            **self._reference._disease_info(key),
+        }
+
+    def analyze_leaf_images_bytes(self, images_bytes, max_side=None):
+        return [self.analyze_leaf_image_bytes(image_bytes, max_side) for image_bytes in images_bytes]
+
+    def knowledge_base(self) -> Dict[str, Any]:
+        return self._reference.knowledge_base()
+
+
+# Canned Plant.id disease suggestions (name, type, probability)
+STUB_DISEASES = (
+    ("Early blight", "fungus", 0.87),
+    ("Late blight", "oomycete", 0.74),
+    ("Powdery mildew", "fungus", 0.66),
+    ("Bacterial leaf spot", "bacteria", 0.58),
+    ("Mosaic virus", "virus", 0.42),
+)
+
+
+def stub_identification(body: bytes) -> Dict[str, Any]:
+    """A Plant.id v3 identification response; the same request gets the same answer."""
+    seed = hashlib.sha256(body).digest()[0]
+    suggestions = []
+    for offset in range(3):
+        name, kind, probability = STUB_DISEASES[(seed + offset) % len(STUB_DISEASES)]
+        suggestions.append({
+            "id": hashlib.md5(name.encode()).hexdigest()[:16],
+            "name": name,
+            "probability": round(probability / (offset + 1), 4),
+            "similar_images": [],
+            "details": {
+                "language": "en",
+                "type": kind,
+                "symptoms": {"localized": ["Spots on leaves", "Yellowing", "Leaf drop"]},
+                "treatment": {
+                    "biological": f"Biological control for {name.lower()}",
+                    "chemical": f"Registered fungicide for {name.lower()}",
+                    "prevention": "Rotate crops and remove infected debris",
+                },
+            },
+        })
+    now = time.time()
+    return {
+        "access_token": uuid.uuid4().hex,
+        "model_version": "plant_id:stub",
+        "custom_id": None,
+        "input": {"similar_images": True},
+        "result": {
+            "is_plant": {"probability": 0.99, "threshold": 0.5, "binary": True},
+            "is_healthy": {"probability": 0.1, "threshold": 0.525, "binary": False},
+            "disease": {"suggestions": suggestions},
+        },
+        "status": "COMPLETED",
+        "sla_compliant_client": True,
+        "sla_compliant_system": True,
+        "created": now,
+        "completed": now,
+    }
+
+
+class StubPlantIdServer:
+    """
+    Threaded HTTP server imitating the Plant.id v3 API.
+
+    Requests without an Api-Key header get 401. ``error_rate`` of the
+    requests fail with 500 or 429 (with Retry-After) to exercise retries
+    and circuit breaking.
+
+    Args:
+        host: Interface to bind.
+        port: Port to bind (0 picks a free one).
+        latency: Seconds before each answer.
+        error_rate: Fraction of requests that fail (0-1).
+    """
+
+    PATHS = ("/api/v3/identification", "/api/v3/health_assessment")
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8090,
+                 latency: float = 0.4, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with server._lock:
+                    server.requests += 1
+                if self.path.split("?")[0] not in server.PATHS:
+                    return self._reply(404, {"error": "Not found"})
+                if not self.headers.get("Api-Key"):
+                    return self._reply(401, {"error": "Missing Api-Key header"})
+                time.sleep(server.latency)
+                if random.random() < server.error_rate:
+                    with server._lock:
+                        server.failures += 1
+                    if random.random() < 0.5:
+                        return self._reply(429, {"error": "Too many requests"}, {"Retry-After": "1"})
+                    return self._reply(500, {"error": "Internal server error"})
+                self._reply(201, stub_identification(body))
+
+            def _reply(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client gave up (timed out or cancelled)
+
+            def log_message(self, format, *args):
+                pass  # Quiet under load
+
+        return Handler
+
+    def start(self) -> "StubPlantIdServer":
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def stub_weather(location: str) -> Dict[str, Any]:
+    """A wttr.in j1 document; the same location always gets the same weather."""
+    rng = random.Random(hashlib.sha256(location.casefold().encode()).digest())
+    base_temp, base_humidity = rng.uniform(18, 34), rng.uniform(45, 95)
+    conditions = ("Sunny", "Partly cloudy", "Overcast", "Light rain shower", "Mist")
+    days = []
+    for offset in range(3):
+        hourly = []
+        for hour in range(0, 24, 3):
+            swing = -5 if hour < 6 or hour >= 21 else (5 if 12 <= hour <= 15 else 0)
+            rain = rng.random() < 0.25
+            hourly.append({
+                "time": str(hour * 100),
+                "tempC": str(round(base_temp + swing + rng.uniform(-2, 2))),
+                "humidity": str(min(100, round(base_humidity - swing * 2 + (15 if rain else 0)))),
+                "precipMM": f"{rng.uniform(0.5, 6) if rain else 0.0:.1f}",
+                "chanceofrain": str(rng.randint(60, 95) if rain else rng.randint(0, 30)),
+                "weatherDesc": [{"value": "Light rain" if rain else rng.choice(conditions[:3])}],
+            })
+        days.append({"date": (date.today() + timedelta(days=offset)).isoformat(), "hourly": hourly})
+    now = days[0]["hourly"][4]
+    return {
+        "current_condition": [{
+            "temp_C": now["tempC"],
+            "humidity": now["humidity"],
+            "windspeedKmph": str(rng.randint(2, 25)),
+            "winddir16Point": rng.choice(("N", "NE", "E", "SE", "S", "SW", "W", "NW")),
+            "precipMM": now["precipMM"],
+            "localObsDateTime": datetime.now().strftime("%Y-%m-%d %I:%M %p"),
+            "weatherDesc": [{"value": rng.choice(conditions)}],
+        }],
+        "nearest_area": [{"areaName": [{"value": location}]}],
+        "weather": days,
+    }
+
+
+class StubWeatherServer(StubPlantIdServer):
+    """
+    Threaded HTTP server imitating wttr.in's JSON format: ``GET /<location>?format=j1``.
+
+    Args:
+        host: Interface to bind.
+        port: Port to bind (0 picks a free one).
+        latency: Seconds before each answer.
+        error_rate: Fraction of requests answered with 503 (0-1).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8091,
+                 latency: float = 0.3, error_rate: float = 0.0):
+        super().__init__(host, port, latency, error_rate)
+
+    def _handler(self):
+        server = self
+        Base = super()._handler()
+
+        class Handler(Base):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                location = unquote(urlsplit(self.path).path.strip("/"))
+                if not location:
+                    return self._reply(404, {"error": "Location required"})
+                time.sleep(server.latency)
+                if random.random() < server.error_rate:
+                    with server._lock:
+                        server.failures += 1
+                    return self._reply(503, {"error": "Service unavailable"})
+                self._reply(200, stub_weather(location))
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in backends for load tests")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help, port, latency_ms in (("plant-id", "Serve a fake Plant.id v3 API", 8090, 400.0),
+                                         ("weather", "Serve a fake wttr.in (format=j1)", 8091, 300.0)):
+        command = sub.add_parser(name, help=help)
+        command.add_argument("--host", default="127.0.0.1")
+        command.add_argument("--port", type=int, default=port)
+        command.add_argument("--latency-ms", type=float, default=latency_ms)
+        command.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server_class = StubPlantIdServer if args.command == "plant-id" else StubWeatherServer
+    server = server_class(args.host, args.port, args.latency_ms / 1000, args.error_rate)
+    label = "Plant.id API" if args.command == "plant-id" else "wttr.in"
+    print(f"🌱 Stub {label} on {server.base_url} "
+          f"({args.latency_ms:.0f} ms, {args.error_rate:.0%} errors)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+uploads.py
+Size limits and format checks for image uploads to the API.
+
+Starlette's multipart parser already streams each file part in chunks into a
+SpooledTemporaryFile (kept in RAM up to ``spool_max_size``, then moved to
+disk). The pieces here add the missing guard rails around it:
+
+* ``UploadLimitMiddleware`` rejects a request from its Content-Length header
+  before the body is read, and stops a chunked body as soon as it exceeds the
+  limit, so an oversized upload never fills RAM or disk.
+* ``validate_image_upload`` checks the stored size and sniffs the first bytes
+  (magic number) against ``AppConfig.supported_formats``.
+
+Detectors then decode straight from ``UploadFile.file`` with no extra copy.
+"""
+
+import hashlib
+from typing import Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+# Leading bytes of each image format -> file extension used in supported_formats
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"BM", ".bmp"),
+    (b"II*\x00", ".tiff"),
+    (b"MM\x00*", ".tiff"),
+)
+SNIFF_BYTES = 12
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Return the extension matching the image's magic number, or None."""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def check_image_head(head: bytes, supported_formats: tuple, name: str = "upload"):
+    """Raise 415 unless ``head`` starts like one of the supported formats."""
+    image_format = sniff_image_format(head)
+    if image_format is None or image_format not in supported_formats:
+        raise HTTPException(
+            status_code=415,
+            detail=f"{name} is not a supported image ({', '.join(supported_formats)})"
+        )
+    return image_format
+
+
+async def validate_image_upload(upload: UploadFile, max_bytes: int, supported_formats: tuple) -> str:
+    """
+    Check one uploaded image before it reaches a detector.
+
+    Rejects files over ``max_bytes`` (413) and files whose first bytes don't
+    match a supported format (415). Leaves the file positioned at the start
+    so ``upload.file`` can be handed to a detector as-is.
+
+    Returns:
+        The sniffed file extension, e.g. ".jpg".
+    """
+    name = upload.filename or "upload"
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{name} is larger than {max_bytes // (1024 * 1024)} MB"
+        )
+
+    await upload.seek(0)
+    head = await upload.read(SNIFF_BYTES)
+    await upload.seek(0)
+    return check_image_head(head, supported_formats, name)
+
+
+def hash_file(fileobj, chunk_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a binary file object, read in chunks from the start.
+    Leaves the file positioned at the start again.
+    """
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware capping the request body size per path.
+
+    Args:
+        app: The wrapped ASGI application.
+        limits: Mapping of request path to maximum body size in bytes.
+            Paths not listed are passed through untouched.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Reject early from the header, before any body byte is read
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(
+                status_code=413,
+                content={"detail": f"Request body larger than {limit} bytes"}
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            # Chunked uploads have no Content-Length: count as the body arrives
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Request body larger than {limit} bytes"
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
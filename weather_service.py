@@ -0,0 +1,262 @@
+"""
+weather_service.py
+Cached weather lookups from wttr.in.
+
+Weather barely changes minute to minute and many farmers in a district ask
+about the same town, so results are cached per location for
+``ttl_seconds``, in memory and in a small SQLite file that survives
+restarts. All requests share one pooled ``requests.Session`` (no new TLS
+handshake per click), concurrent lookups of the same location wait for a
+single fetch, and ``get_many`` fetches a list of villages in parallel.
+
+wttr.in is asked for its JSON format (``format=j1``) instead of a one-line
+text format split on whitespace. Besides the current conditions the result
+keeps the 3-day, 3-hourly forecast used for disease risk. If a fetch
+fails, an expired entry up to ``stale_seconds`` old is returned marked
+``stale`` rather than nothing.
+
+Configuration: WEATHER_BASE_URL, WEATHER_TTL_SECONDS and
+WEATHER_CACHE_PATH ("off" keeps the cache in memory only). For tests,
+``python stub_servers.py weather`` serves canned wttr.in answers.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from Leaf_Disease.metrics import CACHE_REQUESTS
+
+WEATHER_BASE_URL = "https://wttr.in"
+
+
+def normalize_location(location: str) -> str:
+    """Cache key for a place name: "  New  Delhi " and "new delhi" are the same town."""
+    return " ".join(location.split()).casefold()
+
+
+def parse_wttr(data: Dict[str, Any], location: str) -> Dict[str, Any]:
+    """
+    wttr.in j1 response -> the app's weather dict.
+
+    The display fields (temperature, humidity, wind, condition) keep the
+    strings the sidebar showed before; the numeric ones and ``hourly``
+    are for calculations.
+    """
+    current = data["current_condition"][0]
+    condition = (current.get("weatherDesc") or [{}])[0].get("value", "").strip()
+    temp_c = float(current["temp_C"])
+    humidity = float(current["humidity"])
+    wind_kmph = float(current["windspeedKmph"])
+    try:
+        # The location's clock, which may differ from the server's
+        local_time = datetime.strptime(current["localObsDateTime"], "%Y-%m-%d %I:%M %p").strftime("%Y-%m-%d %H:%M")
+    except (KeyError, ValueError):
+        local_time = None
+    hourly = []
+    for day in data.get("weather", []):
+        for hour in day.get("hourly", []):
+            hourly.append({
+                "time": f"{day['date']} {int(hour['time']) // 100:02d}:00",
+                "temp_c": float(hour["tempC"]),
+                "humidity": float(hour["humidity"]),
+                "precip_mm": float(hour.get("precipMM", 0.0)),
+                "chance_of_rain": float(hour.get("chanceofrain", 0.0)),
+            })
+    return {
+        "location": location,
+        "temperature": f"{temp_c:+.0f}°C",
+        "humidity": f"{humidity:.0f}%",
+        "wind": f"{current.get('winddir16Point', '')} {wind_kmph:.0f}km/h".strip(),
+        "condition": condition,
+        "temp_c": temp_c,
+        "humidity_pct": humidity,
+        "wind_kmph": wind_kmph,
+        "precip_mm": float(current.get("precipMM", 0.0)),
+        "local_time": local_time,
+        "hourly": hourly,
+        "fetched_at": time.time(),
+    }
+
+
+def upcoming_hours(weather: Dict[str, Any], hours: int = 24,
+                   now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Forecast samples from the current one on, covering the next ``hours``.
+
+    ``now`` defaults to the location's local time from the report (else
+    this machine's clock); a sample counts until the next one starts.
+    """
+    samples = [(datetime.strptime(hour["time"], "%Y-%m-%d %H:%M"), hour) for hour in weather.get("hourly", [])]
+    if not samples:
+        return []
+    if now is None:
+        local_time = weather.get("local_time")
+        now = datetime.strptime(local_time, "%Y-%m-%d %H:%M") if local_time else datetime.now()
+    step = samples[1][0] - samples[0][0] if len(samples) > 1 else timedelta(hours=3)
+    end = now + timedelta(hours=hours)
+    return [hour for start, hour in samples if start + step > now and start < end]
+
+
+class WeatherService:
+    """
+    wttr.in client with a per-location TTL cache.
+
+    Thread-safe; one instance is meant to be shared by the whole process
+    (see get_weather_service).
+
+    Args:
+        base_url: wttr.in or a compatible server (e.g. the stub).
+        ttl_seconds: How long a location's weather is served from cache.
+        stale_seconds: How old an entry may be and still be served when
+            fetching fails.
+        cache_path: SQLite file for the disk cache; None keeps it in memory.
+        timeout: Seconds per HTTP request.
+        max_workers: Parallel fetches in get_many (and pooled connections).
+    """
+
+    def __init__(self, base_url: Optional[str] = None, ttl_seconds: int = 1800,
+                 stale_seconds: int = 6 * 3600, cache_path: Optional[str] = "weather_cache.sqlite3",
+                 timeout: float = 5.0, max_workers: int = 8):
+        self.base_url = (base_url or os.getenv("WEATHER_BASE_URL", WEATHER_BASE_URL)).rstrip("/")
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.timeout = timeout
+        self.max_workers = max(1, max_workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "kisaan-saathi/1.0"
+
+        self._memory: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._fetching: Dict[str, threading.Event] = {}
+        self._conn = None
+        if cache_path:
+            self._conn = sqlite3.connect(cache_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS weather (
+                    location TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            """)
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        """Newest known entry for a location (any age), memory first."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT value FROM weather WHERE location = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = self._memory[key] = json.loads(row[0])
+        return entry
+
+    def _store(self, key: str, weather: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = weather
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO weather (location, value, fetched_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(weather, ensure_ascii=False), weather["fetched_at"]),
+                )
+
+    def fetch(self, location: str) -> Dict[str, Any]:
+        """
+        Current weather and forecast straight from the server (no cache).
+
+        Raises:
+            requests.RequestException: On network errors and non-2xx answers.
+            ValueError: If the answer isn't a wttr.in j1 document.
+        """
+        response = self.session.get(
+            f"{self.base_url}/{requests.utils.quote(location)}",
+            params={"format": "j1"},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        try:
+            return parse_wttr(response.json(), location)
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"Unexpected weather response for {location!r}: {e!r}") from e
+
+    def get(self, location: str) -> Optional[Dict[str, Any]]:
+        """Weather for a location from cache or server; None if unavailable."""
+        key = normalize_location(location)
+        if not key:
+            return None
+        while True:
+            entry = self._cached(key)
+            if entry is not None and time.time() - entry["fetched_at"] < self.ttl_seconds:
+                CACHE_REQUESTS.inc(cache="weather", result="hit")
+                return entry
+            # Only one thread fetches a location; the others wait for its result
+            with self._lock:
+                event = self._fetching.get(key)
+                if event is None:
+                    event = self._fetching[key] = threading.Event()
+                    break
+            event.wait(self.timeout + 1)
+            if key not in self._fetching:
+                fresh = self._cached(key)
+                if fresh is not None and fresh is not entry:
+                    CACHE_REQUESTS.inc(cache="weather", result="hit")
+                    return fresh
+                return self._stale(entry)
+
+        CACHE_REQUESTS.inc(cache="weather", result="miss")
+        try:
+            weather = self.fetch(location)
+            self._store(key, weather)
+            return weather
+        except (requests.RequestException, ValueError) as e:
+            print(f"⚠️ Weather fetch failed for {location!r}: {e}")
+            return self._stale(entry)
+        finally:
+            with self._lock:
+                self._fetching.pop(key, None)
+            event.set()
+
+    def _stale(self, entry: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if entry is not None and time.time() - entry["fetched_at"] < self.stale_seconds:
+            return dict(entry, stale=True)
+        return None
+
+    def get_many(self, locations: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Weather for many villages at once, fetched in parallel; keyed by the given names."""
+        unique = list(dict.fromkeys(locations))
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique) or 1)) as pool:
+            return dict(zip(unique, pool.map(self.get, unique)))
+
+    def close(self):
+        self.session.close()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_weather_service: Optional[WeatherService] = None
+_weather_service_lock = threading.Lock()
+
+
+def get_weather_service() -> WeatherService:
+    """Process-wide WeatherService configured from the environment."""
+    global _weather_service
+    with _weather_service_lock:
+        if _weather_service is None:
+            cache_path = os.getenv("WEATHER_CACHE_PATH", "weather_cache.sqlite3")
+            _weather_service = WeatherService(
+                ttl_seconds=int(os.getenv("WEATHER_TTL_SECONDS", 1800)),
+                cache_path=None if cache_path.lower() == "off" else cache_path,
+            )
+        return _weather_service